@@ -0,0 +1,377 @@
+"""
+Frame-by-frame animation of a canvas.
+
+A Timeline calls an update function once per frame; the function moves
+or restyles shapes through their usual attributes (circle.x = ...). The
+timeline watches the canvas store to see which shapes changed. Those
+shapes become "moving": they are drawn as one animated collection on top
+of a cached image of everything else, so a frame only restores the
+cached background and redraws the moving shapes (blitting). The
+background is redrawn only when a shape that was static so far changes,
+or shapes are added or removed.
+
+Frames are streamed to a writer one at a time and never collected:
+
+    def update(frame):
+        ball.x = 10 + 5 * frame
+
+    canvas.animate('ball.gif', update, frames=120, fps=30)
+
+Outputs ending in .gif are written by GIFWriter, .mp4/.webm/.mkv/.mov
+by piping raw frames into ffmpeg, and a directory or a pattern such as
+'frames/{:05d}.png' gets one PNG per frame.
+"""
+import io
+import os
+import shutil
+import subprocess
+import time
+
+import numpy as np
+
+from Raster import write_png
+
+VIDEO_EXTENSIONS = ('.mp4', '.webm', '.mkv', '.mov')
+
+
+class Timeline:
+    """Renders the frames of an animated canvas, blitting the moving shapes."""
+
+    def __init__(self, canvas, update, frames, fps=30, moving=(), batched=True):
+        """
+        Initialize a Timeline.
+
+        Args:
+            canvas: The Canvas (or text Canvas) to animate
+            update: Function called with each frame value before that frame
+                is drawn; it changes the shapes of the canvas
+            frames: Number of frames, or an iterable of frame values
+            fps: Frames per second of saved animations (default: 30)
+            moving: Shapes known to move, so the first background already
+                leaves them out (default: none, detected as they change)
+            batched: Draw the static shapes as one collection (default: True)
+        """
+        self.canvas = canvas
+        self.update = update
+        self.frames = range(frames) if isinstance(frames, int) else frames
+        self.fps = fps
+        self.batched = batched
+        self.moving = {shape.row for shape in moving}
+        # Counters, for checking that blitting is effective
+        self.rendered = 0
+        self.backgrounds = 0
+        self.seconds = 0.0
+        self._stale = True
+        self._fig = None
+        self._ax = None
+        self._background = None
+        self._collection = None
+
+    # Store observer interface
+
+    def shape_added(self, row):
+        # Rows are reused, so a new shape must not inherit "moving" from a
+        # shape that held its row before
+        self.moving.discard(row)
+        self._stale = True
+
+    def shape_removed(self, row):
+        self.moving.discard(row)
+        self._stale = True
+
+    def shape_changed(self, row):
+        if row not in self.moving:
+            # A shape that was part of the background starts to move
+            self.moving.add(row)
+            self._stale = True
+
+    def store_cleared(self):
+        self.moving.clear()
+        self._stale = True
+
+    # Rendering
+
+    def _figure(self):
+        if self._fig is None:
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            from matplotlib.figure import Figure
+            self._fig = Figure()
+            FigureCanvasAgg(self._fig)
+        return self._fig
+
+    def _moving_rows(self):
+        store = self.canvas.store
+        rows = np.fromiter(self.moving, dtype=np.intp, count=len(self.moving))
+        return store.sort_by_order(rows[store.alive[rows]])
+
+    def _draw_background(self):
+        """Draw everything except the moving shapes and cache the pixels."""
+        from Render import shape_collection, store_arrays
+
+        store = self.canvas.store
+        rows = store.rows()
+        static = rows[~np.isin(rows, self._moving_rows())]
+        fig = self._figure()
+        self._ax = self.canvas.render_figure(fig, self.batched, reuse=True, rows=static)
+        self._collection = shape_collection(store_arrays(store, self._moving_rows()),
+                                            self._ax.transData)
+        # Animated artists are skipped by a normal draw and drawn by hand
+        self._collection.set_animated(True)
+        self._ax.add_collection(self._collection, autolim=False)
+        fig.canvas.draw()
+        self._background = fig.canvas.copy_from_bbox(fig.bbox)
+        self._stale = False
+        self.backgrounds += 1
+
+    def _draw_moving(self):
+        """Restore the background and draw the moving shapes at their new places."""
+        from Render import shape_paths, store_arrays
+
+        fig = self._fig
+        fig.canvas.restore_region(self._background)
+        arrays = store_arrays(self.canvas.store, self._moving_rows())
+        collection = self._collection
+        collection.set_paths(shape_paths(arrays['is_circle'], arrays['x'], arrays['y'],
+                                         arrays['width'], arrays['height']))
+        collection.set_facecolor(arrays['fill'])
+        collection.set_edgecolor(arrays['stroke'])
+        collection.set_linewidth(arrays['stroke_width'])
+        self._ax.draw_artist(collection)
+
+    def render(self, frame):
+        """
+        Apply the update for one frame value and draw the frame.
+
+        Returns:
+            The frame as a uint8 (height, width, 4) RGBA array. It is a view
+            of the figure's pixels, valid until the next frame is drawn.
+        """
+        store = self.canvas.store
+        store.observers.append(self)
+        try:
+            self.update(frame)
+        finally:
+            store.observers.remove(self)
+        start = time.perf_counter()
+        if self._stale:
+            self._draw_background()
+        self._draw_moving()
+        self.seconds += time.perf_counter() - start
+        self.rendered += 1
+        return np.asarray(self._fig.canvas.buffer_rgba())
+
+    def __iter__(self):
+        """Render every frame in turn, yielding each one as render() returns it."""
+        for frame in self.frames:
+            yield self.render(frame)
+
+    def save(self, output, **options):
+        """
+        Stream every frame to a file or a sequence of files.
+
+        Args:
+            output: A .gif or video file, a directory or a file name pattern
+                such as 'frames/{:05d}.png'
+            options: Passed on to the writer, e.g. compression=1 for PNGs
+
+        Returns:
+            The number of frames written
+        """
+        written = 0
+        with open_writer(output, self.fps, **options) as writer:
+            for image in self:
+                writer.write(image)
+                written += 1
+        return written
+
+    def close(self):
+        """Free the figure."""
+        if self._fig is not None:
+            self._fig.clf()
+            self._fig = None
+            self._background = None
+            self._collection = None
+        self._stale = True
+
+    def __str__(self):
+        fps = self.rendered / self.seconds if self.seconds else 0.0
+        return (f"Timeline(frames={self.rendered}, backgrounds={self.backgrounds}, "
+                f"moving={len(self.moving)}, {fps:.0f} frames/s)")
+
+
+def open_writer(output, fps=30, **options):
+    """Return a frame writer chosen by the kind of output (see the module docstring)."""
+    path = os.fspath(output)
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.gif':
+        return GIFWriter(path, fps, **options)
+    if extension in VIDEO_EXTENSIONS:
+        return FFmpegWriter(path, fps, **options)
+    if '{' in path or extension == '.png':
+        return PNGSequenceWriter(path, **options)
+    return PNGSequenceWriter(os.path.join(path, 'frame_{:05d}.png'), **options)
+
+
+class _FrameWriter:
+    """Base class of the frame writers: a context manager with write() and close()."""
+
+    def write(self, rgba):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PNGSequenceWriter(_FrameWriter):
+    """Writes each frame to its own PNG file."""
+
+    def __init__(self, pattern, compression=6):
+        """
+        Initialize a PNGSequenceWriter.
+
+        Args:
+            pattern: File name with a format field for the frame number,
+                such as 'frames/{:05d}.png'; the directory is created
+            compression: zlib compression level 0-9 (default: 6)
+        """
+        if '{' not in pattern:
+            root, extension = os.path.splitext(pattern)
+            pattern = root + '_{:05d}' + extension
+        self.pattern = pattern
+        self.compression = compression
+        self.frames = 0
+        directory = os.path.dirname(pattern.format(0))
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, rgba):
+        write_png(self.pattern.format(self.frames), rgba, self.compression)
+        self.frames += 1
+
+
+class FFmpegWriter(_FrameWriter):
+    """Pipes raw frames into an ffmpeg process, which encodes the video."""
+
+    def __init__(self, path, fps=30, codec='libx264', ffmpeg='ffmpeg', extra_args=()):
+        """
+        Initialize an FFmpegWriter. ffmpeg is started on the first frame,
+        when the frame size is known.
+
+        Args:
+            path: The video file to write
+            fps: Frames per second (default: 30)
+            codec: ffmpeg video codec (default: 'libx264')
+            ffmpeg: Name or path of the ffmpeg program (default: 'ffmpeg')
+            extra_args: More ffmpeg output options
+
+        Raises:
+            RuntimeError: If ffmpeg cannot be found
+        """
+        self.program = shutil.which(ffmpeg)
+        if self.program is None:
+            raise RuntimeError(f"{ffmpeg} was not found; install it, or save a .gif "
+                               "or PNG sequence instead")
+        self.path = path
+        self.fps = fps
+        self.codec = codec
+        self.extra_args = list(extra_args)
+        self.frames = 0
+        self._process = None
+
+    def _start(self, width, height):
+        command = [self.program, '-loglevel', 'error', '-y',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', f'{width}x{height}',
+                   '-r', str(self.fps), '-i', '-',
+                   # Common codecs need even frame sizes
+                   '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+                   '-c:v', self.codec, '-pix_fmt', 'yuv420p', *self.extra_args, self.path]
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, rgba):
+        if self._process is None:
+            self._start(rgba.shape[1], rgba.shape[0])
+        self._process.stdin.write(np.ascontiguousarray(rgba).data)
+        self.frames += 1
+
+    def close(self):
+        if self._process is None:
+            return
+        self._process.stdin.close()
+        if self._process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed with exit code {self._process.returncode}")
+        self._process = None
+
+
+class GIFWriter(_FrameWriter):
+    """
+    Writes an animated GIF frame by frame.
+
+    Pillow encodes each frame as a single-image GIF with its own palette;
+    the image blocks are then copied into the output file, each with a
+    local palette, so earlier frames do not have to be kept in memory.
+    """
+
+    def __init__(self, path, fps=30, loop=0, colors=256):
+        """
+        Initialize a GIFWriter.
+
+        Args:
+            path: The GIF file to write
+            fps: Frames per second; GIF delays are in hundredths of a second
+                (default: 30)
+            loop: Number of times to play, 0 for forever (default: 0)
+            colors: Palette size of each frame, at most 256 (default: 256)
+        """
+        self.file = open(path, 'wb')
+        self.delay = max(int(round(100 / fps)), 1)
+        self.loop = loop
+        self.colors = colors
+        self.frames = 0
+
+    def write(self, rgba):
+        from PIL import Image
+
+        image = Image.fromarray(np.ascontiguousarray(rgba[..., :3]))
+        image = image.convert('P', palette=Image.Palette.ADAPTIVE, colors=self.colors)
+        buffer = io.BytesIO()
+        image.save(buffer, format='GIF')
+        data = buffer.getvalue()
+
+        flags = data[10]
+        table_size = 3 << ((flags & 7) + 1) if flags & 0x80 else 0
+        table = data[13:13 + table_size]
+        if self.frames == 0:
+            # Header and screen descriptor without a global palette, then
+            # the NETSCAPE extension that makes the animation loop
+            self.file.write(b'GIF89a' + data[6:10] + b'\x00\x00\x00')
+            self.file.write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01'
+                            + self.loop.to_bytes(2, 'little') + b'\x00')
+        # Graphic control extension with the frame delay
+        self.file.write(b'\x21\xf9\x04\x00' + self.delay.to_bytes(2, 'little') + b'\x00\x00')
+        position = 13 + table_size
+        while data[position] == 0x21:  # Skip Pillow's own extensions
+            position += 2
+            while data[position]:
+                position += data[position] + 1
+            position += 1
+        if data[position] != 0x2c:
+            raise ValueError("Unexpected GIF data from Pillow")
+        descriptor = bytearray(data[position:position + 10])
+        # Turn the global palette into a local palette of this frame
+        descriptor[9] = (descriptor[9] & 0x40) | (0x80 | (flags & 7) if table_size else 0)
+        end = data.rindex(b'\x3b')
+        self.file.write(bytes(descriptor) + table + data[position + 10:end])
+        self.frames += 1
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.frames:
+            self.file.write(b'\x3b')
+        self.file.close()
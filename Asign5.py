@@ -1,10 +1,10 @@
-import math
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
+from Shapes import Circle as ShapeCircle, Rectangle as ShapeRectangle
 
-class Circle:
+class Circle(ShapeCircle):
     """A class to represent a circle with graphical attributes."""
     
+    __slots__ = ()
+    
     def __init__(self, radius, fill='blue', stroke='black', stroke_width=2):
         """
         Initialize a Circle with radius and graphical attributes.
@@ -15,31 +15,18 @@ class Circle:
             stroke: Color of the boundary line (default: 'black')
             stroke_width: Width of the boundary line (default: 2)
         """
-        self.radius = radius
-        self.fill = fill
-        self.stroke = stroke
-        self.stroke_width = stroke_width
-    
-    def area(self):
-        """Calculate and return the area of the circle."""
-        return math.pi * self.radius ** 2
-    
-    def circumference(self):
-        """Calculate and return the circumference of the circle."""
-        return 2 * math.pi * self.radius
-    
-    def diameter(self):
-        """Calculate and return the diameter of the circle."""
-        return 2 * self.radius
+        super().__init__(radius, fill=fill, stroke=stroke, stroke_width=stroke_width)
     
     def __str__(self):
         """String representation of the Circle."""
         return f"Circle(radius={self.radius}, fill={self.fill}, stroke={self.stroke})"
 
 
-class Rectangle:
+class Rectangle(ShapeRectangle):
     """A class to represent a rectangle with graphical attributes."""
     
+    __slots__ = ()
+    
     def __init__(self, width, height, fill='red', stroke='black', stroke_width=2):
         """
         Initialize a Rectangle with width, height and graphical attributes.
@@ -51,70 +38,43 @@ class Rectangle:
             stroke: Color of the boundary line (default: 'black')
             stroke_width: Width of the boundary line (default: 2)
         """
-        self.width = width
-        self.height = height
-        self.fill = fill
-        self.stroke = stroke
-        self.stroke_width = stroke_width
-    
-    def area(self):
-        """Calculate and return the area of the rectangle."""
-        return self.width * self.height
-    
-    def perimeter(self):
-        """Calculate and return the perimeter of the rectangle."""
-        return 2 * (self.width + self.height)
-    
-    def diagonal(self):
-        """Calculate and return the diagonal of the rectangle."""
-        return math.sqrt(self.width**2 + self.height**2)
-    
-    def bounding_box(self):
-        """Return the bounding box of the rectangle."""
-        return (self.width, self.height)
+        super().__init__(width, height, fill=fill, stroke=stroke, stroke_width=stroke_width)
     
     def __str__(self):
         """String representation of the Rectangle."""
         return f"Rectangle(width={self.width}, height={self.height}, fill={self.fill}, stroke={self.stroke})"
 
 
-def visualize_shapes(shapes):
+def visualize_shapes(shapes, aspect=1.25, gap=2):
     """
     Visualize a list of shapes using matplotlib.
     
+    The shapes are packed into a compact block (see Layout.shelf_pack())
+    and drawn as one collection, so previews of thousands of shapes stay
+    quick. The shapes themselves are not moved.
+    
     Args:
         shapes: List of Circle and/or Rectangle objects to visualize
+        aspect: Target width / height of the layout (default: 1.25, the
+            shape of the figure)
+        gap: Space between neighbouring shapes (default: 2)
     """
+    # Loaded here so that using the shape classes alone stays cheap
+    import matplotlib.pyplot as plt
+    from Layout import layout_shapes
+    from Render import shape_arrays, shape_collection
+    
     fig, ax = plt.subplots(figsize=(10, 8))
     
-    x_offset = 0
-    
-    for shape in shapes:
-        if isinstance(shape, Circle):
-            circle = mpatches.Circle(
-                (x_offset + shape.radius, shape.radius),
-                shape.radius,
-                facecolor=shape.fill,
-                edgecolor=shape.stroke,
-                linewidth=shape.stroke_width
-            )
-            ax.add_patch(circle)
-            x_offset += shape.radius * 2 + 2
-            
-        elif isinstance(shape, Rectangle):
-            rectangle = mpatches.Rectangle(
-                (x_offset, 0),
-                shape.width,
-                shape.height,
-                facecolor=shape.fill,
-                edgecolor=shape.stroke,
-                linewidth=shape.stroke_width
-            )
-            ax.add_patch(rectangle)
-            x_offset += shape.width + 2
-    
-    ax.set_xlim(-1, x_offset)
-    ax.set_ylim(-1, 10)
+    x, y, width, height = layout_shapes(shapes, aspect, gap)
+    if shapes:
+        arrays = shape_arrays(shapes)
+        arrays['x'] = x
+        arrays['y'] = y
+        ax.add_collection(shape_collection(arrays, ax.transData), autolim=False)
+    
+    ax.set_xlim(-1, width + 1)
+    ax.set_ylim(-1, height + 1)
     ax.set_aspect('equal')
     ax.grid(True, alpha=0.3)
     ax.set_title('Shape Visualization', fontsize=14, fontweight='bold')
@@ -0,0 +1,331 @@
+"""
+Benchmarks for rendering, geometry and scene manipulation.
+
+    python Bench.py                          # run and print a table
+    python Bench.py --output results.json    # also write the results as JSON
+    python Bench.py --save-baseline base.json
+    python Bench.py --baseline base.json     # fail if anything got slower
+
+Every case is timed several times and the fastest and median wall
+times are kept. When comparing against a baseline, a case fails if its
+fastest time grew by more than the threshold factor (default 1.25).
+Use --quick for smaller sizes, and --only to run the cases whose name
+contains a substring.
+"""
+import argparse
+import io
+import json
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
+
+# Cases are (name, setup) pairs; setup() prepares the data and returns the
+# function that is timed
+CASES = []
+
+
+def case(name):
+    """Register a benchmark setup function under a name."""
+    def register(setup):
+        CASES.append((name, setup))
+        return setup
+    return register
+
+
+def _agg():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def random_canvas(count, seed=0, width=800, height=600):
+    """Build a canvas with a mix of random circles and rectangles."""
+    from Canvas import Canvas
+    rng = np.random.default_rng(seed)
+    canvas = Canvas(width, height)
+    kinds = rng.integers(0, 2, count).astype(np.int8)
+    styles = [canvas.store.styles.intern(c) for c in ('red', 'blue', 'yellow', 'green', 'black')]
+    sizes = rng.uniform(1, 10, count)
+    # Circles keep their radius in both the width and height columns
+    heights = np.where(kinds == canvas.store.CIRCLE, sizes, rng.uniform(1, 10, count))
+    canvas.store.extend(
+        kinds, rng.uniform(0, width, count), rng.uniform(0, height, count),
+        sizes, heights, rng.uniform(0, 3, count),
+        rng.choice(styles[:4], count), np.full(count, styles[4])
+    )
+    return canvas
+
+
+def _display_case(count, batched):
+    def setup():
+        plt = _agg()
+        canvas = random_canvas(count)
+        fig = plt.figure()
+
+        def run():
+            canvas.render_figure(fig, batched=batched)
+            fig.canvas.draw()
+        return run
+    return setup
+
+
+def register_cases(quick=False):
+    """Register every benchmark case, with smaller sizes when quick is set."""
+    CASES.clear()
+    display_sizes = [100, 1000, 10000] if quick else [100, 1000, 10000, 100000, 1000000]
+    patch_sizes = [100, 1000] if quick else [100, 1000, 10000]
+    population = 10000 if quick else 1000000
+
+    for count in display_sizes:
+        case(f"display/batched/{count}")(_display_case(count, True))
+    for count in patch_sizes:
+        case(f"display/patches/{count}")(_display_case(count, False))
+    for count in display_sizes:
+        @case(f"raster/{count}")
+        def setup(count=count):
+            canvas = random_canvas(count)
+            return canvas.render_to_array
+
+    for reuse in (False, True):
+        @case(f"render_image/{'context' if reuse else 'new_figure'}/100")
+        def setup(reuse=reuse):
+            _agg()
+            from RenderContext import RenderContext
+            canvas = random_canvas(100)
+            context = RenderContext() if reuse else None
+            return lambda: canvas.render_image(context=context)
+
+    @case("animation/blit/10000+10")
+    def setup():
+        _agg()
+        from Shapes import Circle
+        canvas = random_canvas(10000)
+        balls = [Circle(5, 40 + 70 * i, 300, fill='red') for i in range(10)]
+        for ball in balls:
+            canvas.add_shape(ball)
+
+        def update(frame):
+            for ball in balls:
+                ball.y = 300 + frame % 200
+        timeline = canvas.timeline(update, 30, moving=balls)
+        return lambda: list(timeline)
+
+    @case("churn/add_remove/10000")
+    def setup():
+        from Shapes import Circle
+        canvas = random_canvas(10000)
+        shapes = [Circle(5, i % 800, i % 600) for i in range(10000)]
+
+        def run():
+            for shape in shapes:
+                canvas.add_shape(shape)
+            for shape in shapes:
+                canvas.remove_shape(shape)
+        return run
+
+    # Shape objects are slow to create, so the scalar case uses a tenth of the
+    # population; compare the two cases per shape, not by total time
+    @case(f"geometry/scalar/{population // 10}")
+    def setup():
+        from Shapes import Rectangle
+        rng = np.random.default_rng(0)
+        rects = [Rectangle(float(w), float(h)) for w, h in rng.uniform(1, 100, (population // 10, 2))]
+
+        def run():
+            for r in rects:
+                r.area()
+                r.perimeter()
+                r.diagonal()
+        return run
+
+    @case(f"geometry/batch/{population}")
+    def setup():
+        from Geometry import RectangleBatch
+        rng = np.random.default_rng(0)
+        batch = RectangleBatch(rng.uniform(1, 100, population), rng.uniform(1, 100, population))
+
+        def run():
+            batch.area()
+            batch.perimeter()
+            batch.diagonal()
+        return run
+
+    text_count = 200 if quick else 2000
+
+    @case(f"text_canvas/{text_count}")
+    def setup():
+        plt = _agg()
+        from Text import Canvas, Text
+        rng = np.random.default_rng(0)
+        canvas = Canvas(800, 600)
+        for i in range(text_count):
+            canvas.add_text(Text(f"label {i}", float(rng.uniform(0, 800)), float(rng.uniform(0, 600)),
+                                 font_size=int(rng.integers(8, 16))))
+        fig = plt.figure()
+
+        def run():
+            canvas.render_figure(fig)
+            fig.canvas.draw()
+        return run
+
+    label_count = 5000 if quick else 50000
+
+    @case(f"labels/raster/{label_count}")
+    def setup():
+        from Text import Canvas, Text
+        rng = np.random.default_rng(0)
+        canvas = Canvas(4000, 3000)
+        for i in range(label_count):
+            canvas.add_text(Text(f"point {i}", float(rng.uniform(0, 4000)), float(rng.uniform(0, 3000)),
+                                 font_size=int(rng.integers(8, 16)), font_family='DejaVu Sans'))
+        return canvas.render_to_array
+
+    @case("flag/render_and_save/300dpi")
+    def setup():
+        plt = _agg()
+        from Flag import render_flag
+        fig = plt.figure()
+
+        def run():
+            render_flag(fig)
+            fig.savefig(io.BytesIO(), format='png', dpi=300, bbox_inches='tight', facecolor='white')
+        return run
+
+    @case("flag/compiled_variants/100x600px")
+    def setup():
+        from Flag import KENYA
+        palettes = [{'red': (i / 100, 0, 0.5), 'green': (0, 0.4, i / 100)} for i in range(100)]
+
+        def run():
+            for palette in palettes:
+                KENYA.render_png(None, 600, palette=palette)
+        return run
+
+    shape_count = 100 if quick else 1000
+
+    @case(f"visualize_shapes/{shape_count}")
+    def setup():
+        plt = _agg()
+        from Asign5 import Circle, Rectangle, visualize_shapes
+        shapes = [Circle(1 + i % 3) if i % 2 else Rectangle(2, 1 + i % 4) for i in range(shape_count)]
+        show = plt.show
+
+        def run():
+            # With Agg, show() does nothing, so draw the figure explicitly
+            plt.show = lambda: None
+            try:
+                visualize_shapes(shapes)
+                plt.gcf().canvas.draw()
+            finally:
+                plt.show = show
+                plt.close('all')
+        return run
+
+
+def time_case(run, repeat=5, max_seconds=30.0):
+    """
+    Time a function several times.
+
+    Stops early once max_seconds has been spent, after at least one run.
+
+    Returns:
+        A dict with the fastest and median times and the number of runs
+    """
+    times = []
+    budget_start = time.perf_counter()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+        if time.perf_counter() - budget_start > max_seconds:
+            break
+    return {'min': min(times), 'median': statistics.median(times), 'runs': len(times)}
+
+
+def run_benchmarks(only=None, repeat=5):
+    """
+    Run the registered cases.
+
+    Args:
+        only: Only run cases whose name contains this substring
+        repeat: Number of timed runs per case (default: 5)
+
+    Returns:
+        The results document: metadata plus a dict of timings per case
+    """
+    import matplotlib
+    results = {}
+    for name, setup in CASES:
+        if only and only not in name:
+            continue
+        run = setup()
+        run()  # Warm-up run, not timed
+        results[name] = time_case(run, repeat)
+        print(f"{name:40s} {results[name]['min'] * 1000:10.2f} ms", file=sys.stderr)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'matplotlib': matplotlib.__version__,
+            'machine': platform.machine(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def compare(results, baseline, threshold=1.25):
+    """
+    Compare results against a baseline document.
+
+    Returns:
+        A list of (name, baseline seconds, current seconds, ratio) for every
+        case that got slower than the threshold allows
+    """
+    regressions = []
+    for name, current in results['results'].items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            continue
+        ratio = current['min'] / previous['min']
+        if ratio > threshold:
+            regressions.append((name, previous['min'], current['min'], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the benchmark suite.")
+    parser.add_argument('--quick', action='store_true', help="Use smaller problem sizes")
+    parser.add_argument('--only', help="Only run cases whose name contains this text")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per case (default: 5)")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--save-baseline', metavar='PATH', help="Store the results as a baseline")
+    parser.add_argument('--baseline', metavar='PATH', help="Compare against a stored baseline")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="Allowed slowdown factor before a case fails (default: 1.25)")
+    args = parser.parse_args(argv)
+
+    register_cases(args.quick)
+    results = run_benchmarks(args.only, args.repeat)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after, ratio in regressions:
+            print(f"REGRESSION {name}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms "
+                  f"({ratio:.2f}x)", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
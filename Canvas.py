@@ -1,6 +1,8 @@
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-import math
+from Collision import CollisionDetector, overlapping_pairs
+from Raster import IncrementalRaster, rasterize, to_rgba8, write_png
+from Shapes import (Circle, Rectangle, ShapeList, ShapeStore, attach, detach,
+                    shape_from_dict, shape_to_dict)
+from Spatial import GridIndex
 
 
 class Canvas:
@@ -20,134 +22,487 @@ class Canvas:
         self.height = height
         self.background_color = background_color
         self.title = title
-        self.shapes = []  # List to store shapes on the canvas
+        self.store = ShapeStore()  # Columnar storage for the shapes on the canvas
+        self.index = None  # Optional GridIndex, see enable_index()
+        self.collisions = None  # Optional CollisionDetector, see enable_collisions()
+        self._raster = None  # IncrementalRaster kept between incremental renders
+        self.profiler = None  # Optional RenderProfiler, see render_figure()
+    
+    @property
+    def shapes(self):
+        """The shapes on the canvas, in the order they were added."""
+        return ShapeList(self.store)
     
     def add_shape(self, shape):
         """
         Add a shape to the canvas.
         
+        A shape belongs to at most one canvas; adding it here moves its
+        data into this canvas's store.
+        
         Args:
             shape: A Circle or Rectangle object to add to the canvas
         """
-        self.shapes.append(shape)
+        attach(shape, self.store)
     
     def remove_shape(self, shape):
         """
         Remove a shape from the canvas.
         
+        The shape keeps its attributes and can be added again later.
+        
         Args:
             shape: The shape to remove
         """
         if shape in self.shapes:
-            self.shapes.remove(shape)
+            detach(shape)
     
     def clear(self):
         """Remove all shapes from the canvas."""
-        self.shapes = []
+        self.store.clear()
     
-    def display(self):
-        """Display the canvas with all its shapes using matplotlib."""
-        fig, ax = plt.subplots(figsize=(self.width/100, self.height/100))
-        ax.set_facecolor(self.background_color)
+    def enable_index(self, cell_size=64):
+        """
+        Keep a spatial grid index over the shapes to speed up shapes_at()
+        and shapes_in(). The index follows every later change to the canvas.
+        
+        Args:
+            cell_size: Size of a grid cell in canvas units (default: 64)
+        """
+        if self.index is not None:
+            self.index.close()
+        self.index = GridIndex(self.store, cell_size)
+    
+    def disable_index(self):
+        """Drop the spatial index."""
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+    
+    def enable_collisions(self):
+        """
+        Keep track of overlapping shapes, so overlapping_pairs() only
+        re-checks the shapes that changed since its last call.
+        """
+        if self.collisions is not None:
+            self.collisions.close()
+        self.collisions = CollisionDetector(self.store)
+    
+    def disable_collisions(self):
+        """Stop tracking overlapping shapes."""
+        if self.collisions is not None:
+            self.collisions.close()
+            self.collisions = None
+    
+    def overlapping_pairs(self):
+        """
+        Return every pair of overlapping shapes (see Collision.py).
+        
+        Returns:
+            (a, b): arrays of store rows with a < b; canvas.store.view(row)
+            returns the shape of a row
+        """
+        if self.collisions is not None:
+            return self.collisions.pairs()
+        return overlapping_pairs(self.store)
+    
+    def overlapping_shapes(self):
+        """Return the overlapping shapes as a list of (shape, shape) tuples."""
+        a, b = self.overlapping_pairs()
+        return [(self.store.view(i), self.store.view(j)) for i, j in zip(a.tolist(), b.tolist())]
+    
+    def shapes_at(self, x, y):
+        """
+        Return the shapes that contain a point, in drawing order
+        (the last one is on top).
+        
+        Args:
+            x: X-coordinate of the point
+            y: Y-coordinate of the point
+        """
+        if self.index is not None:
+            rows = self.index.rows_at(x, y)
+        else:
+            rows = self.store.rows()
+            rows = rows[self.store.contains_point(rows, x, y)]
+        return [self.store.view(row) for row in rows]
+    
+    def shapes_in(self, rect):
+        """
+        Return the shapes whose bounding box overlaps a rectangle, in
+        drawing order.
+        
+        Args:
+            rect: A Rectangle, or an (x, y, width, height) tuple
+        """
+        if isinstance(rect, Rectangle):
+            rect = (rect.x, rect.y, rect.width, rect.height)
+        x, y, width, height = rect
+        if self.index is not None:
+            rows = self.index.rows_in(x, y, x + width, y + height)
+        else:
+            rows = self.store.rows()
+            x0, y0, x1, y1 = self.store.bounds(rows)
+            rows = rows[(x0 <= x + width) & (x1 >= x) & (y0 <= y + height) & (y1 >= y)]
+        return [self.store.view(row) for row in rows]
+    
+    def areas(self):
+        """Return the area of every shape on the canvas as a NumPy array."""
+        return self.store.areas()
+    
+    def total_area(self):
+        """Return the summed area of all shapes (overlaps are counted twice)."""
+        return float(self.store.areas().sum())
+    
+    def covered_area(self, resolution=2048):
+        """
+        Return the area of the canvas covered by at least one shape.
+        
+        Overlaps are counted once and parts outside the canvas are left out.
+        The result is exact for rectangles and approximate when there are
+        circles (see Coverage.union_area()).
+        
+        Args:
+            resolution: Number of scan rows used for circles (default: 2048)
+        """
+        from Coverage import union_area
+        return union_area(self.store, clip=(0, 0, self.width, self.height), resolution=resolution)
+    
+    def coverage(self, resolution=2048):
+        """Return the fraction of the canvas covered by shapes, from 0 to 1."""
+        return self.covered_area(resolution) / (self.width * self.height)
+    
+    def coverage_by_fill(self, resolution=2048):
+        """
+        Return the area of the canvas covered by shapes of each fill color.
+        
+        Returns:
+            A dict mapping fill color to covered area
+        """
+        from Coverage import coverage_by_style
+        return coverage_by_style(self.store, clip=(0, 0, self.width, self.height),
+                                 resolution=resolution)
+    
+    def display(self, batched=False, viewport=None, lod=None, context=None):
+        """
+        Display the canvas with all its shapes using matplotlib.
+        
+        Repeated calls draw into the same figure instead of opening a new
+        one each time, so a long-running process does not pile up figures.
+        
+        Args:
+            batched: Draw all shapes as one collection instead of one patch
+                per shape, which is much faster for large scenes (default: False)
+            viewport: Part of the canvas to show, see render_figure()
+            lod: Level-of-detail settings, see render_figure()
+            context: RenderContext to draw with (default: one pyplot
+                context shared by all canvases)
+        """
+        # pyplot is only loaded when something is actually displayed
+        from RenderContext import display_context
+        
+        (context or display_context()).show(self, batched, viewport, lod)
+    
+    def render_figure(self, fig, batched=True, viewport=None, lod=None, reuse=False, rows=None):
+        """
+        Draw the canvas into an existing matplotlib figure.
+        
+        The figure is cleared and resized first, so the same figure can be
+        reused for many renders (for example by a batch exporter). With
+        reuse, the axes from the previous render are kept and only their
+        artists are removed, which is faster still (see RenderContext).
+        
+        With level of detail enabled, shapes outside the viewport are not
+        drawn at all, and shapes smaller than a pixel are summed into one
+        density layer instead of getting an artist each (see
+        LOD.LevelOfDetail), so the cost follows what is visible.
+        
+        If a profiler is attached, every phase of the render is measured
+        (see Profiler.RenderProfiler).
+        
+        Args:
+            fig: The matplotlib figure to draw into
+            batched: Draw the shapes as one collection (default: True)
+            viewport: (x, y, width, height) of the part of the canvas to
+                show, for zooming in (default: the whole canvas)
+            lod: True or a LevelOfDetail to enable level of detail
+                (default: None, draw every shape)
+            reuse: Keep the axes of the previous render (default: False)
+            rows: Draw only these store rows, in drawing order (default:
+                every shape)
+        
+        Returns:
+            The axes the canvas was drawn on
+        """
+        if viewport is None:
+            viewport = (0, 0, self.width, self.height)
+        profiler = self.profiler
+        if profiler is None:
+            ax = self._setup_figure(fig, reuse)
+            self._draw_visible(ax, batched, viewport, lod, rows)
+            self._decorate(ax, viewport)
+            fig.tight_layout()
+            return ax
         
-        # Draw all shapes
-        for shape in self.shapes:
-            if isinstance(shape, Circle):
-                circle = mpatches.Circle(
-                    (shape.x, shape.y),
-                    shape.radius,
-                    facecolor=shape.fill,
-                    edgecolor=shape.stroke,
-                    linewidth=shape.stroke_width
-                )
-                ax.add_patch(circle)
-            elif isinstance(shape, Rectangle):
-                rectangle = mpatches.Rectangle(
-                    (shape.x, shape.y),
-                    shape.width,
-                    shape.height,
-                    facecolor=shape.fill,
-                    edgecolor=shape.stroke,
-                    linewidth=shape.stroke_width
-                )
-                ax.add_patch(rectangle)
-        
-        ax.set_xlim(0, self.width)
-        ax.set_ylim(0, self.height)
+        with profiler.render('figure', fig, self.store.count):
+            with profiler.phase('setup'):
+                ax = self._setup_figure(fig, reuse)
+            with profiler.phase('artists'):
+                self._draw_visible(ax, batched, viewport, lod, rows)
+            with profiler.phase('decorate'):
+                self._decorate(ax, viewport)
+            with profiler.phase('layout'):
+                fig.tight_layout()
+            if profiler.include_draw:
+                with profiler.phase('draw'):
+                    fig.canvas.draw()
+        return ax
+    
+    def _setup_figure(self, fig, reuse=False):
+        """Clear and resize the figure and add the axes to draw on."""
+        size = (self.width/100, self.height/100)
+        if reuse and len(fig.axes) == 1:
+            from Render import clear_artists, reset_layout
+            ax = fig.axes[0]
+            clear_artists(ax)
+            if tuple(fig.get_size_inches()) != size:
+                fig.set_size_inches(*size)
+            reset_layout(fig)
+        else:
+            fig.clf()
+            fig.set_size_inches(*size)
+            ax = fig.add_subplot()
+        ax.set_facecolor(self.background_color)
+        return ax
+    
+    def _decorate(self, ax, viewport):
+        """Set the limits, aspect and title of the axes."""
+        x, y, width, height = viewport
+        ax.set_xlim(x, x + width)
+        ax.set_ylim(y, y + height)
         ax.set_aspect('equal')
         ax.set_title(self.title, fontsize=14, fontweight='bold')
-        plt.tight_layout()
-        plt.show()
     
-    def get_shape_count(self):
-        """Return the number of shapes on the canvas."""
-        return len(self.shapes)
+    def render_image(self, format='png', dpi=100, cache=None, context=None):
+        """
+        Render the canvas with matplotlib to encoded image bytes, without
+        pyplot or a window.
+        
+        Args:
+            format: Image format, such as 'png' or 'svg' (default: 'png')
+            dpi: Resolution of the image (default: 100)
+            cache: RenderCache to reuse images of identical canvases from
+                (default: None, always render)
+            context: RenderContext whose figure is reused (default: None,
+                a new figure for this image)
+        
+        Returns:
+            The encoded image as bytes
+        """
+        if cache is not None:
+            from RenderCache import canvas_key
+            key = canvas_key(self, format=format, dpi=dpi)
+            return cache.get_or_render(key, lambda: self.render_image(format, dpi, context=context))
+        if context is not None:
+            return context.render_image(self, format, dpi)
+        
+        import io
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        self.render_figure(fig)
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=format, dpi=dpi)
+        return buffer.getvalue()
     
-    def __str__(self):
-        """String representation of the Canvas."""
-        return f"Canvas(width={self.width}, height={self.height}, shapes={len(self.shapes)})"
-
-
-class Circle:
-    """A class to represent a circle with position and graphical attributes."""
+    def render_to_array(self, scale=1.0, antialias=True, incremental=False):
+        """
+        Render the shapes (and the text of a text Canvas) into an RGBA NumPy
+        array without matplotlib figures.
+        
+        Only the drawing area is rendered (no title or axes), with one pixel
+        per canvas unit at the default scale.
+        
+        Args:
+            scale: Pixels per canvas unit (default: 1.0)
+            antialias: Smooth the edges of shapes (default: True)
+            incremental: Keep the rendered frame and, on the next incremental
+                call with the same settings, only redraw the regions of shapes
+                that were added, removed or changed since (default: False)
+        
+        Returns:
+            A uint8 array of shape (height, width, 4)
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            with profiler.render('raster', shapes=self.store.count):
+                with profiler.phase('rasterize'):
+                    buffer = self._rasterize(scale, antialias, incremental)
+                with profiler.phase('convert'):
+                    return to_rgba8(buffer)
+        return to_rgba8(self._rasterize(scale, antialias, incremental))
+    
+    def _rasterize(self, scale, antialias, incremental):
+        """Return the premultiplied float buffer for render_to_array()."""
+        if not incremental:
+            return rasterize(self.store, self.width, self.height, self.background_color,
+                             scale=scale, antialias=antialias)
+        settings = (self.width, self.height, self.background_color, scale, antialias)
+        if self._raster is None or self._raster.settings != settings:
+            if self._raster is not None:
+                self._raster.close()
+            self._raster = IncrementalRaster(self.store, *settings)
+        return self._raster.render()
+    
+    def render_to_png(self, path, scale=1.0, antialias=True, incremental=False):
+        """
+        Render the shapes headlessly and save them as a PNG file.
+        
+        Args:
+            path: File path to write the PNG to
+            scale: Pixels per canvas unit (default: 1.0)
+            antialias: Smooth the edges of shapes (default: True)
+            incremental: Reuse the previous frame, see render_to_array()
+        """
+        write_png(path, self.render_to_array(scale, antialias, incremental))
     
-    def __init__(self, radius, x=0, y=0, fill='blue', stroke='black', stroke_width=2):
+    def render_to_svg(self, file):
         """
-        Initialize a Circle.
+        Stream the canvas as SVG without building a matplotlib figure.
         
         Args:
-            radius: The radius of the circle
-            x: X-coordinate of the circle's center (default: 0)
-            y: Y-coordinate of the circle's center (default: 0)
-            fill: Color to fill the inside (default: 'blue')
-            stroke: Color of the boundary line (default: 'black')
-            stroke_width: Width of the boundary line (default: 2)
+            file: A file path, or a writable file-like object
         """
-        self.radius = radius
-        self.x = x
-        self.y = y
-        self.fill = fill
-        self.stroke = stroke
-        self.stroke_width = stroke_width
+        from SVG import write_svg
+        write_svg(self, file)
     
-    def area(self):
-        """Calculate and return the area of the circle."""
-        return math.pi * self.radius ** 2
+    def _draw_visible(self, ax, batched, viewport, lod, rows=None):
+        """Draw the canvas contents, applying level of detail if enabled."""
+        if not lod:
+            self._draw(ax, batched, rows)
+            return
+        from LOD import LevelOfDetail
+        from Render import draw_density
+        
+        if lod is True:
+            lod = LevelOfDetail()
+        x, y, width, height = viewport
+        bounds = (x, y, x + width, y + height)
+        # Screen pixels per canvas unit, from the axes box before tight_layout
+        position = ax.get_position()
+        fig_width, fig_height = ax.figure.get_size_inches() * ax.figure.dpi
+        pixels_per_unit = min(position.width * fig_width / width,
+                              position.height * fig_height / height)
+        rows, tiny = lod.split(self.store, bounds, pixels_per_unit, rows, ax.figure.dpi)
+        draw_density(ax, self.store, tiny, bounds, pixels_per_unit, lod.aggregate)
+        self._draw(ax, batched, rows)
     
-    def __str__(self):
-        return f"Circle(radius={self.radius}, pos=({self.x},{self.y}), fill={self.fill})"
-
-
-class Rectangle:
-    """A class to represent a rectangle with position and graphical attributes."""
+    def _draw(self, ax, batched, rows=None):
+        """Draw the canvas contents (or only the given rows) onto the axes."""
+        import matplotlib.patches as mpatches
+        from Render import draw_store_batched
+        
+        if batched:
+            draw_store_batched(ax, self.store, rows)
+        else:
+            shapes = self.shapes if rows is None else [self.store.view(row) for row in rows]
+            for shape in shapes:
+                if isinstance(shape, Circle):
+                    circle = mpatches.Circle(
+                        (shape.x, shape.y),
+                        shape.radius,
+                        facecolor=shape.fill,
+                        edgecolor=shape.stroke,
+                        linewidth=shape.stroke_width
+                    )
+                    ax.add_patch(circle)
+                elif isinstance(shape, Rectangle):
+                    rectangle = mpatches.Rectangle(
+                        (shape.x, shape.y),
+                        shape.width,
+                        shape.height,
+                        facecolor=shape.fill,
+                        edgecolor=shape.stroke,
+                        linewidth=shape.stroke_width
+                    )
+                    ax.add_patch(rectangle)
     
-    def __init__(self, width, height, x=0, y=0, fill='red', stroke='black', stroke_width=2):
+    def timeline(self, update, frames, fps=30, moving=(), batched=True):
         """
-        Initialize a Rectangle.
+        Create a Timeline that animates the canvas (see Animation.py).
         
         Args:
-            width: The width of the rectangle
-            height: The height of the rectangle
-            x: X-coordinate of the rectangle's bottom-left corner (default: 0)
-            y: Y-coordinate of the rectangle's bottom-left corner (default: 0)
-            fill: Color to fill the inside (default: 'red')
-            stroke: Color of the boundary line (default: 'black')
-            stroke_width: Width of the boundary line (default: 2)
+            update: Function called with each frame value; it moves or
+                restyles shapes of the canvas
+            frames: Number of frames, or an iterable of frame values
+            fps: Frames per second of saved animations (default: 30)
+            moving: Shapes known to move (default: detected as they change)
+            batched: Draw the static shapes as one collection (default: True)
         """
-        self.width = width
-        self.height = height
-        self.x = x
-        self.y = y
-        self.fill = fill
-        self.stroke = stroke
-        self.stroke_width = stroke_width
+        from Animation import Timeline
+        return Timeline(self, update, frames, fps, moving, batched)
+    
+    def animate(self, output, update, frames, fps=30, moving=()):
+        """
+        Render an animation of the canvas straight to a file, frame by frame.
+        
+        Args:
+            output: A .gif or video file (video needs ffmpeg), a directory
+                or a file name pattern such as 'frames/{:05d}.png'
+            update, frames, fps, moving: See timeline()
+        
+        Returns:
+            The number of frames written
+        """
+        timeline = self.timeline(update, frames, fps, moving)
+        try:
+            return timeline.save(output)
+        finally:
+            timeline.close()
     
-    def area(self):
-        """Calculate and return the area of the rectangle."""
-        return self.width * self.height
+    def to_scene(self):
+        """
+        Describe the canvas as a plain dict that can be stored as JSON.
+        
+        Returns:
+            A scene description accepted by from_scene()
+        """
+        return {
+            'type': 'canvas',
+            'width': self.width,
+            'height': self.height,
+            'background_color': self.background_color,
+            'title': self.title,
+            'shapes': [shape_to_dict(shape) for shape in self.shapes],
+        }
+    
+    @classmethod
+    def from_scene(cls, scene):
+        """
+        Build a canvas from a scene description made by to_scene().
+        
+        Args:
+            scene: Dict with the canvas settings and a list of shapes
+        """
+        canvas = cls(
+            width=scene.get('width', 800),
+            height=scene.get('height', 600),
+            background_color=scene.get('background_color', 'white'),
+            title=scene.get('title', 'Canvas')
+        )
+        for data in scene.get('shapes', ()):
+            canvas.add_shape(shape_from_dict(data))
+        return canvas
+    
+    def get_shape_count(self):
+        """Return the number of shapes on the canvas."""
+        return self.store.count
     
     def __str__(self):
-        return f"Rectangle(width={self.width}, height={self.height}, pos=({self.x},{self.y}), fill={self.fill})"
+        """String representation of the Canvas."""
+        return f"Canvas(width={self.width}, height={self.height}, shapes={self.store.count})"
 
 
 # Test the Canvas class
@@ -188,3 +543,10 @@ if __name__ == "__main__":
     print("\nClearing canvas...")
     canvas.clear()
     print(f"Canvas now has {canvas.get_shape_count()} shapes")
+
+    # Shapes keep their attributes after a clear and can be added again
+    canvas.add_shape(Circle(radius=99, x=10, y=10, fill='green'))
+    assert circle1.radius == 50 and circle1.fill == 'yellow'
+    canvas.add_shape(circle1)
+    print(f"Re-added circle1, canvas now has {canvas.get_shape_count()} shapes")
+    assert canvas.get_shape_count() == 2 and circle1 in canvas.shapes
@@ -0,0 +1,289 @@
+"""
+Overlap detection between the shapes of a ShapeStore.
+
+A full pass uses a uniform grid as the broad phase: every shape is
+registered in the cells its bounding box touches, and the shapes that
+share a cell are the candidate pairs. Re-checking a few shapes instead
+uses a sort-and-sweep along x: with the shapes sorted by their left
+edge, searchsorted finds the ones that start inside each checked shape.
+Candidates whose bounding boxes overlap go on to an exact
+narrow phase that tests circle-circle, rectangle-rectangle and
+circle-rectangle pairs with array arithmetic. Shapes overlap when their
+interiors intersect; shapes that only touch do not. Strokes are ignored.
+"""
+import numpy as np
+
+# Candidate pairs tested at a time, which bounds the memory of the sweep
+CHUNK_PAIRS = 1 << 22
+
+
+def _expand(starts, counts):
+    """
+    Expand index ranges into flat arrays.
+
+    Returns:
+        (owner, index): owner[k] is the position of the range that entry k
+        came from and index[k] runs from starts[owner] upwards
+    """
+    owner = np.repeat(np.arange(len(counts)), counts)
+    offset = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, starts[owner] + offset
+
+
+def _chunks(counts):
+    """Split ranges into consecutive slices holding about CHUNK_PAIRS entries each."""
+    ends = np.cumsum(counts)
+    lo = 0
+    while lo < len(counts):
+        hi = int(np.searchsorted(ends, (ends[lo - 1] if lo else 0) + CHUNK_PAIRS, 'right'))
+        hi = max(hi, lo + 1)
+        yield slice(lo, hi)
+        lo = hi
+
+
+def overlaps(store, a, b):
+    """
+    Test pairs of shapes for overlap.
+
+    Args:
+        store: The ShapeStore holding the shapes
+        a, b: Arrays of rows, tested pairwise
+
+    Returns:
+        A boolean array, one entry per pair
+    """
+    circle_a = store.kind[a] == store.CIRCLE
+    circle_b = store.kind[b] == store.CIRCLE
+    ax0, ay0, ax1, ay1 = store.bounds(a)
+    bx0, by0, bx1, by1 = store.bounds(b)
+    boxes = (ax0 < bx1) & (bx0 < ax1) & (ay0 < by1) & (by0 < ay1)
+
+    # Circle against circle: the centers are closer than the summed radii
+    dx = store.x[a] - store.x[b]
+    dy = store.y[a] - store.y[b]
+    reach = store.width[a] + store.width[b]
+    circles = dx * dx + dy * dy < reach * reach
+
+    # Circle against rectangle: the point of the rectangle nearest to the
+    # center lies inside the circle
+    cx = np.where(circle_a, store.x[a], store.x[b])
+    cy = np.where(circle_a, store.y[a], store.y[b])
+    radius = np.where(circle_a, store.width[a], store.width[b])
+    x0, y0 = np.where(circle_a, bx0, ax0), np.where(circle_a, by0, ay0)
+    x1, y1 = np.where(circle_a, bx1, ax1), np.where(circle_a, by1, ay1)
+    dx = cx - np.clip(cx, x0, x1)
+    dy = cy - np.clip(cy, y0, y1)
+    mixed = dx * dx + dy * dy < radius * radius
+
+    return boxes & np.where(circle_a == circle_b, np.where(circle_a, circles, True), mixed)
+
+
+def _cell_size(width, height, area, n):
+    """
+    Choose the grid cell size of the broad phase: about the size of a
+    typical shape, but large enough that the shapes touch at most about
+    four cells each on average.
+    """
+    size = max(float(np.median(np.maximum(width, height))) * 2, (area / n) ** 0.5, 1e-12)
+    for _ in range(64):
+        entries = np.sum((np.floor(width / size) + 2) * (np.floor(height / size) + 2))
+        if entries <= 4 * n:
+            break
+        size *= 1.5
+    return size
+
+
+def overlapping_pairs(store, rows=None):
+    """
+    Find every pair of overlapping shapes.
+
+    Args:
+        store: The ShapeStore holding the shapes
+        rows: Rows to consider (default: all live rows)
+
+    Returns:
+        (a, b): arrays of rows with a < b, sorted by a and then b
+    """
+    if rows is None:
+        rows = store.rows()
+    rows = np.asarray(rows, dtype=np.intp)
+    if len(rows) < 2:
+        return _normalize([], [])
+    x0, y0, x1, y1 = store.bounds(rows)
+    gx, gy = x0.min(), y0.min()
+    size = _cell_size(x1 - x0, y1 - y0, (x1.max() - gx) * (y1.max() - gy), len(rows))
+
+    # Register every shape in each grid cell its bounding box touches
+    cx0 = ((x0 - gx) // size).astype(np.int64)
+    cy0 = ((y0 - gy) // size).astype(np.int64)
+    spans_x = ((x1 - gx) // size).astype(np.int64) - cx0 + 1
+    counts = spans_x * (((y1 - gy) // size).astype(np.int64) - cy0 + 1)
+    entry, position = _expand(np.zeros(len(rows), dtype=np.int64), counts)
+    cell_x = cx0[entry] + position % spans_x[entry]
+    cell_y = cy0[entry] + position // spans_x[entry]
+    columns = int(cell_x.max()) + 1
+    cells = cell_y * columns + cell_x
+    sort = np.argsort(cells, kind='stable')
+    cells, entry = cells[sort], entry[sort]
+
+    # Every two entries of the same cell are a candidate pair
+    bounds = np.flatnonzero(np.diff(cells)) + 1
+    cell_end = np.repeat(np.append(bounds, len(cells)), np.diff(np.concatenate([[0], bounds, [len(cells)]])))
+    starts = np.arange(1, len(cells) + 1)
+    pair_counts = cell_end - starts
+    found_a, found_b = [], []
+    for part in _chunks(pair_counts):
+        p, q = _expand(starts[part], pair_counts[part])
+        p += part.start
+        i, j = entry[p], entry[q]
+        # A pair whose boxes overlap is reported only by the cell holding
+        # the lower-left corner of the overlap, so it is found once
+        ox, oy = np.maximum(x0[i], x0[j]), np.maximum(y0[i], y0[j])
+        keep = ((ox < np.minimum(x1[i], x1[j])) & (oy < np.minimum(y1[i], y1[j]))
+                & (((ox - gx) // size).astype(np.int64) + ((oy - gy) // size).astype(np.int64) * columns
+                   == cells[p]))
+        i, j = rows[i[keep]], rows[j[keep]]
+        keep = overlaps(store, i, j)
+        found_a.append(i[keep])
+        found_b.append(j[keep])
+    return _normalize(found_a, found_b)
+
+
+def overlapping_with(store, dirty, rows=None):
+    """
+    Find every overlapping pair that involves at least one of some shapes.
+
+    This is what a re-check after moving a few shapes needs: the cost is
+    a sweep of the moved shapes against the sorted others, not a full
+    pass over every pair.
+
+    Args:
+        store: The ShapeStore holding the shapes
+        dirty: Rows of the shapes to check
+        rows: Rows to check them against (default: all live rows)
+
+    Returns:
+        (a, b): arrays of rows with a < b, sorted by a and then b
+    """
+    if rows is None:
+        rows = store.rows()
+    rows = np.asarray(rows, dtype=np.intp)
+    dirty = np.asarray(dirty, dtype=np.intp)
+    found_a, found_b = [], []
+    if len(dirty) and len(rows):
+        dx0, dy0, dx1, dy1 = store.bounds(dirty)
+        ox0, oy0, ox1, oy1 = store.bounds(rows)
+        d_order = np.argsort(dx0, kind='stable')
+        o_order = np.argsort(ox0, kind='stable')
+        # Intervals overlap when one starts inside the other: others that
+        # start within a dirty shape, then dirty shapes that start strictly
+        # within another (so no pair is found twice)
+        sorted_o, sorted_d = ox0[o_order], dx0[d_order]
+        for owners, owner_order, lo, hi, other_order in (
+                (dirty, d_order, np.searchsorted(sorted_o, dx0[d_order], 'left'),
+                 np.searchsorted(sorted_o, dx1[d_order], 'left'), o_order),
+                (rows, o_order, np.searchsorted(sorted_d, ox0[o_order], 'right'),
+                 np.searchsorted(sorted_d, ox1[o_order], 'left'), d_order)):
+            counts = np.maximum(hi - lo, 0)
+            for part in _chunks(counts):
+                i, j = _expand(lo[part], counts[part])
+                i = owner_order[i + part.start]
+                j = other_order[j]
+                if owners is dirty:
+                    i, j = dirty[i], rows[j]
+                else:
+                    i, j = rows[i], dirty[j]
+                keep = i != j
+                i, j = i[keep], j[keep]
+                keep = overlaps(store, i, j)
+                found_a.append(i[keep])
+                found_b.append(j[keep])
+    return _normalize(found_a, found_b)
+
+
+def _normalize(found_a, found_b):
+    """Order each pair as (low, high), drop duplicates and sort."""
+    if not found_a:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    a = np.concatenate(found_a)
+    b = np.concatenate(found_b)
+    low, high = np.minimum(a, b), np.maximum(a, b)
+    if not len(low):
+        return low, high
+    span = np.int64(high.max()) + 1
+    keys = np.sort(low.astype(np.int64) * span + high)
+    keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+    return (keys // span).astype(np.intp), (keys % span).astype(np.intp)
+
+
+class CollisionDetector:
+    """
+    Keeps the overlapping pairs of a ShapeStore up to date.
+
+    The detector observes its store. Shapes that are added, moved, resized
+    or removed are marked, and the next call to pairs() only re-checks the
+    marked shapes against the rest instead of sweeping the whole store.
+    """
+
+    def __init__(self, store, rebuild_fraction=0.25):
+        """
+        Initialize a CollisionDetector.
+
+        Args:
+            store: The ShapeStore to follow
+            rebuild_fraction: When more than this fraction of the shapes
+                changed, all pairs are found again from scratch (default: 0.25)
+        """
+        self.store = store
+        self.rebuild_fraction = rebuild_fraction
+        self._a = None
+        self._b = None
+        self._dirty = set()
+        store.observers.append(self)
+
+    def close(self):
+        """Stop following the store."""
+        if self in self.store.observers:
+            self.store.observers.remove(self)
+
+    # Store observer interface
+
+    def shape_added(self, row):
+        self._dirty.add(row)
+
+    def shape_removed(self, row):
+        self._dirty.add(row)
+
+    def shape_changed(self, row):
+        self._dirty.add(row)
+
+    def store_cleared(self):
+        self._a = None
+        self._b = None
+        self._dirty = set()
+
+    # Queries
+
+    def pairs(self):
+        """
+        Return the overlapping pairs as (a, b) arrays of rows, with a < b.
+        """
+        store = self.store
+        if self._a is None or len(self._dirty) > self.rebuild_fraction * max(store.count, 1):
+            self._a, self._b = overlapping_pairs(store)
+        elif self._dirty:
+            dirty = np.fromiter(self._dirty, dtype=np.intp, count=len(self._dirty))
+            stale = np.isin(self._a, dirty) | np.isin(self._b, dirty)
+            dirty = dirty[store.alive[dirty]]
+            new_a, new_b = overlapping_with(store, dirty)
+            self._a, self._b = _normalize([self._a[~stale], new_a], [self._b[~stale], new_b])
+        self._dirty = set()
+        return self._a, self._b
+
+    def colliding(self, row):
+        """Return the rows of the shapes that overlap one shape."""
+        a, b = self.pairs()
+        return np.sort(np.concatenate([b[a == row], a[b == row]]))
+
+    def __len__(self):
+        return len(self.pairs()[0])
@@ -0,0 +1,383 @@
+"""
+Coverage analytics: how much area a set of shapes covers, counting
+overlapping parts once.
+
+Rectangles get an exact answer. The plane is split recursively into a
+grid until each cell holds a few dozen rectangles. Rectangles that span
+a whole cell in one direction are measured as 1-D intervals and
+squeezed out of the others first. Each cell is then swept on a
+compressed grid of its rectangles' edges: the +1/-1 edge events are
+accumulated along x and y with cumulative sums, which is a sweep line
+run by NumPy instead of a segment tree walked in Python. Small cells are swept in batches. The
+cost grows as O(n log n) with the number of rectangles, with no
+pairwise comparisons.
+
+Circles (and mixed scenes) are measured approximately on horizontal
+scan rows: every shape becomes one x-interval per row it crosses, and
+the union of the intervals in each row is exact. Only the y direction
+is sampled, so the error shrinks quickly as the number of rows grows.
+"""
+import math
+
+import numpy as np
+
+# Cells with at most this many rectangles are swept directly (at most 127)
+LEAF_SIZE = 32
+
+# Subdivision depth limit, so heavily stacked rectangles cannot recurse forever
+MAX_DEPTH = 12
+
+# Shape spans measured at a time by scanline_union_area(), which bounds its memory
+SCAN_CHUNK = 1 << 20
+
+
+def _sweep(x0, y0, x1, y1):
+    """Exact union area of a small set of rectangles on their compressed grid."""
+    xs = np.unique(np.concatenate([x0, x1]))
+    ys = np.unique(np.concatenate([y0, y1]))
+    i0, i1 = np.searchsorted(xs, x0), np.searchsorted(xs, x1)
+    j0, j1 = np.searchsorted(ys, y0), np.searchsorted(ys, y1)
+    ny = len(ys)
+    # +1/-1 at the corners; the cumulative sums give the cover count per grid cell
+    index = np.concatenate([i0 * ny + j0, i1 * ny + j1, i0 * ny + j1, i1 * ny + j0])
+    weight = np.repeat([1, 1, -1, -1], len(x0))
+    events = np.bincount(index, weight, len(xs) * ny).reshape(len(xs), ny)
+    count = events.cumsum(axis=0).cumsum(axis=1)[:-1, :-1]
+    return float(np.diff(xs) @ (count > 0.5) @ np.diff(ys))
+
+
+def _sweep_batch(x0, y0, x1, y1, cell, slot, cells, pad_x, pad_y, size):
+    """
+    Sweep many small cells at once.
+
+    Every cell's rectangles are padded to the same count and their grids
+    stacked into one 3-D array, so the sweeps of all cells run as single
+    NumPy operations.
+
+    Args:
+        x0, y0, x1, y1: Corners of the rectangles of all cells
+        cell: Index (0 to cells - 1) of the cell each rectangle belongs to
+        slot: Position of each rectangle within its cell
+        cells: Number of cells
+        pad_x, pad_y: Per-cell coordinates used for the padding rectangles,
+            at or beyond the cell's far corner so they add no width
+        size: Padded number of rectangles per cell
+    """
+    corners = []
+    for values, pad in ((x0, pad_x), (x1, pad_x), (y0, pad_y), (y1, pad_y)):
+        padded = np.repeat(pad[:, None], size, axis=1)
+        padded[cell, slot] = values
+        corners.append(padded)
+    weight = np.zeros((cells, size))
+    weight[cell, slot] = 1.0
+
+    ranks = []
+    steps = []
+    for low, high in ((corners[0], corners[1]), (corners[2], corners[3])):
+        edges = np.concatenate([low, high], axis=1)
+        order = np.argsort(edges, axis=1)
+        # Tied coordinates get neighbouring ranks with zero width between them
+        rank = np.empty_like(order)
+        np.put_along_axis(rank, order, np.arange(2 * size)[None, :], axis=1)
+        ranks.append((rank[:, :size], rank[:, size:]))
+        steps.append(np.diff(np.take_along_axis(edges, order, axis=1), axis=1))
+    (i0, i1), (j0, j1) = ranks
+    side = 2 * size
+    base = (np.arange(cells) * side * side)[:, None]
+    index = np.concatenate([base + i0 * side + j0, base + i1 * side + j1,
+                            base + i0 * side + j1, base + i1 * side + j0])
+    weights = np.concatenate([weight, weight, -weight, -weight])
+    events = np.bincount(index.ravel(), weights.ravel(), cells * side * side)
+    # Cover counts never exceed the number of rectangles in a cell (at most
+    # LEAF_SIZE), so small integers keep the cumulative sums cheap
+    events = events.astype(np.int8).reshape(cells, side, side)
+    count = events.cumsum(axis=1, dtype=np.int8).cumsum(axis=2, dtype=np.int8)[:, :-1, :-1]
+    return float(np.einsum('ci,cij,cj->', steps[0], count > 0, steps[1]))
+
+
+def _interval_union(start, end):
+    """Merge 1-D intervals. Returns the sorted starts and ends of the union."""
+    order = np.argsort(start, kind='stable')
+    start, end = start[order], end[order]
+    reach = np.maximum.accumulate(end)
+    # A new merged interval begins wherever a start lies beyond every earlier end
+    first = np.concatenate([[True], start[1:] > reach[:-1]])
+    group_end = np.append(np.flatnonzero(first)[1:] - 1, len(start) - 1)
+    return start[first], reach[group_end]
+
+
+def _squeeze(values, starts, ends):
+    """
+    Map coordinates so that the given merged intervals shrink to points:
+    each value moves down by the length of the intervals below it.
+    """
+    lengths = ends - starts
+    before = np.concatenate([[0.0], np.cumsum(lengths)])
+    k = np.searchsorted(starts, values, 'right') - 1
+    inside = np.clip(values - starts[np.maximum(k, 0)], 0, lengths[np.maximum(k, 0)])
+    return values - np.where(k >= 0, before[np.maximum(k, 0)] + inside, 0.0)
+
+
+def _union(x0, y0, x1, y1, box, depth):
+    """Union area of rectangles already clipped to a box."""
+    bx0, by0, bx1, by1 = box
+    total = 0.0
+    # Rectangles that span the whole box in one direction are just intervals
+    # in the other. Their union is measured directly, then squeezed out of
+    # the remaining rectangles, which keeps only the part outside it.
+    while len(x0):
+        across = (x0 <= bx0) & (x1 >= bx1)
+        down = (y0 <= by0) & (y1 >= by1)
+        if np.any(across & down):
+            return total + (bx1 - bx0) * (by1 - by0)
+        if np.any(across):
+            starts, ends = _interval_union(y0[across], y1[across])
+            covered = float(np.sum(ends - starts))
+            total += (bx1 - bx0) * covered
+            keep = ~across
+            x0, x1 = x0[keep], x1[keep]
+            y0, y1 = _squeeze(y0[keep], starts, ends), _squeeze(y1[keep], starts, ends)
+            by1 -= covered
+        elif np.any(down):
+            starts, ends = _interval_union(x0[down], x1[down])
+            covered = float(np.sum(ends - starts))
+            total += (by1 - by0) * covered
+            keep = ~down
+            y0, y1 = y0[keep], y1[keep]
+            x0, x1 = _squeeze(x0[keep], starts, ends), _squeeze(x1[keep], starts, ends)
+            bx1 -= covered
+        else:
+            break
+        keep = (x1 > x0) & (y1 > y0)
+        x0, y0, x1, y1 = x0[keep], y0[keep], x1[keep], y1[keep]
+    n = len(x0)
+    if n == 0:
+        return total
+    if n <= LEAF_SIZE or depth >= MAX_DEPTH:
+        return total + _sweep(x0, y0, x1, y1)
+
+    # Split into a g x g grid with about LEAF_SIZE / 2 rectangles per cell.
+    # Rectangles that straddle cell edges count once for every cell, so large
+    # rectangles need a finer grid, but the copies are capped at 8n; cells
+    # that are still crowded are split again below.
+    widths = (x1 - x0) / (bx1 - bx0)
+    heights = (y1 - y0) / (by1 - by0)
+
+    def entries(g):
+        return np.sum((widths * g + 1) * (heights * g + 1))
+
+    g = max(int(math.sqrt(2 * n / LEAF_SIZE)), 2)
+    if entries(g) > 8 * n:
+        while g > 2 and entries(g) > 8 * n:
+            g = max(int(g * 0.8), 2)
+    else:
+        most = 4 * g
+        while g < most and entries(g) > g * g * LEAF_SIZE / 2 and entries(int(g * 1.25) + 1) <= 8 * n:
+            g = int(g * 1.25) + 1
+    edges_x = np.linspace(bx0, bx1, g + 1)
+    edges_y = np.linspace(by0, by1, g + 1)
+    cx0 = np.clip(np.searchsorted(edges_x, x0, 'right') - 1, 0, g - 1)
+    cx1 = np.clip(np.searchsorted(edges_x, x1, 'left') - 1, 0, g - 1)
+    cy0 = np.clip(np.searchsorted(edges_y, y0, 'right') - 1, 0, g - 1)
+    cy1 = np.clip(np.searchsorted(edges_y, y1, 'left') - 1, 0, g - 1)
+
+    # One entry per (rectangle, cell) it overlaps, clipped to the cell
+    span = cx1 - cx0 + 1
+    counts = span * (cy1 - cy0 + 1)
+    source = np.repeat(np.arange(n), counts)
+    position = np.arange(len(source)) - np.repeat(np.cumsum(counts) - counts, counts)
+    cells = (cy0[source] + position // span[source]) * g + cx0[source] + position % span[source]
+    order = np.argsort(cells, kind='stable')
+    cells, source = cells[order], source[order]
+    cell_x, cell_y = cells % g, cells // g
+    nx0 = np.maximum(x0[source], edges_x[cell_x])
+    nx1 = np.minimum(x1[source], edges_x[cell_x + 1])
+    ny0 = np.maximum(y0[source], edges_y[cell_y])
+    ny1 = np.minimum(y1[source], edges_y[cell_y + 1])
+
+    unique, starts = np.unique(cells, return_index=True)
+    sizes = np.diff(np.append(starts, len(cells)))
+    ux, uy = unique % g, unique // g
+    cell_area = (edges_x[ux + 1] - edges_x[ux]) * (edges_y[uy + 1] - edges_y[uy])
+    full = np.logical_or.reduceat((nx0 <= edges_x[cell_x]) & (ny0 <= edges_y[cell_y])
+                                  & (nx1 >= edges_x[cell_x + 1]) & (ny1 >= edges_y[cell_y + 1]),
+                                  starts)
+    total += float(cell_area[full].sum())
+
+    # Cells with few rectangles are swept together, grouped by size to limit padding
+    lower = 0
+    size = 8
+    while lower < LEAF_SIZE:
+        size = min(size, LEAF_SIZE)
+        chosen = np.flatnonzero(~full & (sizes > lower) & (sizes <= size))
+        # Bound the stacked grids to about 2M cells per batch
+        batch = max(1, (1 << 21) // (4 * size * size))
+        for first in range(0, len(chosen), batch):
+            group = chosen[first:first + batch]
+            entry_counts = sizes[group]
+            entries = np.repeat(starts[group], entry_counts) + (
+                np.arange(entry_counts.sum()) - np.repeat(np.cumsum(entry_counts) - entry_counts, entry_counts))
+            cell = np.repeat(np.arange(len(group)), entry_counts)
+            slot = entries - np.repeat(starts[group], entry_counts)
+            total += _sweep_batch(nx0[entries], ny0[entries], nx1[entries], ny1[entries],
+                                  cell, slot, len(group), edges_x[ux[group] + 1],
+                                  edges_y[uy[group] + 1], size)
+        lower = size
+        size *= 2
+
+    # Crowded cells are split again
+    for i in np.flatnonzero(~full & (sizes > LEAF_SIZE)).tolist():
+        s, e = starts[i], starts[i] + sizes[i]
+        total += _union(nx0[s:e], ny0[s:e], nx1[s:e], ny1[s:e],
+                        (edges_x[ux[i]], edges_y[uy[i]], edges_x[ux[i] + 1], edges_y[uy[i] + 1]),
+                        depth + 1)
+    return total
+
+
+def rectangle_union_area(x0, y0, x1, y1, clip=None):
+    """
+    Return the exact area covered by a set of axis-aligned rectangles.
+
+    Args:
+        x0, y0, x1, y1: Arrays with the corners of each rectangle
+        clip: Only count area inside this (x0, y0, x1, y1) box
+            (default: the bounding box of all rectangles)
+    """
+    x0, y0, x1, y1 = (np.asarray(a, dtype=float) for a in (x0, y0, x1, y1))
+    if clip is None:
+        if not len(x0):
+            return 0.0
+        clip = (x0.min(), y0.min(), x1.max(), y1.max())
+    x0, y0 = np.maximum(x0, clip[0]), np.maximum(y0, clip[1])
+    x1, y1 = np.minimum(x1, clip[2]), np.minimum(y1, clip[3])
+    keep = (x1 > x0) & (y1 > y0)
+    return _union(x0[keep], y0[keep], x1[keep], y1[keep], tuple(float(c) for c in clip), 0)
+
+
+def scanline_union_area(store, rows, clip, resolution=2048):
+    """
+    Return the approximate area covered by circles and rectangles.
+
+    The clip box is cut into resolution horizontal rows. In every row each
+    shape covers one x-interval (a chord for circles), and the union of the
+    intervals is measured exactly. Scan rows are measured in bands of
+    about SCAN_CHUNK intervals, so memory does not grow with the number
+    of shapes times the number of rows.
+
+    Args:
+        store: The ShapeStore holding the shapes
+        rows: Rows of the shapes to measure
+        clip: Only count area inside this (x0, y0, x1, y1) box
+        resolution: Number of scan rows (default: 2048)
+    """
+    bx0, by0, bx1, by1 = clip
+    if not len(rows) or bx1 <= bx0 or by1 <= by0:
+        return 0.0
+    dy = (by1 - by0) / resolution
+    sx0, sy0, sx1, sy1 = store.bounds(rows)
+    # Scan rows whose centers lie inside each shape's vertical extent
+    first = np.maximum(np.ceil((sy0 - by0) / dy - 0.5), 0).astype(np.int64)
+    last = np.minimum(np.floor((sy1 - by0) / dy - 0.5), resolution - 1).astype(np.int64)
+    spanned = last >= first
+    first, last = first[spanned], last[spanned]
+    shapes = (rows[spanned], sx0[spanned], sx1[spanned])
+    # Running count of intervals up to each scan row, to cut the bands
+    starting = np.bincount(first, minlength=resolution + 1)
+    ending = np.bincount(last + 1, minlength=resolution + 1)
+    intervals = np.cumsum(np.cumsum(starting - ending)[:resolution])
+
+    length = 0.0
+    band_start = 0
+    while band_start < resolution:
+        done = intervals[band_start - 1] if band_start else 0
+        band_end = max(int(np.searchsorted(intervals, done + SCAN_CHUNK, side='right')),
+                       band_start + 1)
+        if intervals[band_end - 1] > done:
+            length += _scan_band(store, shapes, first, last, band_start, band_end, clip, dy)
+        band_start = band_end
+    return float(length * dy)
+
+
+def _scan_band(store, shapes, first, last, band_start, band_end, clip, dy):
+    """Return the total length of the union of the intervals in a band of scan rows."""
+    rows, sx0, sx1 = shapes
+    bx0, by0, bx1, _ = clip
+    inside = np.flatnonzero((first < band_end) & (last >= band_start))
+    low = np.maximum(first[inside], band_start)
+    counts = np.minimum(last[inside], band_end - 1) - low + 1
+    source = np.repeat(inside, counts)
+    scan = np.repeat(low, counts) + np.arange(len(source)) - np.repeat(np.cumsum(counts) - counts, counts)
+    center_y = by0 + (scan + 0.5) * dy
+
+    row = rows[source]
+    circle = store.kind[row] == store.CIRCLE
+    radius = store.width[row]
+    half = np.sqrt(np.maximum(radius * radius - (center_y - store.y[row]) ** 2, 0))
+    start = np.where(circle, store.x[row] - half, sx0[source])
+    end = np.where(circle, store.x[row] + half, sx1[source])
+    start = np.maximum(start, bx0)
+    end = np.minimum(end, bx1)
+    keep = end > start
+    start, end, scan = start[keep], end[keep], scan[keep]
+    if not len(start):
+        return 0.0
+
+    # Shift every scan row to its own stretch of the x axis, then take the
+    # union of all intervals in one pass: sort by start and keep a running
+    # maximum of the ends seen so far
+    offset = (scan - band_start) * (2 * (bx1 - bx0) + 1.0)
+    start, end = start - bx0 + offset, end - bx0 + offset
+    order = np.argsort(start, kind='stable')
+    start, end = start[order], end[order]
+    reach = np.maximum.accumulate(end)
+    previous = np.concatenate([[-np.inf], reach[:-1]])
+    return np.maximum(end - np.maximum(start, previous), 0).sum()
+
+
+def union_area(store, rows=None, clip=None, resolution=2048):
+    """
+    Return the area covered by shapes, counting overlaps once.
+
+    The result is exact when all shapes are rectangles, and approximate
+    (see scanline_union_area()) when there are circles. Stroke widths are
+    not included, as in Circle.area() and Rectangle.area().
+
+    Args:
+        store: The ShapeStore holding the shapes
+        rows: Rows to measure (default: all live rows)
+        clip: Only count area inside this (x0, y0, x1, y1) box
+            (default: the bounding box of the shapes)
+        resolution: Number of scan rows for circles (default: 2048)
+    """
+    if rows is None:
+        rows = store.rows()
+    if not len(rows):
+        return 0.0
+    x0, y0, x1, y1 = store.bounds(rows)
+    if clip is None:
+        clip = (x0.min(), y0.min(), x1.max(), y1.max())
+    if np.all(store.kind[rows] == store.RECTANGLE):
+        return rectangle_union_area(x0, y0, x1, y1, clip)
+    return scanline_union_area(store, rows, clip, resolution)
+
+
+def coverage_by_style(store, rows=None, clip=None, resolution=2048):
+    """
+    Return the area covered by the shapes of each fill color.
+
+    Each color's shapes are measured on their own, so areas where shapes
+    of different colors overlap count for every one of those colors.
+
+    Returns:
+        A dict mapping fill color to covered area
+    """
+    if rows is None:
+        rows = store.rows()
+    fills = store.fill_id[rows]
+    result = {}
+    for fill in np.unique(fills).tolist():
+        name = store.styles.name(fill)
+        if not isinstance(name, str):
+            name = tuple(name)
+        result[name] = union_area(store, rows[fills == fill], clip, resolution)
+    return result
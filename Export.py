@@ -0,0 +1,310 @@
+"""
+Batch export of canvases and flags to image files.
+
+Scenes are plain dicts (one JSON object per line on the command line):
+
+    {"type": "canvas", "width": 600, "height": 400, "shapes": [...],
+     "texts": [...], "output": "scene.png", "backend": "raster"}
+    {"type": "flag", "output": "flag.png", "dpi": 300, "figsize": [12, 8]}
+    {"type": "flag", "output": "small.png", "backend": "raster", "width": 300,
+     "palette": {"red": "navy"}}
+
+Canvas scenes use the layout of Canvas.to_scene(). The "backend" is
+"raster" (headless NumPy renderer, the default for PNG when there is no
+text), "svg" (streaming SVG writer, the default for SVG when there is no
+text) or "matplotlib". Flag scenes take an optional "palette" of colors
+by role (see Flag.PALETTE); with the "raster" backend only the flag
+itself is drawn, "width" pixels wide, straight from its compiled
+template. Without an "output" the encoded bytes are returned in the
+result instead of being written to a file.
+
+Rendering is spread over a pool of worker processes. Each worker sets
+up the Agg backend and one reusable figure when it starts. With
+--cache-dir, images are looked up in a RenderCache on disk first, so
+repeated scenes are not rendered again.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# Per-process figure reused by every matplotlib job in a worker
+_figure = None
+
+# Per-process RenderCache used by run_job(), see init_worker()
+_cache = None
+
+
+class ExportResult:
+    """The outcome of one export job."""
+
+    def __init__(self, index, output=None, data=None, seconds=0.0, error=None, invalid=False):
+        """
+        Initialize an ExportResult.
+
+        Args:
+            index: Position of the scene in the input
+            output: Path the image was written to, if any
+            data: Encoded image bytes when the scene had no output path
+            seconds: Wall time spent rendering and encoding
+            error: Traceback text if the job failed, otherwise None
+            invalid: Whether the job failed because the scene itself is
+                invalid (a ValueError, KeyError or TypeError), rather than
+                because of a fault while rendering it
+        """
+        self.index = index
+        self.output = output
+        self.data = data
+        self.seconds = seconds
+        self.error = error
+        self.invalid = invalid
+
+    @property
+    def ok(self):
+        """Whether the job succeeded."""
+        return self.error is None
+
+    def __str__(self):
+        status = "ok" if self.ok else "failed"
+        return f"ExportResult(index={self.index}, {status}, seconds={self.seconds:.3f}, output={self.output})"
+
+
+def warm_up():
+    """Load the Agg backend and create the figure reused by later jobs."""
+    global _figure
+    if _figure is None:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        _figure = plt.figure()
+    return _figure
+
+
+def init_worker(cache_dir=None):
+    """
+    Prepare a worker process: warm up matplotlib and, given a directory,
+    open the on-disk render cache shared by all workers.
+    """
+    global _cache
+    warm_up()
+    if cache_dir is not None:
+        from RenderCache import RenderCache
+        _cache = RenderCache(directory=cache_dir)
+
+
+def build_canvas(scene):
+    """Create a Canvas (or a text Canvas if the scene has text) from a scene."""
+    if scene.get('texts'):
+        from Text import Canvas
+    else:
+        from Canvas import Canvas
+    return Canvas.from_scene(scene)
+
+
+def render_scene(scene, cache=None):
+    """
+    Render one scene description to encoded image bytes.
+
+    Args:
+        scene: A scene dict as described in the module docstring
+        cache: RenderCache to look the image up in and store it to
+            (default: None, always render)
+
+    Returns:
+        The encoded image as bytes
+
+    Raises:
+        ValueError: If the scene type or backend is unknown
+    """
+    if cache is None:
+        return _render_scene(scene)
+    return cache.get_or_render(cache_key(scene), lambda: _render_scene(scene))
+
+
+def cache_key(scene):
+    """Return the RenderCache key of a scene's image."""
+    from RenderCache import scene_key, template_digest
+    if scene.get('type', 'canvas') == 'flag':
+        # The flag is drawn by code, so its source is part of the key
+        return scene_key(scene, template=template_digest('Flag'),
+                         compiler=template_digest('Template'))
+    return scene_key(scene)
+
+
+def _render_scene(scene):
+    scene_type = scene.get('type', 'canvas')
+    image_format = scene.get('format', 'png')
+    dpi = scene.get('dpi', 100)
+
+    if scene_type == 'flag':
+        from Flag import KENYA, render_flag
+        figsize = tuple(scene.get('figsize', (12, 8)))
+        palette = scene.get('palette')
+        if scene.get('backend', 'matplotlib') == 'raster':
+            if image_format != 'png':
+                raise ValueError("The raster backend only writes PNG")
+            return KENYA.render_png(None, scene.get('width', figsize[0] * dpi), palette=palette,
+                                    background='white')
+        fig = warm_up()
+        render_flag(fig, figsize, palette)
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=image_format, dpi=dpi, bbox_inches='tight', facecolor='white')
+        return buffer.getvalue()
+
+    if scene_type != 'canvas':
+        raise ValueError(f"Unknown scene type: {scene_type!r}")
+
+    canvas = build_canvas(scene)
+    default = 'svg' if image_format == 'svg' else 'raster'
+    backend = scene.get('backend', 'matplotlib' if scene.get('texts') else default)
+    if backend == 'raster':
+        if image_format != 'png':
+            raise ValueError("The raster backend only writes PNG")
+        from Raster import encode_png
+        return encode_png(canvas.render_to_array(scale=scene.get('scale', 1.0)))
+    if backend == 'svg':
+        if image_format != 'svg':
+            raise ValueError("The svg backend only writes SVG")
+        buffer = io.BytesIO()
+        canvas.render_to_svg(buffer)
+        return buffer.getvalue()
+    if backend == 'matplotlib':
+        fig = warm_up()
+        canvas.render_figure(fig, batched=True)
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=image_format, dpi=dpi)
+        return buffer.getvalue()
+    raise ValueError(f"Unknown backend: {backend!r}")
+
+
+def run_job(index, scene):
+    """
+    Render a scene and write or return the result, never raising.
+
+    Args:
+        index: Position of the scene in the input
+        scene: The scene description
+
+    Returns:
+        An ExportResult with timing and any error
+    """
+    start = time.perf_counter()
+    output = None
+    try:
+        if not isinstance(scene, dict):
+            raise TypeError(f"A scene must be a JSON object, not {type(scene).__name__}")
+        output = scene.get('output')
+        data = render_scene(scene, _cache)
+        if output:
+            with open(output, 'wb') as f:
+                f.write(data)
+            data = None
+        return ExportResult(index, output, data, time.perf_counter() - start)
+    except Exception as error:
+        return ExportResult(index, output, None, time.perf_counter() - start,
+                            traceback.format_exc(),
+                            isinstance(error, (ValueError, KeyError, TypeError)))
+
+
+def iter_export(scenes, workers=None, cache_dir=None):
+    """
+    Render scenes in worker processes, yielding results as they finish.
+
+    The scenes can be a generator; at most two jobs per worker are queued
+    at a time, so a long stream is never loaded into memory at once. An
+    exception in place of a scene, as read_scenes() yields for a line it
+    cannot parse, is reported as a failed result without being rendered.
+
+    Args:
+        scenes: Iterable of scene dicts
+        workers: Number of worker processes (default: number of CPUs)
+        cache_dir: Directory of a render cache shared by the workers, so
+            repeated scenes are not rendered again (default: None)
+
+    Yields:
+        ExportResult objects, in completion order
+    """
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(cache_dir,)) as pool:
+        pending = set()
+        for index, scene in enumerate(scenes):
+            if isinstance(scene, Exception):
+                yield ExportResult(index, error=''.join(traceback.format_exception_only(scene)),
+                                   invalid=True)
+                continue
+            pending.add(pool.submit(run_job, index, scene))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in pending:
+            yield future.result()
+
+
+def export_batch(scenes, workers=None, cache_dir=None):
+    """
+    Render a batch of scenes in parallel.
+
+    Args:
+        scenes: Iterable of scene dicts
+        workers: Number of worker processes (default: number of CPUs)
+        cache_dir: Directory of a shared render cache (default: None)
+
+    Returns:
+        A list of ExportResult objects in input order
+    """
+    return sorted(iter_export(scenes, workers, cache_dir), key=lambda result: result.index)
+
+
+def read_scenes(stream):
+    """
+    Yield scene dicts from a stream of JSON lines, skipping blank lines.
+
+    A line that is not valid JSON yields the ValueError instead, so one bad
+    line fails only its own scene.
+    """
+    for line in stream:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError as error:
+                yield error
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render scene descriptions to image files.")
+    parser.add_argument('scenes', nargs='?', default='-',
+                        help="JSON-lines file of scenes ('-' for stdin)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument('--cache-dir', default=None,
+                        help="Reuse images rendered before from this cache directory")
+    args = parser.parse_args(argv)
+
+    stream = sys.stdin if args.scenes == '-' else open(args.scenes)
+    start = time.perf_counter()
+    failures = 0
+    count = 0
+    with stream:
+        for result in iter_export(read_scenes(stream), args.workers, args.cache_dir):
+            count += 1
+            print(json.dumps({
+                'index': result.index,
+                'output': result.output,
+                'seconds': round(result.seconds, 4),
+                'error': result.error,
+            }))
+            failures += not result.ok
+    elapsed = time.perf_counter() - start
+    print(f"Exported {count - failures}/{count} scenes in {elapsed:.2f}s", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,90 +1,107 @@
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-import numpy as np
+"""
+The flag of Kenya, described once as a Template.
 
-# Create figure and axis
-fig, ax = plt.subplots(1, 1, figsize=(12, 8))
+The template is compiled when this module is imported. Every render
+after that only scales the compiled outlines to the figure or image
+size and looks up the colors, so drawing many sizes or color variants
+does not run the construction code again:
+
+    KENYA.render_png('flag.png', width=1200)
+    KENYA.render_png('night.png', width=300, palette={'red': 'navy'})
+"""
+from Template import Ellipse, Line, Stripe, Template
 
 # Flag dimensions
 flag_width = 10
 flag_height = 6
 
-# Draw horizontal stripes
-# Black stripe (top)
-black_stripe = patches.Rectangle((0, 4), flag_width, 2, 
-                                  facecolor='black', edgecolor='none')
-ax.add_patch(black_stripe)
-
-# Red stripe (middle)
-red_stripe = patches.Rectangle((0, 2), flag_width, 2, 
-                                facecolor='#BB0000', edgecolor='none')
-ax.add_patch(red_stripe)
-
-# Green stripe (bottom)
-green_stripe = patches.Rectangle((0, 0), flag_width, 2, 
-                                  facecolor='#006600', edgecolor='none')
-ax.add_patch(green_stripe)
-
-# White borders around red stripe
-white_top = patches.Rectangle((0, 3.8), flag_width, 0.2, 
-                               facecolor='white', edgecolor='none')
-white_bottom = patches.Rectangle((0, 2), flag_width, 0.2, 
-                                  facecolor='white', edgecolor='none')
-ax.add_patch(white_top)
-ax.add_patch(white_bottom)
-
-# Central Maasai shield (red)
-shield_center_x = flag_width / 2
-shield_center_y = flag_height / 2
-shield_width = 1.5
-shield_height = 2.5
-
-shield = patches.Ellipse((shield_center_x, shield_center_y), 
-                         shield_width, shield_height,
-                         facecolor='#BB0000', edgecolor='white', linewidth=3)
-ax.add_patch(shield)
-
-# White inner ellipse on shield
-inner_shield = patches.Ellipse((shield_center_x, shield_center_y), 
-                               shield_width * 0.6, shield_height * 0.8,
-                               facecolor='white', edgecolor='none')
-ax.add_patch(inner_shield)
-
-# Black center of shield
-center_shield = patches.Ellipse((shield_center_x, shield_center_y), 
-                                shield_width * 0.4, shield_height * 0.6,
-                                facecolor='black', edgecolor='none')
-ax.add_patch(center_shield)
-
-# Draw two crossed spears (white)
-spear_length = 3.5
-angle1 = np.radians(25)
-angle2 = np.radians(-25)
-
-# Left spear
-x1_start = shield_center_x - spear_length/2 * np.cos(angle1)
-y1_start = shield_center_y - spear_length/2 * np.sin(angle1)
-x1_end = shield_center_x + spear_length/2 * np.cos(angle1)
-y1_end = shield_center_y + spear_length/2 * np.sin(angle1)
-ax.plot([x1_start, x1_end], [y1_start, y1_end], 'white', linewidth=4)
-
-# Right spear
-x2_start = shield_center_x - spear_length/2 * np.cos(angle2)
-y2_start = shield_center_y - spear_length/2 * np.sin(angle2)
-x2_end = shield_center_x + spear_length/2 * np.cos(angle2)
-y2_end = shield_center_y + spear_length/2 * np.sin(angle2)
-ax.plot([x2_start, x2_end], [y2_start, y2_end], 'white', linewidth=4)
-
-# Set limits and remove axes
-ax.set_xlim(0, flag_width)
-ax.set_ylim(0, flag_height)
-ax.set_aspect('equal')
-ax.axis('off')
-
-plt.title('Flag of Kenya', fontsize=16, fontweight='bold', pad=20)
-plt.tight_layout()
-plt.savefig('kenyan_flag.png', dpi=300, bbox_inches='tight', facecolor='white')
-plt.show()
-
-print("Kenyan flag created successfully!")
-print("The flag has been saved as 'kenyan_flag.png'")
+# Color roles of the flag, named after the colors of the real flag
+PALETTE = {'black': 'black', 'red': '#BB0000', 'green': '#006600', 'white': 'white'}
+
+
+def kenya_template():
+    """Describe the flag of Kenya as a Template in a 10 x 6 box."""
+    template = Template(flag_width, flag_height, palette=PALETTE, title='Flag of Kenya')
+
+    # Horizontal stripes, with white borders around the red one
+    template.add(Stripe(4, 2, 'black'))
+    template.add(Stripe(2, 2, 'red'))
+    template.add(Stripe(0, 2, 'green'))
+    template.add(Stripe(3.8, 0.2, 'white'))
+    template.add(Stripe(2, 0.2, 'white'))
+
+    # Central Maasai shield with its white edge, white inner ellipse and
+    # black center
+    shield = template.add(Ellipse(flag_width / 2, flag_height / 2, 1.5, 2.5, 'red',
+                                  stroke='white', stroke_width=0.04))
+    template.add(shield.scaled(0.6, 0.8, 'white'))
+    template.add(shield.scaled(0.4, 0.6, 'black'))
+
+    # Two crossed white spears
+    for angle in (25, -25):
+        template.add(Line.through(shield.cx, shield.cy, 3.5, angle, 'white', 0.05))
+    return template
+
+
+# Compiled once; renders only rescale and recolor it
+KENYA = kenya_template().compile()
+
+
+def draw_flag(ax, palette=None):
+    """
+    Draw the flag of Kenya onto a matplotlib axes.
+
+    Args:
+        ax: The matplotlib axes to draw on
+        palette: Dict of colors overriding PALETTE (default: None)
+    """
+    KENYA.draw(ax, palette)
+
+
+def render_flag(fig, figsize=(12, 8), palette=None):
+    """
+    Draw the titled flag into an existing figure, clearing it first.
+
+    Args:
+        fig: The matplotlib figure to draw into
+        figsize: Size of the figure in inches (default: (12, 8))
+        palette: Dict of colors overriding PALETTE (default: None)
+
+    Returns:
+        The axes the flag was drawn on
+    """
+    fig.clf()
+    fig.set_size_inches(*figsize)
+    ax = fig.add_subplot(1, 1, 1)
+    draw_flag(ax, palette)
+    ax.set_title(KENYA.title, fontsize=16, fontweight='bold', pad=20)
+    fig.tight_layout()
+    return ax
+
+
+if __name__ == "__main__":
+    import io
+
+    import matplotlib.pyplot as plt
+
+    from Export import cache_key
+    from RenderCache import RenderCache
+
+    # Create figure and axis
+    fig = plt.figure()
+    render_flag(fig)
+
+    def encode():
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', dpi=300, bbox_inches='tight', facecolor='white')
+        return buffer.getvalue()
+
+    # The 300-dpi PNG is only encoded again when the flag's code changes
+    cache = RenderCache(directory='.render_cache')
+    scene = {'type': 'flag', 'dpi': 300, 'figsize': [12, 8]}
+    with open('kenyan_flag.png', 'wb') as f:
+        f.write(cache.get_or_render(cache_key(scene), encode))
+    plt.show()
+
+    print("Kenyan flag created successfully!")
+    print("The flag has been saved as 'kenyan_flag.png'")
@@ -0,0 +1,135 @@
+import math
+
+import numpy as np
+
+
+class RectangleBatch:
+    """
+    A batch of rectangles stored as NumPy arrays.
+
+    The methods mirror Rectangle.area(), perimeter(), diagonal() and
+    bounding_box(), but work on every rectangle at once and return arrays.
+    The formulas are evaluated in the same order as the scalar versions, so
+    the results are exactly equal element by element.
+    """
+
+    def __init__(self, width, height):
+        """
+        Initialize a RectangleBatch.
+
+        Args:
+            width: Array-like of rectangle widths
+            height: Array-like of rectangle heights, same length as width
+        """
+        self.width = np.asarray(width)
+        self.height = np.asarray(height)
+        if self.width.shape != self.height.shape:
+            raise ValueError("width and height must have the same shape")
+
+    @classmethod
+    def from_arrays(cls, width, height):
+        """Create a batch from raw width and height arrays."""
+        return cls(width, height)
+
+    @classmethod
+    def from_shapes(cls, rectangles):
+        """
+        Create a batch from a list of rectangle objects.
+
+        Args:
+            rectangles: Objects with width and height attributes, such as any
+                of the Rectangle classes in this project
+        """
+        width = np.array([r.width for r in rectangles])
+        height = np.array([r.height for r in rectangles])
+        return cls(width, height)
+
+    @classmethod
+    def from_store(cls, store):
+        """Create a batch from the rectangles in a ShapeStore, in drawing order."""
+        rows = store.rows()
+        rows = rows[store.kind[rows] == store.RECTANGLE]
+        return cls(store.width[rows], store.height[rows])
+
+    def area(self):
+        """Return the area of every rectangle (width * height)."""
+        return self.width * self.height
+
+    def perimeter(self):
+        """Return the perimeter of every rectangle (2 * (width + height))."""
+        return 2 * (self.width + self.height)
+
+    def diagonal(self):
+        """Return the diagonal of every rectangle (sqrt(width^2 + height^2))."""
+        # float_power calls pow() like Python does; ** 2 would take a squaring
+        # fast path that can differ from math in the last bit
+        return np.sqrt(np.float_power(self.width, 2) + np.float_power(self.height, 2))
+
+    def bounding_box(self):
+        """Return an (n, 2) array of (width, height) pairs."""
+        return np.stack([self.width, self.height], axis=-1)
+
+    def __len__(self):
+        return len(self.width)
+
+    def __str__(self):
+        return f"RectangleBatch(count={len(self)})"
+
+
+class CircleBatch:
+    """
+    A batch of circles stored as a NumPy array of radii.
+
+    The methods mirror Circle.area(), circumference() and diameter() and
+    give exactly the same values as the scalar versions.
+    """
+
+    def __init__(self, radius):
+        """
+        Initialize a CircleBatch.
+
+        Args:
+            radius: Array-like of circle radii
+        """
+        self.radius = np.asarray(radius)
+
+    @classmethod
+    def from_arrays(cls, radius):
+        """Create a batch from a raw array of radii."""
+        return cls(radius)
+
+    @classmethod
+    def from_shapes(cls, circles):
+        """
+        Create a batch from a list of circle objects.
+
+        Args:
+            circles: Objects with a radius attribute, such as any of the
+                Circle classes in this project
+        """
+        return cls(np.array([c.radius for c in circles]))
+
+    @classmethod
+    def from_store(cls, store):
+        """Create a batch from the circles in a ShapeStore, in drawing order."""
+        rows = store.rows()
+        rows = rows[store.kind[rows] == store.CIRCLE]
+        return cls(store.width[rows])
+
+    def area(self):
+        """Return the area of every circle (pi * radius^2)."""
+        return math.pi * np.float_power(self.radius, 2)
+
+    def circumference(self):
+        """Return the circumference of every circle (2 * pi * radius)."""
+        return 2 * math.pi * self.radius
+
+    def diameter(self):
+        """Return the diameter of every circle (2 * radius)."""
+        return 2 * self.radius
+
+    def __len__(self):
+        return len(self.radius)
+
+    def __str__(self):
+        return f"CircleBatch(count={len(self)})"
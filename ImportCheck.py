@@ -0,0 +1,76 @@
+"""
+Guard against matplotlib creeping back into the import path of the model layer.
+
+Each module is imported in a fresh interpreter. The check fails if
+matplotlib got imported, or if the import took longer than the
+budget. Run it with:
+
+    python ImportCheck.py [--budget-ms 400]
+
+The exit status is non-zero when a check fails, so it can run in CI.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Modules that must be importable without loading matplotlib
+MODEL_MODULES = ('Shapes', 'Geometry', 'Spatial', 'Canvas', 'Text', 'Asign5',
+                 'SceneFile', 'SVG', 'TextLayout', 'Profiler', 'RenderCache',
+                 'Tiles', 'LOD', 'Coverage', 'Collision', 'Layout',
+                 'Server', 'RenderContext', 'Animation', 'Labels',
+                 'Template', 'Flag')
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+loaded = sorted(m for m in sys.modules if m == 'matplotlib' or m.startswith('matplotlib.'))
+print(json.dumps({{'seconds': elapsed, 'matplotlib': loaded}}))
+"""
+
+
+def probe(module):
+    """
+    Import a module in a fresh interpreter.
+
+    Returns:
+        A dict with the import time in seconds and the matplotlib modules loaded
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    output = subprocess.run([sys.executable, '-c', _PROBE.format(module=module)],
+                            cwd=here, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def check(modules=MODEL_MODULES, budget_ms=400):
+    """
+    Check that none of the modules import matplotlib and that each one
+    imports within the time budget.
+
+    Returns:
+        A list of failure messages (empty if everything passed)
+    """
+    failures = []
+    for module in modules:
+        result = probe(module)
+        milliseconds = result['seconds'] * 1000
+        print(f"{module:12s} {milliseconds:8.1f} ms")
+        if result['matplotlib']:
+            failures.append(f"{module} imports matplotlib: {', '.join(result['matplotlib'][:3])}")
+        if milliseconds > budget_ms:
+            failures.append(f"{module} took {milliseconds:.0f} ms to import (budget {budget_ms} ms)")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that model modules import without matplotlib.")
+    parser.add_argument('--budget-ms', type=float, default=400,
+                        help="Maximum import time per module in milliseconds (default: 400)")
+    args = parser.parse_args()
+    failures = check(budget_ms=args.budget_ms)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
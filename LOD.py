@@ -0,0 +1,162 @@
+import math
+
+import numpy as np
+
+from Raster import CANVAS_DPI, color_table
+
+
+def viewport_rows(store, rows, viewport):
+    """
+    Return the rows whose shapes (including their stroke) overlap a viewport.
+
+    Args:
+        store: The ShapeStore holding the shapes
+        rows: Rows to consider
+        viewport: (x0, y0, x1, y1) in canvas units
+    """
+    vx0, vy0, vx1, vy1 = viewport
+    x0, y0, x1, y1 = store.bounds(rows)
+    pad = store.stroke_width[rows] * CANVAS_DPI / 144.0
+    return rows[(x0 - pad <= vx1) & (x1 + pad >= vx0) & (y0 - pad <= vy1) & (y1 + pad >= vy0)]
+
+
+class LevelOfDetail:
+    """
+    Settings for the level-of-detail stage of Canvas.render_figure().
+
+    Shapes outside the viewport are dropped. Shapes whose outer size is
+    below min_size pixels are not drawn one by one but summed into a
+    density layer: an image with one pixel per screen pixel ('heatmap'),
+    or one marker per occupied pixel ('points'). Each shape adds its own
+    area and color to its pixel, so dense clouds of tiny shapes keep
+    roughly the tone they would have had.
+    """
+
+    AGGREGATES = ('heatmap', 'points')
+
+    def __init__(self, min_size=1.0, aggregate='heatmap'):
+        """
+        Initialize a LevelOfDetail.
+
+        Args:
+            min_size: Shapes smaller than this many pixels are aggregated
+                (default: 1.0)
+            aggregate: How to draw aggregated shapes, 'heatmap' or 'points'
+                (default: 'heatmap')
+        """
+        if aggregate not in self.AGGREGATES:
+            raise ValueError(f"aggregate must be one of {self.AGGREGATES}, not {aggregate!r}")
+        self.min_size = min_size
+        self.aggregate = aggregate
+        # Counts from the last split(), for diagnostics
+        self.drawn = 0
+        self.culled = 0
+        self.aggregated = 0
+
+    def split(self, store, viewport, pixels_per_unit, rows=None, dpi=CANVAS_DPI):
+        """
+        Divide the shapes into those to draw and those to aggregate.
+
+        Args:
+            store: The ShapeStore holding the shapes
+            viewport: (x0, y0, x1, y1) in canvas units
+            pixels_per_unit: Screen pixels per canvas unit
+            rows: Rows to consider (default: all live rows in drawing order)
+            dpi: Screen pixels per inch, to turn stroke widths in points
+                into pixels (default: 100)
+
+        Returns:
+            (rows to draw, rows to aggregate), both in drawing order
+        """
+        if rows is None:
+            rows = store.rows()
+        visible = viewport_rows(store, rows, viewport)
+        extent = np.where(store.kind[visible] == store.CIRCLE,
+                          2 * store.width[visible],
+                          np.maximum(store.width[visible], store.height[visible]))
+        # Stroke widths are in points, so they do not shrink with the viewport
+        outer = extent * pixels_per_unit + store.stroke_width[visible] * dpi / 72.0
+        tiny = outer < self.min_size
+        self.drawn = int(np.count_nonzero(~tiny))
+        self.aggregated = len(visible) - self.drawn
+        self.culled = len(rows) - len(visible)
+        return visible[~tiny], visible[tiny]
+
+
+def density_image(store, rows, viewport, pixels_per_unit, dpi=CANVAS_DPI):
+    """
+    Sum sub-pixel shapes into an RGBA image with one pixel per screen pixel.
+
+    Each shape adds its fill area and stroke ring area (in square pixels),
+    weighted by color, to the pixel under its center. The pixel color is
+    the area-weighted mean color of its shapes.
+
+    Args:
+        store: The ShapeStore holding the shapes
+        rows: Rows to aggregate
+        viewport: (x0, y0, x1, y1) in canvas units
+        pixels_per_unit: Screen pixels per canvas unit
+        dpi: Screen pixels per inch, to turn stroke widths in points into
+            pixels (default: 100)
+
+    Returns:
+        A float (height, width, 4) straight-alpha RGBA image whose first row
+        is the bottom of the viewport, for imshow(origin='lower')
+    """
+    vx0, vy0, vx1, vy1 = viewport
+    nx = max(math.ceil((vx1 - vx0) * pixels_per_unit), 1)
+    ny = max(math.ceil((vy1 - vy0) * pixels_per_unit), 1)
+    image = np.zeros((ny, nx, 4))
+    if not len(rows):
+        return image
+
+    circle = store.kind[rows] == store.CIRCLE
+    w = store.width[rows] * pixels_per_unit
+    h = store.height[rows] * pixels_per_unit
+    # Screen pixels like w and h; stroke widths are points and do not scale with the view
+    half_line = store.stroke_width[rows] * dpi / 144.0
+    center_x = np.where(circle, store.x[rows], store.x[rows] + store.width[rows] / 2)
+    center_y = np.where(circle, store.y[rows], store.y[rows] + store.height[rows] / 2)
+    inner = np.where(circle, math.pi * w * w, w * h)
+    outer = np.where(circle, math.pi * (w + half_line) ** 2, (w + 2 * half_line) * (h + 2 * half_line))
+
+    colors = color_table(store.styles.names)
+    fill = colors[store.fill_id[rows]]
+    stroke = colors[store.stroke_id[rows]]
+    fill_weight = inner * fill[:, 3]
+    stroke_weight = np.where(half_line > 0, outer - inner, 0.0) * stroke[:, 3]
+
+    ix = np.clip(((center_x - vx0) * pixels_per_unit).astype(np.int64), 0, nx - 1)
+    iy = np.clip(((center_y - vy0) * pixels_per_unit).astype(np.int64), 0, ny - 1)
+    cell = iy * nx + ix
+    coverage = np.bincount(cell, fill_weight + stroke_weight, nx * ny)
+    flat = image.reshape(-1, 4)
+    for channel in range(3):
+        weighted = np.bincount(cell, fill_weight * fill[:, channel] + stroke_weight * stroke[:, channel],
+                               nx * ny)
+        np.divide(weighted, coverage, out=flat[:, channel], where=coverage > 0)
+    # Overlapping shapes do not add up past full cover: for shapes spread
+    # at random, the covered fraction is 1 - exp(-total area)
+    flat[:, 3] = -np.expm1(-coverage)
+    return image
+
+
+def density_extent(image, viewport, pixels_per_unit):
+    """Return the (left, right, bottom, top) extent of a density image in canvas units."""
+    ny, nx = image.shape[:2]
+    return (viewport[0], viewport[0] + nx / pixels_per_unit,
+            viewport[1], viewport[1] + ny / pixels_per_unit)
+
+
+def density_points(image, viewport, pixels_per_unit):
+    """
+    Turn a density image into one point per covered pixel.
+
+    Returns:
+        (x, y, colors) with the pixel centers in canvas units and an (n, 4)
+        RGBA array
+    """
+    iy, ix = np.nonzero(image[..., 3] > 0)
+    x = viewport[0] + (ix + 0.5) / pixels_per_unit
+    y = viewport[1] + (iy + 0.5) / pixels_per_unit
+    return x, y, image[iy, ix]
@@ -0,0 +1,448 @@
+"""
+Batched label rendering from a cached glyph atlas.
+
+Drawing text with one ax.text() call per Text object repeats font
+lookup, layout and glyph rasterization for every label, which dominates
+the render when there are tens of thousands of labels. Here every glyph
+is rasterized once per font (family, size, bold, italic) and resolution
+into a GlyphAtlas, which keeps the pixels of all its glyphs packed in
+flat arrays. A batch of labels is then turned into glyph placements and
+composited into an image buffer with a few array operations, no matter
+how many labels there are.
+
+Labels are laid out like TextLayout.layout_text() measures them, and
+glyphs land on whole pixels. Where labels overlap, the coverage of their
+glyphs is combined and each pixel takes the color of the label drawn
+last. Overlapping labels can also be dropped (the first one wins) or
+merged into one label per group, see select_labels().
+"""
+from collections import OrderedDict
+from itertools import product
+
+import numpy as np
+
+from TextLayout import CANVAS_DPI, default_cache, find_font, font_key
+
+# Glyph pixels composited at a time, which bounds the memory of a batch
+CHUNK_PIXELS = 1 << 22
+
+OVERLAP_MODES = (None, 'drop', 'merge')
+
+
+class GlyphAtlas:
+    """
+    Glyph bitmaps rasterized once per font and character.
+
+    The non-zero pixels of every glyph are stored one after the other in
+    flat arrays (column, row, coverage), with per-glyph start, count and
+    offset arrays alongside, so placements of many different glyphs can
+    be expanded into pixels with array arithmetic. When more than
+    max_glyphs glyphs would be kept the atlas starts over.
+    """
+
+    def __init__(self, dpi=CANVAS_DPI, max_glyphs=16384):
+        """
+        Initialize an empty GlyphAtlas.
+
+        Args:
+            dpi: Resolution glyphs are rasterized at; at the default of 100
+                one pixel is one canvas unit
+            max_glyphs: Number of glyphs kept before the atlas is cleared
+                (default: 16384)
+        """
+        self.dpi = dpi
+        self.max_glyphs = max_glyphs
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def clear(self):
+        """Drop every glyph."""
+        self._ids = {}
+        self._fonts = {}
+        self._bitmaps = []  # (columns, rows, coverage) of glyphs not packed yet
+        self._left = []
+        self._top = []
+        self.start = np.zeros(0, dtype=np.int64)
+        self.count = np.zeros(0, dtype=np.int64)
+        self.left = np.zeros(0)
+        self.top = np.zeros(0)
+        self.width = np.zeros(0, dtype=np.int64)
+        self.height = np.zeros(0, dtype=np.int64)
+        self.columns = np.zeros(0, dtype=np.int32)
+        self.rows = np.zeros(0, dtype=np.int32)
+        self.coverage = np.zeros(0, dtype=np.float32)
+
+    def _font(self, key):
+        font = self._fonts.get(key)
+        if font is None:
+            font = self._fonts[key] = find_font(key)
+        return font
+
+    def _rasterize(self, key, char):
+        """Return (columns, rows, coverage, left, top) of one glyph."""
+        from matplotlib.backends.backend_agg import get_hinting_flag
+        font = self._font(key)
+        # The font objects are shared with matplotlib, so always set the size
+        font.set_size(key[1], self.dpi)
+        font.set_text(char, 0, flags=get_hinting_flag())
+        font.draw_glyphs_to_bitmap(antialiased=True)
+        image = np.asarray(font.get_image())
+        rows, columns = np.nonzero(image)
+        coverage = image[rows, columns].astype(np.float32) / 255
+        # The image starts at the left edge of the glyph's box, and the
+        # baseline is one pixel below the top of the box
+        left = font.get_bitmap_offset()[0] / 64
+        top = -((font.get_width_height()[1] - font.get_descent()) / 64 + 1)
+        return columns.astype(np.int32), rows.astype(np.int32), coverage, left, top
+
+    def glyph(self, key, char):
+        """
+        Return the id of a glyph, rasterizing it on first use.
+
+        Args:
+            key: Font settings as returned by TextLayout.font_key()
+            char: A single character
+        """
+        entry = (key, char)
+        glyph_id = self._ids.get(entry)
+        if glyph_id is not None:
+            self.hits += 1
+            return glyph_id
+        self.misses += 1
+        columns, rows, coverage, left, top = self._rasterize(key, char)
+        glyph_id = self._ids[entry] = len(self._ids)
+        self._bitmaps.append((columns, rows, coverage))
+        self._left.append(left)
+        self._top.append(top)
+        return glyph_id
+
+    def reserve(self, count):
+        """
+        Make room for count more glyphs: if the atlas would grow past
+        max_glyphs, it starts over. Call it before looking up a batch, so
+        ids handed out for the batch stay valid.
+        """
+        if len(self._ids) + count > self.max_glyphs:
+            self.clear()
+
+    def pack(self):
+        """Append the glyphs rasterized since the last call to the flat arrays."""
+        if not self._bitmaps:
+            return
+        counts = np.array([len(bitmap[2]) for bitmap in self._bitmaps], dtype=np.int64)
+        self.start = np.concatenate([self.start, len(self.coverage) + np.cumsum(counts) - counts])
+        self.count = np.concatenate([self.count, counts])
+        self.columns = np.concatenate([self.columns] + [bitmap[0] for bitmap in self._bitmaps])
+        self.rows = np.concatenate([self.rows] + [bitmap[1] for bitmap in self._bitmaps])
+        self.coverage = np.concatenate([self.coverage] + [bitmap[2] for bitmap in self._bitmaps])
+        self.width = np.concatenate([self.width, [bitmap[0].max(initial=-1) + 1
+                                                  for bitmap in self._bitmaps]]).astype(np.int64)
+        self.height = np.concatenate([self.height, [bitmap[1].max(initial=-1) + 1
+                                                    for bitmap in self._bitmaps]]).astype(np.int64)
+        self.left = np.array(self._left)
+        self.top = np.array(self._top)
+        self._bitmaps = []
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __str__(self):
+        return f"GlyphAtlas(dpi={self.dpi}, glyphs={len(self)}, pixels={len(self.coverage)})"
+
+
+# Atlases shared by all renders, one per resolution
+_atlases = OrderedDict()
+
+
+def atlas_for(dpi):
+    """Return the shared GlyphAtlas for a resolution, keeping the last few used."""
+    atlas = _atlases.get(dpi)
+    if atlas is None:
+        atlas = _atlases[dpi] = GlyphAtlas(dpi)
+        if len(_atlases) > 4:
+            _atlases.popitem(last=False)
+    _atlases.move_to_end(dpi)
+    return atlas
+
+
+# Where the anchor sits across the width of a label, per alignment
+_ALIGN = {'left': 0.0, 'center': 0.5, 'right': 1.0}
+
+
+def _measure(texts, contents=None, atlas=None):
+    """
+    Lay out many labels at once, in canvas units relative to their anchors.
+
+    The result matches TextLayout.layout_text() (without wrapping), but
+    the advances are looked up once per distinct font and character and
+    the rest is array arithmetic, so the cost per label stays small.
+
+    Args:
+        texts: List of Text objects
+        contents: Strings to draw instead of the texts' own content
+        atlas: GlyphAtlas to look the glyphs up in (default: None, only
+            measure the boxes)
+
+    Returns:
+        (boxes, glyphs): boxes is an (n, 4) array of (x0, y0, x1, y1) with
+        y growing downwards from the anchor; glyphs is None without an
+        atlas, otherwise (ids, x, y, owner) with the atlas id of every
+        visible character, its pen position on the baseline and its label
+    """
+    n = len(texts)
+    if contents is None:
+        contents = [text.content for text in texts]
+    keys = {}
+    key_ids = np.fromiter((keys.setdefault(font_key(text), len(keys)) for text in texts),
+                          dtype=np.int64, count=n)
+    align = np.fromiter((_ALIGN.get(text.alignment, 0.0) for text in texts), dtype=float, count=n)
+    lines = []
+    line_counts = np.empty(n, dtype=np.int64)
+    for i, content in enumerate(contents):
+        parts = str(content).split('\n')
+        lines.extend(parts)
+        line_counts[i] = len(parts)
+
+    first_line = np.cumsum(line_counts) - line_counts
+    line_owner = np.repeat(np.arange(n), line_counts)
+    line_index = np.arange(len(lines)) - first_line[line_owner]
+    lengths = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+    line_start = np.cumsum(lengths) - lengths
+    codes = np.frombuffer(''.join(lines).encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+    char_line = np.repeat(np.arange(len(lines)), lengths)
+
+    # One advance (and glyph) lookup per distinct font and character
+    font_keys = list(keys)
+    pairs, inverse = np.unique((key_ids[line_owner[char_line]] << 32) | codes, return_inverse=True)
+    pairs = [(font_keys[pair >> 32], chr(pair & 0xffffffff)) for pair in pairs.tolist()]
+    advance = np.array([default_cache.advance(key, char) for key, char in pairs])[inverse]
+    total = np.concatenate([[0.0], np.cumsum(advance)])
+    widths = total[line_start + lengths] - total[line_start]
+    text_width = np.maximum.reduceat(widths, first_line) if n else np.zeros(0)
+
+    ascent, descent, line_height = np.array([default_cache.vertical_metrics(key)
+                                             for key in font_keys]).reshape(-1, 3)[key_ids].T
+    height = ascent + descent + line_height * (line_counts - 1)
+    x0 = -align * text_width
+    boxes = np.stack([x0, -height, x0 + text_width, np.zeros(n)], axis=1)
+    if atlas is None:
+        return boxes, None
+
+    owner = line_owner[char_line]
+    pen_x = (x0[owner] + align[owner] * (text_width[owner] - widths[char_line])
+             + total[:-1] - total[line_start[char_line]])
+    baseline = (ascent - height)[line_owner] + line_index * line_height[line_owner]
+    pen_y = baseline[char_line]
+    atlas.reserve(len(pairs))
+    ids = np.array([-1 if char.isspace() else atlas.glyph(key, char) for key, char in pairs],
+                   dtype=np.int64)[inverse]
+    atlas.pack()
+    visible = ids >= 0
+    return boxes, (ids[visible], pen_x[visible], pen_y[visible], owner[visible])
+
+
+def label_boxes(texts, anchors, dpi=CANVAS_DPI, contents=None):
+    """
+    Return the boxes of labels in pixels.
+
+    Args:
+        texts: List of Text objects
+        anchors: (n, 2) array of the pixel position of each text's (x, y),
+            with pixel rows growing downwards
+        dpi: Resolution of the pixels (default: 100)
+        contents: Strings to measure instead of the texts' own content
+
+    Returns:
+        An (n, 4) array of (x0, y0, x1, y1) with y0 the top row
+    """
+    boxes = _measure(texts, contents)[0] * (dpi / CANVAS_DPI)
+    anchors = np.asarray(anchors, dtype=float).reshape(-1, 2)
+    boxes[:, 0::2] += anchors[:, :1]
+    boxes[:, 1::2] += anchors[:, 1:]
+    return boxes
+
+
+def _drop_overlapping(boxes):
+    """
+    Keep boxes in order, leaving out each box that overlaps one kept before.
+
+    Kept boxes are registered in a grid of cells about one box in size,
+    so every box is only compared with the kept boxes near it. Unlike a
+    search for all overlapping pairs, the cost does not grow with how
+    crowded the labels are.
+
+    Returns:
+        The indices of the kept boxes
+    """
+    x0, y0, x1, y1 = boxes.T
+    size = max(float(np.median(x1 - x0)), float(np.median(y1 - y0)), 1e-9)
+    cells = np.floor(boxes / size).astype(np.int64).tolist()
+    left, top, right, bottom = x0.tolist(), y0.tolist(), x1.tolist(), y1.tolist()
+    grid = {}
+    kept = []
+    for i, (cx0, cy0, cx1, cy1) in enumerate(cells):
+        near = [k for cell in product(range(cx0, cx1 + 1), range(cy0, cy1 + 1))
+                for k in grid.get(cell, ())]
+        if any(left[i] < right[k] and left[k] < right[i] and top[i] < bottom[k] and top[k] < bottom[i]
+               for k in near):
+            continue
+        kept.append(i)
+        for cell in product(range(cx0, cx1 + 1), range(cy0, cy1 + 1)):
+            grid.setdefault(cell, []).append(i)
+    return np.array(kept, dtype=np.int64)
+
+
+def _groups(n, a, b):
+    """Label the connected groups of n items joined by pairs (a, b), by their lowest item."""
+    group = np.arange(n)
+    while True:
+        low = np.minimum(group[a], group[b])
+        joined = group.copy()
+        np.minimum.at(joined, a, low)
+        np.minimum.at(joined, b, low)
+        joined = joined[joined]
+        if np.array_equal(joined, group):
+            return group
+        group = joined
+
+
+def select_labels(texts, boxes, overlap):
+    """
+    Resolve overlapping labels.
+
+    With 'drop', labels are taken in order and a label is left out when it
+    overlaps one that was kept. With 'merge', every group of labels that
+    overlap each other (directly or through others) is drawn as its first
+    label, with the number of labels it stands in for appended, such as
+    'Paris (+3)'.
+
+    Args:
+        texts: List of Text objects
+        boxes: Their boxes as returned by label_boxes()
+        overlap: None to keep every label, 'drop' or 'merge'
+
+    Returns:
+        (indices, contents): the positions of the labels to draw and the
+        text to draw for each of them
+    """
+    if overlap not in OVERLAP_MODES:
+        raise ValueError(f"overlap must be one of {OVERLAP_MODES}, not {overlap!r}")
+    n = len(texts)
+    if overlap is None or n < 2:
+        return np.arange(n), [text.content for text in texts]
+
+    if overlap == 'drop':
+        indices = _drop_overlapping(boxes)
+        return indices, [texts[i].content for i in indices.tolist()]
+
+    # The boxes go through the shape overlap detection as rectangles
+    from Collision import overlapping_pairs
+    from Shapes import ShapeStore
+    store = ShapeStore(n)
+    style = store.styles.intern('none')
+    x0, y0, x1, y1 = boxes.T
+    store.extend(np.full(n, store.RECTANGLE, dtype=np.int8), x0, y0, x1 - x0, y1 - y0,
+                 np.zeros(n), np.full(n, style), np.full(n, style))
+    a, b = overlapping_pairs(store)
+    group = _groups(n, a, b)
+    sizes = np.bincount(group, minlength=n)
+    indices = np.flatnonzero(group == np.arange(n))
+    contents = [texts[i].content if size == 1 else f"{texts[i].content} (+{size - 1})"
+                for i, size in zip(indices.tolist(), sizes[indices].tolist())]
+    return indices, contents
+
+
+def composite_labels(buffer, texts, anchors, dpi=CANVAS_DPI, overlap=None, atlas=None):
+    """
+    Draw a batch of labels into a premultiplied RGBA float buffer.
+
+    Args:
+        buffer: (H, W, 4) float32 buffer, as made by Raster.new_buffer()
+        texts: List of Text objects, drawn in order
+        anchors: (n, 2) array of the pixel position of each text's (x, y),
+            with pixel rows growing downwards
+        dpi: Resolution to draw the fonts at; 100 draws one canvas unit
+            per pixel (default: 100)
+        overlap: None to draw every label, or 'drop' or 'merge' overlapping
+            labels, see select_labels() (default: None)
+        atlas: GlyphAtlas to draw from; its resolution is used instead of
+            dpi (default: the shared atlas for dpi)
+
+    Returns:
+        The number of labels drawn
+    """
+    from Raster import color_table
+
+    if atlas is None:
+        atlas = atlas_for(dpi)
+    anchors = np.asarray(anchors, dtype=float).reshape(-1, 2)
+    contents = None
+    if overlap is not None:
+        indices, contents = select_labels(texts, label_boxes(texts, anchors, atlas.dpi), overlap)
+        texts = [texts[i] for i in indices.tolist()]
+        anchors = anchors[indices]
+    if not texts:
+        return 0
+
+    factor = atlas.dpi / CANVAS_DPI
+    glyphs, pen_x, pen_y, owner = _measure(texts, contents, atlas)[1]
+    if not len(glyphs):
+        # Only empty or blank labels: the buffer keeps its background
+        return len(texts)
+    styles = {}
+    label_style = np.fromiter((styles.setdefault(text.color if isinstance(text.color, str)
+                                                 else tuple(text.color), len(styles))
+                               for text in texts), dtype=np.int64, count=len(texts))
+    colors = color_table(list(styles)).astype(np.float32)
+    opacity = colors[:, 3].copy()
+    colors[:, 3] = 1.0
+    # With a single color the topmost label of each pixel does not matter
+    several = len(styles) > 1
+    translucent = bool((opacity < 1).any())
+
+    height, width = buffer.shape[:2]
+    index = np.int32 if height * width < 2**31 else np.int64
+    coverage = np.zeros(height * width, dtype=np.float32)
+    topmost = np.zeros(height * width if several else 0, dtype=index)
+    x = np.rint(anchors[owner, 0] + pen_x * factor + atlas.left[glyphs]).astype(index)
+    y = np.rint(anchors[owner, 1] + pen_y * factor + atlas.top[glyphs]).astype(index)
+    owner = owner.astype(index)
+    # Every placement of a glyph adds the same pixel offsets to its own
+    # position, so each glyph is drawn everywhere at once
+    order = np.argsort(glyphs, kind='stable')
+    splits = np.flatnonzero(np.diff(glyphs[order])) + 1
+    for placed in np.split(order, splits):
+        glyph = glyphs[placed[0]]
+        if not atlas.count[glyph]:
+            continue
+        pixels = slice(atlas.start[glyph], atlas.start[glyph] + atlas.count[glyph])
+        columns, rows = atlas.columns[pixels].astype(index), atlas.rows[pixels].astype(index)
+        offsets = rows * width + columns
+        step = max(CHUNK_PIXELS // len(offsets), 1)
+        for lo in range(0, len(placed), step):
+            part = placed[lo:lo + step]
+            gx, gy = x[part], y[part]
+            pixel = (gy * width + gx)[:, None] + offsets
+            value = atlas.coverage[pixels]
+            value = (value * opacity[label_style[owner[part]], None] if translucent
+                     else np.broadcast_to(value, pixel.shape))
+            # Labels are numbered from 1 so that 0 means no label
+            label = np.broadcast_to(owner[part, None] + 1, pixel.shape)
+            inside = ((gx >= 0) & (gy >= 0) & (gx + atlas.width[glyph] <= width)
+                      & (gy + atlas.height[glyph] <= height))
+            if not inside.all():
+                # Only glyphs cut by the edge need each pixel checked
+                px, py = gx[:, None] + columns, gy[:, None] + rows
+                keep = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+                pixel, label, value = pixel[keep], label[keep], value[keep]
+            np.maximum.at(coverage, pixel.ravel(), value.ravel())
+            if several:
+                np.maximum.at(topmost, pixel.ravel(), label.ravel())
+
+    drawn = np.flatnonzero(coverage)
+    alpha = coverage[drawn, None]
+    color = colors[label_style[topmost[drawn] - 1]] if several else colors[0]
+    pixels = buffer.reshape(-1, 4)
+    pixels[drawn] = pixels[drawn] * (1 - alpha) + alpha * color
+    return len(texts)
@@ -0,0 +1,97 @@
+"""
+Compact layouts for previewing many shapes at once.
+
+Shapes are packed onto shelves: sorted by height, tallest first, and
+placed left to right on a shelf until it is full, after which a new
+shelf starts on top of it. The shelf width is chosen so the whole
+layout comes out close to a target aspect ratio. Sorting dominates the
+cost, so laying out n shapes takes O(n log n).
+"""
+import math
+
+import numpy as np
+
+
+def shelf_pack(widths, heights, aspect=1.0, gap=0.0):
+    """
+    Pack boxes onto shelves.
+
+    Args:
+        widths: Array-like of box widths
+        heights: Array-like of box heights
+        aspect: Target width / height of the whole layout (default: 1.0)
+        gap: Space between neighbouring boxes and shelves (default: 0.0)
+
+    Returns:
+        (x, y, width, height): arrays with the lower-left corner of every
+        box, in the order given, and the size of the whole layout
+    """
+    widths = np.asarray(widths, dtype=float)
+    heights = np.asarray(heights, dtype=float)
+    n = len(widths)
+    x = np.zeros(n)
+    y = np.zeros(n)
+    if n == 0:
+        return x, y, 0.0, 0.0
+
+    order = np.argsort(-heights, kind='stable')
+    padded_w = widths[order] + gap
+    padded_h = heights[order] + gap
+    # A square-ish target: the area the boxes need, spread at the aspect
+    # ratio, but never narrower than the widest box
+    area = float(np.dot(padded_w, padded_h))
+    shelf_width = max(math.sqrt(area * aspect), float(padded_w.max()))
+
+    # Next-fit: each shelf takes boxes until the next one would overflow.
+    # The running total of widths finds every shelf end with one search.
+    ends = np.cumsum(padded_w)
+    left = np.empty(n)
+    bottom = np.empty(n)
+    start = 0
+    level = 0.0
+    while start < n:
+        offset = ends[start - 1] if start else 0.0
+        stop = max(int(np.searchsorted(ends, offset + shelf_width, 'right')), start + 1)
+        left[start:stop] = ends[start:stop] - padded_w[start:stop] - offset
+        bottom[start:stop] = level
+        # The first box on a shelf is the tallest one on it
+        level += padded_h[start]
+        start = stop
+
+    x[order] = left
+    y[order] = bottom
+    width = float((left + padded_w).max()) - gap
+    return x, y, width, float(level) - gap
+
+
+def layout_shapes(shapes, aspect=1.0, gap=0.0):
+    """
+    Compute a compact layout for a list of shapes.
+
+    Circles are recognised by their radius attribute and take up a square
+    of their diameter, so any of the Circle/Rectangle classes in this
+    project can be passed in. The shapes themselves are not moved.
+
+    Args:
+        shapes: List of Circle and/or Rectangle objects
+        aspect: Target width / height of the whole layout (default: 1.0)
+        gap: Space between neighbouring shapes (default: 0.0)
+
+    Returns:
+        (x, y, width, height): arrays with the position of every shape (the
+        center of a circle, the lower-left corner of a rectangle) and the
+        size of the whole layout
+    """
+    n = len(shapes)
+    radius = np.fromiter((getattr(s, 'radius', np.nan) for s in shapes), dtype=float, count=n)
+    is_circle = ~np.isnan(radius)
+    widths = np.where(is_circle, 2 * radius,
+                      np.fromiter((0.0 if c else s.width for s, c in zip(shapes, is_circle)),
+                                  dtype=float, count=n))
+    heights = np.where(is_circle, 2 * radius,
+                       np.fromiter((0.0 if c else s.height for s, c in zip(shapes, is_circle)),
+                                   dtype=float, count=n))
+    x, y, width, height = shelf_pack(widths, heights, aspect, gap)
+    x = np.where(is_circle, x + radius, x)
+    y = np.where(is_circle, y + radius, y)
+    return x, y, width, height
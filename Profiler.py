@@ -0,0 +1,206 @@
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def count_artists(fig):
+    """Return the number of artists on all axes of a figure."""
+    if fig is None:
+        return 0
+    return sum(len(ax.get_children()) for ax in fig.axes) + len(fig.texts)
+
+
+def _max_rss_bytes():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux and the BSDs kilobytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def rss_bytes():
+    """
+    Return the current resident memory of the process, or the peak where
+    the current value is not available (outside Linux), or None.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return _max_rss_bytes()
+
+
+class PhaseStats:
+    """Measurements for one phase of a render."""
+
+    def __init__(self, name, seconds=0.0, artists=0, peak_bytes=None):
+        """
+        Initialize a PhaseStats.
+
+        Args:
+            name: Name of the phase, such as 'artists' or 'layout'
+            seconds: Wall time spent in the phase
+            artists: Change in the number of artists on the figure during
+                the phase (negative when the phase clears the figure)
+            peak_bytes: Peak traced Python memory during the phase, or None
+                if memory tracking is off
+        """
+        self.name = name
+        self.seconds = seconds
+        self.artists = artists
+        self.peak_bytes = peak_bytes
+
+    def as_dict(self):
+        return {'name': self.name, 'seconds': self.seconds, 'artists': self.artists,
+                'peak_bytes': self.peak_bytes}
+
+    def __str__(self):
+        return f"PhaseStats({self.name}, seconds={self.seconds:.4f}, artists={self.artists})"
+
+
+class RenderStats:
+    """Measurements for one render, phase by phase."""
+
+    def __init__(self, kind, shapes=0):
+        """
+        Initialize a RenderStats.
+
+        Args:
+            kind: What was rendered: 'figure' or 'raster'
+            shapes: Number of shapes on the canvas
+        """
+        self.kind = kind
+        self.shapes = shapes
+        self.phases = []
+        self.artists = 0  # Artists on the figure once the render finished
+        self.max_rss_bytes = None  # Peak resident memory of the process so far
+
+    @property
+    def seconds(self):
+        """Total wall time of all phases."""
+        return sum(phase.seconds for phase in self.phases)
+
+    @property
+    def peak_bytes(self):
+        """Highest traced memory of any phase, or None if tracking was off."""
+        peaks = [phase.peak_bytes for phase in self.phases if phase.peak_bytes is not None]
+        return max(peaks) if peaks else None
+
+    def phase(self, name):
+        """Return the stats of a phase by name, or None."""
+        for phase in self.phases:
+            if phase.name == name:
+                return phase
+        return None
+
+    def as_dict(self):
+        """Return the measurements as plain data, e.g. for a metrics pipeline."""
+        return {
+            'kind': self.kind,
+            'shapes': self.shapes,
+            'seconds': self.seconds,
+            'artists': self.artists,
+            'peak_bytes': self.peak_bytes,
+            'max_rss_bytes': self.max_rss_bytes,
+            'phases': [phase.as_dict() for phase in self.phases],
+        }
+
+    def __str__(self):
+        phases = ', '.join(f"{phase.name}={phase.seconds * 1000:.1f}ms" for phase in self.phases)
+        return f"RenderStats({self.kind}, shapes={self.shapes}, {phases})"
+
+
+class RenderProfiler:
+    """
+    Collects per-phase timings of canvas renders.
+
+    Attach one to a canvas to enable it:
+
+        canvas.profiler = RenderProfiler(on_phase_end=print)
+        canvas.display()
+        print(canvas.profiler.last)
+
+    A canvas without a profiler (the default) skips all of this.
+    """
+
+    def __init__(self, on_phase_start=None, on_phase_end=None, on_render_end=None,
+                 track_memory=False, include_draw=True):
+        """
+        Initialize a RenderProfiler.
+
+        Args:
+            on_phase_start: Called with the phase name when a phase starts
+            on_phase_end: Called with the PhaseStats when a phase ends
+            on_render_end: Called with the RenderStats when a render ends
+            track_memory: Measure peak Python memory per phase with
+                tracemalloc, which slows rendering down noticeably (default: False)
+            include_draw: Also draw the figure with its backend as a final
+                'draw' phase of Canvas.render_figure(), so backend time is
+                measured too (default: True)
+        """
+        self.on_phase_start = on_phase_start
+        self.on_phase_end = on_phase_end
+        self.on_render_end = on_render_end
+        self.track_memory = track_memory
+        self.include_draw = include_draw
+        self.last = None  # RenderStats of the most recent render
+        self.renders = 0
+        self._current = None
+        self._fig = None
+
+    @contextmanager
+    def render(self, kind, fig=None, shapes=0):
+        """
+        Measure one render. Phases are measured inside it with phase().
+
+        Args:
+            kind: What is rendered: 'figure' or 'raster'
+            fig: The figure being drawn into, used to count artists
+            shapes: Number of shapes on the canvas
+        """
+        stats = RenderStats(kind, shapes)
+        self._current = stats
+        self._fig = fig
+        started_tracing = self.track_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        try:
+            yield stats
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+            stats.artists = count_artists(fig)
+            stats.max_rss_bytes = _max_rss_bytes()
+            self._current = None
+            self._fig = None
+            self.last = stats
+            self.renders += 1
+        if self.on_render_end is not None:
+            self.on_render_end(stats)
+
+    @contextmanager
+    def phase(self, name):
+        """Measure one phase of the current render."""
+        if self.on_phase_start is not None:
+            self.on_phase_start(name)
+        tracing = self.track_memory and tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        artists = count_artists(self._fig)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] if tracing else None
+            phase = PhaseStats(name, seconds, count_artists(self._fig) - artists, peak)
+            self._current.phases.append(phase)
+        if self.on_phase_end is not None:
+            self.on_phase_end(phase)
@@ -0,0 +1,551 @@
+import math
+import struct
+import zlib
+
+import numpy as np
+
+# Canvas units are pixels at 100 dpi (the size display() uses), while
+# stroke widths are in points like matplotlib line widths
+CANVAS_DPI = 100
+
+
+def color_table(names):
+    """
+    Convert a list of colors to an (n, 4) float array of RGBA values.
+
+    Only matplotlib.colors is used, so no figure or backend is created.
+    """
+    from matplotlib.colors import to_rgba_array
+    if not names:
+        return np.zeros((0, 4))
+    return to_rgba_array(names)
+
+
+def new_buffer(width, height, background='white'):
+    """
+    Create a premultiplied RGBA float buffer filled with a background color.
+
+    Args:
+        width: Width of the buffer in pixels
+        height: Height of the buffer in pixels
+        background: Background color (default: 'white')
+    """
+    r, g, b, a = color_table([background])[0]
+    buffer = np.empty((height, width, 4), dtype=np.float32)
+    buffer[...] = (r * a, g * a, b * a, a)
+    return buffer
+
+
+def _blend(buffer, iy0, ix0, coverage, color, opacity):
+    """
+    Composite a color over part of the buffer with per-pixel coverage.
+
+    Args:
+        color: float32 array (r, g, b, 1)
+        opacity: Alpha of the color
+    """
+    alpha = coverage[..., None]
+    if opacity != 1.0:
+        alpha = alpha * np.float32(opacity)
+    region = buffer[iy0:iy0 + coverage.shape[0], ix0:ix0 + coverage.shape[1]]
+    region *= 1 - alpha
+    region += alpha * color
+
+
+def _coverage(distance, antialias):
+    """Turn a signed distance in pixels (negative inside) into coverage."""
+    if antialias:
+        coverage = np.float32(0.5) - distance
+        np.maximum(coverage, 0, out=coverage)
+        return np.minimum(coverage, 1, out=coverage)
+    return (distance <= 0).astype(np.float32)
+
+
+def _distance(px, py, circle, center_x, center_y, half_w, half_h):
+    """Signed distance in pixels from pixel centers to the edges of shapes."""
+    dx = np.abs(px - center_x)
+    dy = np.abs(py - center_y)
+    # Chebyshev distance keeps rectangle corners square (miter joins)
+    return np.where(circle, np.sqrt(dx * dx + dy * dy) - half_w, np.maximum(dx - half_w, dy - half_h))
+
+
+# Pixels of shape bounding boxes drawn in one batch, which bounds the
+# memory of a batch; larger shapes are drawn on their own
+CHUNK_PIXELS = 1 << 20
+
+
+def rasterize(store, width, height, background='white', scale=1.0, antialias=True,
+              rows=None, buffer=None, clip=None, origin=None):
+    """
+    Draw the shapes of a ShapeStore into a premultiplied RGBA float buffer.
+
+    Shapes are drawn in order, fill first and then stroke, the same way the
+    matplotlib patches are drawn by Canvas.display(). Each shape only
+    touches the pixels inside its own bounding box.
+
+    Shapes are drawn in batches rather than one at a time. The pixels of
+    all bounding boxes in a batch are expanded into flat arrays, with one
+    fragment (fill and stroke combined) per shape and pixel. Per pixel,
+    the last opaque fragment is written directly; only the translucent
+    fragments after it, mostly anti-aliased edges, are blended in order.
+
+    Args:
+        store: The ShapeStore holding the shapes
+        width: Width of the canvas in canvas units
+        height: Height of the canvas in canvas units
+        background: Background color (default: 'white')
+        scale: Pixels per canvas unit (default: 1.0)
+        antialias: Smooth the edges of shapes (default: True)
+        rows: Rows to draw (default: all live rows in drawing order)
+        buffer: Existing C-contiguous buffer to draw into instead of a new one
+        clip: Pixel rectangle (x0, y0, x1, y1) to limit drawing to
+            (default: the area covered by the buffer)
+        origin: Pixel (x, y) of the whole image at the top-left corner of
+            the buffer, for drawing one tile of a larger image into a
+            tile-sized buffer (default: (0, 0))
+
+    Returns:
+        The (H, W, 4) float32 buffer
+    """
+    out_w = max(int(round(width * scale)), 1)
+    out_h = max(int(round(height * scale)), 1)
+    if buffer is None:
+        buffer = new_buffer(out_w, out_h, background)
+    elif not buffer.flags.c_contiguous:
+        raise ValueError("The buffer must be C-contiguous")
+    if rows is None:
+        rows = store.rows()
+    rows = np.asarray(rows, dtype=np.intp)
+    ox, oy = origin if origin is not None else (0, 0)
+    if clip is None:
+        clip = (ox, oy, min(ox + buffer.shape[1], out_w), min(oy + buffer.shape[0], out_h))
+    cx0, cy0, cx1, cy1 = clip
+    if len(rows) == 0 or cx0 >= cx1 or cy0 >= cy1:
+        return buffer
+
+    colors = color_table(store.styles.names)
+    # Opaque (r, g, b, 1) per style, plus the style's own alpha separately
+    solid = colors.astype(np.float32)
+    solid[:, 3] = 1.0
+    opacity = colors[:, 3].astype(np.float32)
+    line_scale = scale * CANVAS_DPI / 72.0
+
+    circle = store.kind[rows] == store.CIRCLE
+    w = store.width[rows] * scale
+    h = store.height[rows] * scale
+    x = store.x[rows] * scale
+    y = (height - store.y[rows]) * scale   # Image rows grow downwards
+    fill = store.fill_id[rows]
+    stroke = store.stroke_id[rows]
+    half_line = np.where(opacity[stroke] > 0, store.stroke_width[rows] * line_scale / 2, 0.0)
+    # Circles keep their radius as both half sizes
+    half_w = np.where(circle, w, w / 2)
+    half_h = np.where(circle, w, h / 2)
+    center_x = np.where(circle, x, x + w / 2)
+    center_y = np.where(circle, y, y - h / 2)
+    pad = half_line + 1
+    ix0 = np.maximum(np.floor(center_x - half_w - pad), cx0).astype(np.int64)
+    ix1 = np.minimum(np.ceil(center_x + half_w + pad), cx1).astype(np.int64)
+    iy0 = np.maximum(np.floor(center_y - half_h - pad), cy0).astype(np.int64)
+    iy1 = np.minimum(np.ceil(center_y + half_h + pad), cy1).astype(np.int64)
+    box_w = np.maximum(ix1 - ix0, 0)
+    sizes = box_w * np.maximum(iy1 - iy0, 0)
+
+    buffer_w = buffer.shape[1]
+    shapes = {
+        'circle': circle,
+        # Offset from the center of the shape to the first pixel center of its box
+        'start_x': (ix0 + 0.5 - center_x).astype(np.float32),
+        'start_y': (iy0 + 0.5 - center_y).astype(np.float32),
+        'half_w': half_w.astype(np.float32),
+        'half_h': half_h.astype(np.float32),
+        'half_line': half_line.astype(np.float32),
+        'fill_alpha': np.where(opacity[fill] > 0, opacity[fill], 0).astype(np.float32),
+        'stroke_alpha': np.where(half_line > 0, opacity[stroke], 0).astype(np.float32),
+        'fill': fill,
+        'stroke': stroke,
+        'box_w': box_w,
+        'box_h': np.maximum(iy1 - iy0, 0),
+        # Index of the first pixel of the box in the flattened buffer
+        'base': (iy0 - oy) * buffer_w + (ix0 - ox),
+    }
+    # Shape index of the last opaque fragment written to each pixel of
+    # the buffer rows inside the clip rectangle
+    first_pixel = (cy0 - oy) * buffer_w
+    last = np.full((cy1 - cy0) * buffer_w, -1, dtype=np.int32)
+    flat = buffer.reshape(-1, 4)
+    ends = np.cumsum(sizes)
+    start = 0
+    while start < len(rows):
+        done = ends[start - 1] if start else 0
+        if sizes[start] > CHUNK_PIXELS:
+            _draw_shape(buffer, start, (ix0[start], iy0[start], ix1[start], iy1[start]),
+                        (center_x[start], center_y[start]), shapes, solid, antialias, (ox, oy))
+            start += 1
+            continue
+        # A batch never reaches a large shape, since that alone is over the limit
+        stop = max(int(np.searchsorted(ends, done + CHUNK_PIXELS, side='right')), start + 1)
+        fragments = _fragments(shapes, start, stop, antialias, buffer_w)
+        if len(fragments[0]):
+            _composite(flat, *fragments, shapes, solid, last, first_pixel)
+        start = stop
+    return buffer
+
+
+def _fragments(shapes, start, stop, antialias, buffer_w):
+    """
+    Compute the fragments of a batch of shapes: one per shape and pixel
+    of its box that the fill or stroke covers.
+
+    Boxes of the same width and kind are handled together as one 2-D
+    array with a row per row of a box, so the values of a shape are
+    looked up once per row rather than once per pixel.
+
+    Args:
+        shapes: Dict of per-shape arrays prepared by rasterize()
+        start, stop: Range of shape indexes in the batch
+
+    Returns:
+        Arrays (shape, pixel, fill alpha, stroke alpha), where pixel is
+        the index in the flattened buffer and the fill alpha is already
+        reduced by the stroke drawn over it
+    """
+    ids = np.arange(start, stop, dtype=np.int32)
+    ids = ids[(shapes['box_w'][ids] > 0) & (shapes['box_h'][ids] > 0)]
+    key = shapes['box_w'][ids] * 2 + shapes['circle'][ids]
+    ids = ids[np.argsort(key, kind='stable')]
+    key = np.sort(key)
+    parts = []
+    for group in np.split(ids, np.flatnonzero(np.diff(key)) + 1):
+        if not len(group):
+            continue
+        width = int(shapes['box_w'][group[0]])
+        heights = shapes['box_h'][group]
+        row_shape = np.repeat(group, heights)
+        row = np.arange(len(row_shape)) - np.repeat(np.cumsum(heights) - heights, heights)
+
+        def column(name):
+            return shapes[name][row_shape][:, None]
+        dx = np.abs(column('start_x') + np.arange(width, dtype=np.float32))
+        dy = np.abs(column('start_y') + row[:, None].astype(np.float32))
+        if shapes['circle'][group[0]]:
+            distance = np.sqrt(dx * dx + dy * dy) - column('half_w')
+        else:
+            # Chebyshev distance keeps rectangle corners square (miter joins)
+            distance = np.maximum(dx - column('half_w'), dy - column('half_h'))
+        fill_alpha = _coverage(distance, antialias)
+        fill_alpha *= column('fill_alpha')
+        np.abs(distance, out=distance)
+        distance -= column('half_line')
+        stroke_alpha = _coverage(distance, antialias)
+        stroke_alpha *= column('stroke_alpha')
+        # The stroke is drawn over the fill
+        fill_alpha *= 1 - stroke_alpha
+
+        keep = np.flatnonzero((fill_alpha > 0) | (stroke_alpha > 0))
+        box_row, box_column = np.divmod(keep, width)
+        shape = row_shape[box_row]
+        parts.append((shape, shapes['base'][shape] + row[box_row] * buffer_w + box_column,
+                      fill_alpha.ravel()[keep], stroke_alpha.ravel()[keep]))
+    if not parts:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+    return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+
+def _composite(flat, shape, pixel, fill_alpha, stroke_alpha, shapes, solid, last, first_pixel):
+    """
+    Composite fragments of a batch of shapes into the buffer.
+
+    Args:
+        flat: The buffer as an (H * W, 4) array
+        shape, pixel, fill_alpha, stroke_alpha: Fragments from _fragments()
+        shapes: Dict of per-shape arrays prepared by rasterize()
+        last: Shape index of the last opaque fragment per pixel, from
+            first_pixel on, updated in place
+    """
+    alpha = fill_alpha + stroke_alpha
+
+    def color(fragments):
+        # Premultiplied colors of fragments; their alpha is the fragment alpha
+        return (solid[shapes['fill'][shape[fragments]]] * fill_alpha[fragments, None]
+                + solid[shapes['stroke'][shape[fragments]]] * stroke_alpha[fragments, None])
+
+    opaque = alpha >= 1
+    np.maximum.at(last, pixel[opaque] - first_pixel, shape[opaque])
+    on_top = np.flatnonzero(opaque & (last[pixel - first_pixel] == shape))
+    # Most opaque fragments are plain fill or plain stroke, whose color is
+    # copied from the style table a whole pixel (16 bytes) at a time
+    plain = stroke_alpha[on_top]
+    fill_only, stroke_only = on_top[plain == 0], on_top[plain >= 1]
+    mixed = on_top[(plain > 0) & (plain < 1)]
+    pixels = flat.view(np.complex128)[:, 0]
+    styles = solid.view(np.complex128)[:, 0]
+    pixels[pixel[fill_only]] = styles[shapes['fill'][shape[fill_only]]]
+    pixels[pixel[stroke_only]] = styles[shapes['stroke'][shape[stroke_only]]]
+    flat[pixel[mixed]] = color(mixed)
+
+    # Translucent fragments above the opaque ones, blended in order: the
+    # n-th fragment of every pixel goes into layer n
+    over = np.flatnonzero(~opaque & (shape > last[pixel - first_pixel]))
+    if not len(over):
+        return
+    # Sort by pixel, then by drawing order
+    over = over[np.argsort(pixel[over] * len(shapes['fill']) + shape[over])]
+    sorted_pixel = pixel[over]
+    positions = np.arange(len(over))
+    first = np.ones(len(over), dtype=bool)
+    first[1:] = sorted_pixel[1:] != sorted_pixel[:-1]
+    layer = positions - np.maximum.accumulate(np.where(first, positions, 0))
+    over = over[np.argsort(layer, kind='stable')]
+    for fragments in np.split(over, np.cumsum(np.bincount(layer))[:-1]):
+        target = pixel[fragments]
+        flat[target] = flat[target] * (1 - alpha[fragments, None]) + color(fragments)
+
+
+def _draw_shape(buffer, i, box, center, shapes, solid, antialias, origin):
+    """Composite the fill and stroke of one large shape over its pixel box."""
+    ix0, iy0, ix1, iy1 = box
+    ox, oy = origin
+    px = np.arange(ix0, ix1, dtype=np.float32) + np.float32(0.5)
+    py = np.arange(iy0, iy1, dtype=np.float32)[:, None] + np.float32(0.5)
+    distance = _distance(px, py, shapes['circle'][i], np.float32(center[0]), np.float32(center[1]),
+                         shapes['half_w'][i], shapes['half_h'][i])
+    if shapes['fill_alpha'][i] > 0:
+        _blend(buffer, iy0 - oy, ix0 - ox, _coverage(distance, antialias),
+               solid[shapes['fill'][i]], shapes['fill_alpha'][i])
+    if shapes['stroke_alpha'][i] > 0:
+        _blend(buffer, iy0 - oy, ix0 - ox,
+               _coverage(np.abs(distance) - shapes['half_line'][i], antialias),
+               solid[shapes['stroke'][i]], shapes['stroke_alpha'][i])
+
+
+def to_rgba8(buffer):
+    """Convert a premultiplied float buffer to straight-alpha uint8 RGBA."""
+    alpha = buffer[..., 3:4]
+    rgb = np.divide(buffer[..., :3], alpha, out=np.zeros_like(buffer[..., :3]),
+                    where=alpha > 0)
+    out = np.empty(buffer.shape, dtype=np.uint8)
+    out[..., :3] = np.clip(rgb * 255 + 0.5, 0, 255)
+    out[..., 3] = np.clip(buffer[..., 3] * 255 + 0.5, 0, 255)
+    return out
+
+
+def encode_png(rgba, compression=6):
+    """
+    Encode a uint8 (H, W, 4) RGBA array as PNG bytes.
+
+    Args:
+        rgba: The image to encode
+        compression: zlib compression level 0-9 (default: 6)
+    """
+    height, width = rgba.shape[:2]
+
+    def chunk(tag, data):
+        body = tag + data
+        return struct.pack('>I', len(data)) + body + struct.pack('>I', zlib.crc32(body))
+
+    # Every scanline starts with filter type 0 (none)
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(height, width * 4)
+    header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(raw.tobytes(), compression))
+            + chunk(b'IEND', b''))
+
+
+class PNGWriter:
+    """
+    Writes a PNG file a band of rows at a time, so the whole image never
+    has to be in memory.
+    """
+
+    def __init__(self, file, width, height, compression=6):
+        """
+        Initialize a PNGWriter and write the PNG header.
+
+        Args:
+            file: Binary file object to write to
+            width: Width of the image in pixels
+            height: Height of the image in pixels
+            compression: zlib compression level 0-9 (default: 6)
+        """
+        self.file = file
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self._compressor = zlib.compressobj(compression)
+        file.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+
+    def _chunk(self, tag, data):
+        body = tag + data
+        self.file.write(struct.pack('>I', len(data)) + body + struct.pack('>I', zlib.crc32(body)))
+
+    def write_rows(self, rgba):
+        """Append rows to the image from a uint8 (rows, width, 4) RGBA array."""
+        rows = rgba.shape[0]
+        raw = np.zeros((rows, self.width * 4 + 1), dtype=np.uint8)
+        raw[:, 1:] = rgba.reshape(rows, self.width * 4)
+        data = self._compressor.compress(raw.tobytes())
+        if data:
+            self._chunk(b'IDAT', data)
+        self.rows_written += rows
+
+    def close(self):
+        """Finish the image. Every row must have been written."""
+        if self.rows_written != self.height:
+            raise ValueError(f"Wrote {self.rows_written} of {self.height} rows")
+        self._chunk(b'IDAT', self._compressor.flush())
+        self._chunk(b'IEND', b'')
+
+
+def write_png(path, rgba, compression=6):
+    """Write a uint8 RGBA array to a PNG file."""
+    with open(path, 'wb') as f:
+        f.write(encode_png(rgba, compression))
+
+
+def outer_bounds(store, rows):
+    """
+    Return the bounding boxes of shapes including half their stroke width.
+
+    Returns:
+        An (n, 4) array of (x0, y0, x1, y1) in canvas units
+    """
+    x0, y0, x1, y1 = store.bounds(rows)
+    pad = store.stroke_width[rows] * CANVAS_DPI / 144.0
+    return np.stack([x0 - pad, y0 - pad, x1 + pad, y1 + pad], axis=1)
+
+
+class IncrementalRaster:
+    """
+    A raster of a ShapeStore that only redraws the regions that changed.
+
+    The raster observes its store. Between renders it collects the rows
+    that were added, removed or changed. The next render clears and
+    redraws only the pixels under their old and new bounding boxes, and
+    keeps the rest of the previous frame.
+    """
+
+    # Above this fraction of dirty pixels a full redraw is cheaper
+    FULL_REDRAW_FRACTION = 0.5
+
+    def __init__(self, store, width, height, background='white', scale=1.0, antialias=True):
+        """
+        Initialize an IncrementalRaster. Nothing is drawn until render().
+
+        Args:
+            store: The ShapeStore to draw
+            width: Width of the canvas in canvas units
+            height: Height of the canvas in canvas units
+            background: Background color (default: 'white')
+            scale: Pixels per canvas unit (default: 1.0)
+            antialias: Smooth the edges of shapes (default: True)
+        """
+        self.store = store
+        self.settings = (width, height, background, scale, antialias)
+        self.buffer = None
+        self.regions_drawn = 0  # Number of regions redrawn by the last render
+        self._background = new_buffer(1, 1, background)[0, 0]
+        self._dirty = set()
+        self._full = True
+        self._drawn_bounds = np.zeros((0, 4))
+        self._drawn = np.zeros(0, dtype=bool)
+        store.observers.append(self)
+
+    def close(self):
+        """Stop following the store."""
+        if self in self.store.observers:
+            self.store.observers.remove(self)
+
+    # Store observer interface
+
+    def shape_added(self, row):
+        self._dirty.add(row)
+
+    def shape_removed(self, row):
+        self._dirty.add(row)
+
+    def shape_changed(self, row):
+        self._dirty.add(row)
+
+    def store_cleared(self):
+        self._full = True
+
+    def _pixel_rect(self, bounds):
+        width, height, _, scale, _ = self.settings
+        x0, y0, x1, y1 = bounds
+        out_h, out_w = self.buffer.shape[:2]
+        # One extra pixel on each side covers anti-aliased edges
+        return (max(math.floor(x0 * scale) - 1, 0),
+                max(math.floor((height - y1) * scale) - 1, 0),
+                min(math.ceil(x1 * scale) + 1, out_w),
+                min(math.ceil((height - y0) * scale) + 1, out_h))
+
+    def _remember(self, rows):
+        """Record the bounds the given rows were drawn with."""
+        size = self.store.size
+        if len(self._drawn) < size:
+            grow = max(size, 2 * len(self._drawn))
+            bounds = np.zeros((grow, 4))
+            bounds[:len(self._drawn_bounds)] = self._drawn_bounds
+            drawn = np.zeros(grow, dtype=bool)
+            drawn[:len(self._drawn)] = self._drawn
+            self._drawn_bounds, self._drawn = bounds, drawn
+        alive = self.store.alive[rows]
+        self._drawn[rows] = alive
+        live = rows[alive]
+        self._drawn_bounds[live] = outer_bounds(self.store, live)
+
+    def render(self):
+        """
+        Bring the buffer up to date and return it.
+
+        Returns:
+            The (H, W, 4) premultiplied float32 buffer
+        """
+        width, height, background, scale, antialias = self.settings
+        store = self.store
+        if self.buffer is None or self._full:
+            self.buffer = rasterize(store, width, height, background, scale, antialias)
+            self._drawn[:] = False
+            self._remember(np.arange(store.size))
+            self._dirty.clear()
+            self._full = False
+            self.regions_drawn = 1
+            return self.buffer
+        if not self._dirty:
+            self.regions_drawn = 0
+            return self.buffer
+
+        dirty = np.fromiter(self._dirty, dtype=np.intp, count=len(self._dirty))
+        self._dirty.clear()
+        boxes = []
+        old = dirty[dirty < len(self._drawn)]
+        boxes.extend(self._drawn_bounds[old[self._drawn[old]]])
+        new = dirty[store.alive[dirty]]
+        boxes.extend(outer_bounds(store, new))
+        rects = [r for r in map(self._pixel_rect, boxes) if r[0] < r[2] and r[1] < r[3]]
+
+        out_h, out_w = self.buffer.shape[:2]
+        dirty_pixels = sum((r[2] - r[0]) * (r[3] - r[1]) for r in rects)
+        if dirty_pixels > self.FULL_REDRAW_FRACTION * out_w * out_h:
+            self._full = True
+            return self.render()
+
+        live = store.rows()
+        live_bounds = outer_bounds(store, live)
+        for rect in rects:
+            px0, py0, px1, py1 = rect
+            self.buffer[py0:py1, px0:px1] = self._background
+            # Convert the pixel rectangle back to canvas units to find shapes under it
+            x0, x1 = px0 / scale, px1 / scale
+            y0, y1 = height - py1 / scale, height - py0 / scale
+            hit = ((live_bounds[:, 0] <= x1) & (live_bounds[:, 2] >= x0)
+                   & (live_bounds[:, 1] <= y1) & (live_bounds[:, 3] >= y0))
+            rasterize(store, width, height, background, scale, antialias,
+                      rows=live[hit], buffer=self.buffer, clip=rect)
+        self._remember(dirty)
+        self.regions_drawn = len(rects)
+        return self.buffer
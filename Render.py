@@ -0,0 +1,292 @@
+import numpy as np
+from matplotlib import rcParams
+from matplotlib import text as mtext
+from matplotlib.artist import Artist
+from matplotlib.backends.backend_agg import RendererAgg
+from matplotlib.collections import PathCollection
+from matplotlib.colors import to_rgba_array
+from matplotlib.path import Path
+
+# Same unit paths that mpatches.Circle and mpatches.Rectangle are built from
+_UNIT_CIRCLE = Path.unit_circle()
+_UNIT_RECTANGLE = Path.unit_rectangle()
+
+
+def shape_arrays(shapes):
+    """
+    Pack a list of shapes into per-element arrays for batched drawing.
+
+    Circles are recognised by their radius attribute, so any of the
+    Circle/Rectangle classes in this project can be passed in.
+
+    Args:
+        shapes: List of Circle and/or Rectangle objects
+
+    Returns:
+        A dict of arrays: is_circle, x, y, width, height, stroke_width,
+        plus fill and stroke lists of colors
+    """
+    n = len(shapes)
+    is_circle = np.fromiter((hasattr(s, 'radius') for s in shapes), dtype=bool, count=n)
+    x = np.fromiter((s.x for s in shapes), dtype=float, count=n)
+    y = np.fromiter((s.y for s in shapes), dtype=float, count=n)
+    width = np.fromiter((s.radius if c else s.width for s, c in zip(shapes, is_circle)),
+                        dtype=float, count=n)
+    height = np.fromiter((s.radius if c else s.height for s, c in zip(shapes, is_circle)),
+                         dtype=float, count=n)
+    stroke_width = np.fromiter((s.stroke_width for s in shapes), dtype=float, count=n)
+    return {
+        'is_circle': is_circle,
+        'x': x,
+        'y': y,
+        'width': width,
+        'height': height,
+        'stroke_width': stroke_width,
+        'fill': [s.fill for s in shapes],
+        'stroke': [s.stroke for s in shapes],
+    }
+
+
+def store_arrays(store, rows=None):
+    """
+    Read the arrays for batched drawing straight out of a ShapeStore.
+
+    Colors are converted once per entry in the style table rather than
+    once per shape.
+
+    Args:
+        store: The ShapeStore holding the shapes
+        rows: Rows to draw (default: all live rows in insertion order)
+
+    Returns:
+        A dict in the same layout as shape_arrays(), with RGBA colors
+    """
+    arrays = store.columns(rows)
+    colors = to_rgba_array(store.styles.names) if len(store.styles) else np.zeros((0, 4))
+    arrays['fill'] = colors[arrays['fill_id']]
+    arrays['stroke'] = colors[arrays['stroke_id']]
+    return arrays
+
+
+def shape_paths(is_circle, x, y, width, height):
+    """
+    Build one data-space Path per shape, keeping the original draw order.
+
+    For circles, width and height both hold the radius; for rectangles they
+    hold the size and (x, y) is the bottom-left corner.
+
+    Returns:
+        A list of matplotlib Path objects
+    """
+    paths = [None] * len(is_circle)
+
+    circles = np.flatnonzero(is_circle)
+    if len(circles):
+        r = width[circles, None, None]
+        centers = np.stack([x[circles], y[circles]], axis=1)[:, None, :]
+        verts = _UNIT_CIRCLE.vertices[None, :, :] * r + centers
+        codes = _UNIT_CIRCLE.codes
+        for i, v in zip(circles, verts):
+            paths[i] = Path(v, codes, readonly=True)
+
+    rects = np.flatnonzero(~is_circle)
+    if len(rects):
+        size = np.stack([width[rects], height[rects]], axis=1)[:, None, :]
+        corners = np.stack([x[rects], y[rects]], axis=1)[:, None, :]
+        verts = _UNIT_RECTANGLE.vertices[None, :, :] * size + corners
+        codes = _UNIT_RECTANGLE.codes
+        for i, v in zip(rects, verts):
+            paths[i] = Path(v, codes, readonly=True)
+
+    return paths
+
+
+def shape_collection(arrays, transform):
+    """
+    Create a single collection artist that draws every shape.
+
+    Args:
+        arrays: Dict as returned by shape_arrays()
+        transform: Transform from data space to display space (ax.transData)
+
+    Returns:
+        A PathCollection with per-element fill, stroke and line width
+    """
+    paths = shape_paths(arrays['is_circle'], arrays['x'], arrays['y'],
+                        arrays['width'], arrays['height'])
+    # Match the patch defaults so the batched picture is identical
+    return PathCollection(
+        paths,
+        facecolors=arrays['fill'],
+        edgecolors=arrays['stroke'],
+        linewidths=arrays['stroke_width'],
+        joinstyle='miter',
+        capstyle='butt',
+        transform=transform,
+    )
+
+
+def clear_artists(ax):
+    """
+    Remove everything drawn on the axes but keep the axes themselves, with
+    their spines, ticks and title, ready for the next frame. This is much
+    cheaper than clearing the figure and adding new axes.
+    """
+    for artists in (ax.patches, ax.collections, ax.images, ax.lines, ax.texts, ax.artists):
+        for artist in list(artists):
+            artist.remove()
+    ax.ignore_existing_data_limits = True
+
+
+def reset_layout(fig):
+    """
+    Put the subplots back where a new figure would have them, so that
+    tight_layout() on a reused figure gives the same result as on a new one.
+    """
+    fig.subplots_adjust(**{name: rcParams[f'figure.subplot.{name}']
+                           for name in ('left', 'right', 'bottom', 'top', 'wspace', 'hspace')})
+
+
+def draw_shapes_batched(ax, shapes):
+    """
+    Draw all shapes onto the axes with one collection instead of one patch each.
+
+    Args:
+        ax: The matplotlib axes to draw on
+        shapes: List of Circle and/or Rectangle objects
+
+    Returns:
+        The collection that was added, or None if there were no shapes
+    """
+    if not shapes:
+        return None
+    collection = shape_collection(shape_arrays(shapes), ax.transData)
+    ax.add_collection(collection, autolim=False)
+    return collection
+
+
+def draw_store_batched(ax, store, rows=None):
+    """
+    Draw every shape in a ShapeStore onto the axes with one collection.
+
+    Args:
+        ax: The matplotlib axes to draw on
+        store: The ShapeStore holding the shapes
+        rows: Rows to draw (default: all live rows in insertion order)
+
+    Returns:
+        The collection that was added, or None if there was nothing to draw
+    """
+    if not (store.count if rows is None else len(rows)):
+        return None
+    collection = shape_collection(store_arrays(store, rows), ax.transData)
+    ax.add_collection(collection, autolim=False)
+    return collection
+
+
+class LabelImage(Artist):
+    """
+    An artist that draws a batch of Text objects as one image.
+
+    The labels are composited from the shared glyph atlas (see Labels.py)
+    when the figure is drawn, at the resolution of the renderer. Vector
+    backends get one text element per label instead, so their output
+    stays selectable text.
+    """
+
+    def __init__(self, texts, transform, overlap=None):
+        """
+        Initialize a LabelImage.
+
+        Args:
+            texts: List of Text objects
+            transform: Transform of the text positions (ax.transData)
+            overlap: None, 'drop' or 'merge', see Labels.select_labels()
+        """
+        super().__init__()
+        self.texts = list(texts)
+        self.overlap = overlap
+        self.drawn = 0  # Number of labels drawn by the last draw
+        self.set_transform(transform)
+
+    def draw(self, renderer):
+        if not self.get_visible() or not self.texts:
+            return
+        from Labels import composite_labels, label_boxes, select_labels
+        from Raster import new_buffer, to_rgba8
+
+        positions = np.array([(text.x, text.y) for text in self.texts], dtype=float)
+        anchors = self.get_transform().transform(positions)
+        if not isinstance(renderer, RendererAgg):
+            height = renderer.get_canvas_width_height()[1]
+            anchors[:, 1] = height - anchors[:, 1]
+            indices, contents = select_labels(self.texts, label_boxes(self.texts, anchors, renderer.dpi),
+                                              self.overlap)
+            for i, content in zip(indices.tolist(), contents):
+                text = self.texts[i]
+                artist = mtext.Text(text.x, text.y, content, fontsize=text.font_size,
+                                    color=text.color, family=text.font_family,
+                                    weight='bold' if text.bold else 'normal',
+                                    style='italic' if text.italic else 'normal',
+                                    ha=text.alignment, va='bottom',
+                                    transform=self.get_transform(), figure=self.figure)
+                artist.draw(renderer)
+            self.drawn = len(indices)
+            return
+
+        width, height = int(renderer.width), int(renderer.height)
+        anchors[:, 1] = height - anchors[:, 1]
+        buffer = new_buffer(width, height, 'none')
+        self.drawn = composite_labels(buffer, self.texts, anchors, renderer.dpi, self.overlap)
+        gc = renderer.new_gc()
+        renderer.draw_image(gc, 0, 0, to_rgba8(buffer)[::-1])
+        gc.restore()
+
+
+def draw_labels_batched(ax, texts, overlap=None):
+    """
+    Draw all Text objects onto the axes as one label image.
+
+    Args:
+        ax: The matplotlib axes to draw on
+        texts: List of Text objects
+        overlap: None, 'drop' or 'merge', see Labels.select_labels()
+
+    Returns:
+        The LabelImage that was added, or None if there were no texts
+    """
+    if not texts:
+        return None
+    return ax.add_artist(LabelImage(texts, ax.transData, overlap))
+
+
+def draw_density(ax, store, rows, viewport, pixels_per_unit, aggregate='heatmap'):
+    """
+    Draw shapes too small to see individually as one density layer.
+
+    The layer is drawn underneath the shapes drawn normally.
+
+    Args:
+        ax: The matplotlib axes to draw on
+        store: The ShapeStore holding the shapes
+        rows: Rows of the shapes to aggregate
+        viewport: (x0, y0, x1, y1) in canvas units
+        pixels_per_unit: Screen pixels per canvas unit
+        aggregate: 'heatmap' for an image, or 'points' for one marker per
+            covered pixel (default: 'heatmap')
+
+    Returns:
+        The artist that was added, or None if there was nothing to draw
+    """
+    from LOD import density_extent, density_image, density_points
+
+    if not len(rows):
+        return None
+    image = density_image(store, rows, viewport, pixels_per_unit, ax.figure.dpi)
+    if aggregate == 'heatmap':
+        return ax.imshow(image, origin='lower', interpolation='nearest', zorder=0.5,
+                         extent=density_extent(image, viewport, pixels_per_unit))
+    x, y, colors = density_points(image, viewport, pixels_per_unit)
+    # A square marker one pixel wide; marker sizes are in points squared
+    size = (72.0 / ax.figure.dpi) ** 2
+    return ax.scatter(x, y, s=size, c=colors, marker='s', linewidths=0, zorder=0.5)
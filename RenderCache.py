@@ -0,0 +1,233 @@
+"""
+A content-addressed cache of rendered images.
+
+Images are stored under a key that is a stable hash of what was drawn
+plus the output parameters (format, dpi, size...), so asking for the
+same output twice returns the stored bytes without rendering again.
+Recently used images are kept in memory; with a directory, they are
+also written to disk and shared between processes and runs. Both tiers
+are bounded in bytes and drop the least recently used entries first.
+"""
+import hashlib
+import importlib.util
+import json
+import os
+import tempfile
+from collections import OrderedDict
+
+# Bump when the renderers change in a way that makes stored images stale
+CACHE_VERSION = 1
+
+
+def _digest(*parts):
+    h = hashlib.sha256()
+    h.update(f"v{CACHE_VERSION}".encode())
+    for part in parts:
+        h.update(b'\0')
+        h.update(part if isinstance(part, bytes) else part.encode('utf-8'))
+    return h.hexdigest()
+
+
+def _canonical(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def scene_key(scene, **params):
+    """
+    Return the cache key of a scene dict and output parameters.
+
+    The scene's 'output' path does not affect the key.
+
+    Args:
+        scene: A scene dict (see Export and Canvas.to_scene())
+        params: Output parameters, such as format='png' or dpi=300
+    """
+    scene = {name: value for name, value in scene.items() if name != 'output'}
+    return _digest(_canonical(scene), _canonical(params))
+
+
+def canvas_key(canvas, **params):
+    """
+    Return the cache key of a canvas and output parameters.
+
+    The shape columns are hashed directly, which is much faster than
+    building a scene dict for large canvases.
+
+    Args:
+        canvas: A Canvas (or text Canvas)
+        params: Output parameters, such as format='png' or dpi=100
+    """
+    store = canvas.store
+    rows = store.rows()
+    settings = {
+        'type': type(canvas).__name__,
+        'width': canvas.width,
+        'height': canvas.height,
+        'background_color': canvas.background_color,
+        'title': canvas.title,
+        'styles': store.styles.names,
+        'texts': [vars(text) for text in getattr(canvas, 'texts', ())],
+    }
+    if getattr(canvas, 'label_overlap', None) is not None:
+        settings['label_overlap'] = canvas.label_overlap
+    columns = [getattr(store, name)[rows].tobytes()
+               for name in ('kind', 'x', 'y', 'width', 'height', 'stroke_width', 'fill_id', 'stroke_id')]
+    return _digest(_canonical(settings), _canonical(params), *columns)
+
+
+def template_digest(module):
+    """
+    Return a hash of a module's source file without importing it.
+
+    Use it in the key of images drawn by code, such as Flag.py, so that
+    editing the drawing code invalidates the stored images.
+    """
+    spec = importlib.util.find_spec(module)
+    with open(spec.origin, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class RenderCache:
+    """A two-tier (memory and disk) LRU cache of encoded images."""
+
+    def __init__(self, max_memory_bytes=64 << 20, directory=None, max_disk_bytes=512 << 20):
+        """
+        Initialize a RenderCache.
+
+        Args:
+            max_memory_bytes: Size limit of the in-memory tier (default: 64 MiB)
+            directory: Directory of the on-disk tier, created if needed
+                (default: None, memory only)
+            max_disk_bytes: Size limit of the on-disk tier (default: 512 MiB)
+        """
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.directory = directory
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.bin')
+
+    def _disk_entries(self):
+        """Return (mtime, path, size) of every stored file."""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.bin'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:  # Evicted by another process
+                        continue
+                    entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+    def _remember(self, key, data):
+        if len(data) > self.max_memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, dropped = self._memory.popitem(last=False)
+            self._memory_bytes -= len(dropped)
+
+    def get(self, key):
+        """
+        Return the stored bytes for a key, or None.
+
+        A disk hit is promoted to the memory tier and marked as recently used.
+        """
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return data
+        if self.directory is not None:
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                os.utime(path)  # The modification time orders disk eviction
+            except FileNotFoundError:
+                data = None
+            if data is not None:
+                self.disk_hits += 1
+                self._remember(key, data)
+                return data
+        self.misses += 1
+        return None
+
+    def put(self, key, data):
+        """Store the bytes for a key in both tiers."""
+        self._remember(key, data)
+        if self.directory is None or len(data) > self.max_disk_bytes:
+            return
+        path = self._path(key)
+        # Write to a temporary file first so readers never see partial files
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        if os.path.exists(path):
+            self._disk_bytes -= os.path.getsize(path)
+        os.replace(temp, path)
+        self._disk_bytes += len(data)
+        if self._disk_bytes > self.max_disk_bytes:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """Delete the least recently used files until the disk tier fits."""
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._disk_bytes = total
+
+    def get_or_render(self, key, render):
+        """
+        Return the stored bytes for a key, rendering and storing them on a miss.
+
+        Args:
+            key: Cache key, e.g. from scene_key() or canvas_key()
+            render: Function without arguments that returns the encoded bytes
+        """
+        data = self.get(key)
+        if data is None:
+            data = render()
+            self.put(key, data)
+        return data
+
+    def clear(self):
+        """Drop every entry from both tiers."""
+        self._memory.clear()
+        self._memory_bytes = 0
+        if self.directory is not None:
+            for _, path, _ in self._disk_entries():
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._disk_bytes = 0
+
+    def __len__(self):
+        return len(self._memory)
+
+    def __str__(self):
+        return (f"RenderCache(memory={self._memory_bytes} bytes in {len(self._memory)} entries, "
+                f"disk={self._disk_bytes} bytes, hits={self.memory_hits}+{self.disk_hits}, "
+                f"misses={self.misses})")
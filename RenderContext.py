@@ -0,0 +1,236 @@
+"""
+Reusable matplotlib figures for repeated renders.
+
+A RenderContext owns one figure and its axes and draws canvas after
+canvas into them, removing the previous frame's artists instead of
+creating a new figure each time. Live figures are capped across all
+contexts: when a new one would go over RenderContext.max_live_figures,
+the least recently used context gives its figure up (it makes a new one
+if it is used again). close(), or leaving a with block, frees the figure
+at a known point instead of whenever the garbage collector gets to it.
+
+    with RenderContext() as context:
+        for canvas in canvases:
+            png = context.render_image(canvas)
+
+Running this module is a soak test: it renders the same scenes over and
+over and checks that resident memory stays flat.
+
+    python RenderContext.py --renders 100000
+"""
+import argparse
+import io
+import sys
+import time
+from collections import OrderedDict
+
+
+class RenderContext:
+    """One reusable figure, for rendering many canvases in a row."""
+
+    # Cap on figures held by all contexts together
+    max_live_figures = 4
+
+    # Contexts holding a figure, least recently used first
+    _live = OrderedDict()
+
+    def __init__(self, pyplot=False):
+        """
+        Initialize a RenderContext. The figure is created on first use.
+
+        Args:
+            pyplot: Create the figure through pyplot so it can be shown in
+                a window; otherwise it is a plain Agg figure that pyplot
+                does not know about (default: False)
+        """
+        self.pyplot = pyplot
+        self.renders = 0
+        self._figure = None
+
+    @property
+    def figure(self):
+        """The figure of this context, created (again) if needed."""
+        fig = self._figure
+        if fig is not None and self.pyplot:
+            import matplotlib.pyplot as plt
+            # A figure whose window was closed is gone from pyplot
+            if not plt.fignum_exists(fig.number):
+                self._forget()
+                fig = None
+        if fig is None:
+            fig = self._figure = self._new_figure()
+            self._live[id(self)] = self
+            # Make room by closing the figures used least recently
+            while len(self._live) > self.max_live_figures:
+                _, oldest = self._live.popitem(last=False)
+                oldest.release()
+        self._live.move_to_end(id(self))
+        return fig
+
+    def _new_figure(self):
+        if self.pyplot:
+            import matplotlib.pyplot as plt
+            return plt.figure()
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        return fig
+
+    def _forget(self):
+        self._figure = None
+        self._live.pop(id(self), None)
+
+    def render(self, canvas, batched=True, viewport=None, lod=None):
+        """
+        Draw a canvas into the figure, replacing the previous frame.
+
+        Args:
+            canvas: The Canvas (or text Canvas) to draw
+            batched, viewport, lod: See Canvas.render_figure()
+
+        Returns:
+            The axes the canvas was drawn on
+        """
+        ax = canvas.render_figure(self.figure, batched, viewport, lod, reuse=True)
+        self.renders += 1
+        return ax
+
+    def render_image(self, canvas, format='png', dpi=100, batched=True):
+        """
+        Render a canvas to encoded image bytes.
+
+        Args:
+            canvas: The Canvas (or text Canvas) to draw
+            format: Image format, such as 'png' or 'svg' (default: 'png')
+            dpi: Resolution of the image (default: 100)
+            batched: Draw the shapes as one collection (default: True)
+        """
+        self.render(canvas, batched)
+        buffer = io.BytesIO()
+        self.figure.savefig(buffer, format=format, dpi=dpi)
+        return buffer.getvalue()
+
+    def show(self, canvas, batched=False, viewport=None, lod=None):
+        """Draw a canvas and show the figure with pyplot."""
+        import matplotlib.pyplot as plt
+        self.render(canvas, batched, viewport, lod)
+        plt.show()
+
+    def release(self):
+        """Close the figure now. The context can still be used afterwards."""
+        fig = self._figure
+        if fig is None:
+            return
+        self._forget()
+        if self.pyplot:
+            import matplotlib.pyplot as plt
+            plt.close(fig)
+        else:
+            fig.clf()
+
+    close = release
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    @classmethod
+    def live_figures(cls):
+        """Return the number of figures held by all contexts."""
+        return len(cls._live)
+
+    def __str__(self):
+        return f"RenderContext(pyplot={self.pyplot}, renders={self.renders}, live={self._figure is not None})"
+
+
+# Shared context behind Canvas.display()
+_display_context = None
+
+
+def display_context():
+    """Return the pyplot context that Canvas.display() reuses between calls."""
+    global _display_context
+    if _display_context is None:
+        _display_context = RenderContext(pyplot=True)
+    return _display_context
+
+
+def soak(renders=100_000, shapes=200, report_every=10_000, draw=True, callback=None):
+    """
+    Render the same scenes over and over and track resident memory.
+
+    Two canvases (one with text) are drawn alternately through one
+    context, each frame fully drawn by the Agg backend.
+
+    Args:
+        renders: Number of renders (default: 100000)
+        shapes: Shapes per canvas (default: 200)
+        report_every: Renders between memory samples (default: 10000)
+        draw: Draw every frame with the backend, not only build its artists
+            (default: True)
+        callback: Called with (renders done, RSS in bytes) at every sample
+
+    Returns:
+        A list of (renders done, RSS in bytes) samples
+    """
+    import random
+
+    from Canvas import Canvas
+    from Profiler import rss_bytes
+    from Shapes import Circle, Rectangle
+    from Text import Canvas as TextCanvas, Text
+
+    rng = random.Random(0)
+    plain = Canvas(400, 300)
+    labelled = TextCanvas(400, 300)
+    for canvas in (plain, labelled):
+        for i in range(shapes):
+            if i % 2:
+                canvas.add_shape(Circle(rng.uniform(2, 20), rng.uniform(0, 400), rng.uniform(0, 300)))
+            else:
+                canvas.add_shape(Rectangle(rng.uniform(4, 40), rng.uniform(4, 40),
+                                           rng.uniform(0, 400), rng.uniform(0, 300), fill='green'))
+    for i in range(10):
+        labelled.add_text(Text(f"label {i}", 20 + 35 * i, 150, font_family='DejaVu Sans'))
+
+    samples = []
+    with RenderContext() as context:
+        for done in range(1, renders + 1):
+            context.render(plain if done % 2 else labelled)
+            if draw:
+                context.figure.canvas.draw()
+            if done % report_every == 0 or done == renders:
+                samples.append((done, rss_bytes()))
+                if callback is not None:
+                    callback(*samples[-1])
+    return samples
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that repeated renders do not grow memory.")
+    parser.add_argument('--renders', type=int, default=100_000, help="Number of renders")
+    parser.add_argument('--shapes', type=int, default=200, help="Shapes per canvas")
+    parser.add_argument('--report-every', type=int, default=None,
+                        help="Renders between memory samples (default: renders / 10)")
+    parser.add_argument('--max-growth', type=float, default=5.0,
+                        help="Allowed RSS growth in MiB after the first sample")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+
+    def report(done, rss):
+        rate = done / (time.perf_counter() - start)
+        print(f"{done:>9} renders  RSS {rss / 2**20:8.1f} MiB  {rate:7.0f} renders/s", flush=True)
+
+    samples = soak(args.renders, args.shapes, args.report_every or max(args.renders // 10, 1),
+                   callback=report)
+    growth = (samples[-1][1] - samples[0][1]) / 2**20
+    print(f"RSS growth after the first sample: {growth:.1f} MiB")
+    return 1 if growth > args.max_growth else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import io
+from xml.sax.saxutils import escape, quoteattr
+
+# Canvas units are pixels at 100 dpi; stroke widths and font sizes are points
+CANVAS_DPI = 100
+POINTS_TO_UNITS = CANVAS_DPI / 72.0
+
+ANCHORS = {'left': 'start', 'center': 'middle', 'right': 'end'}
+
+
+def svg_color(color):
+    """
+    Return a color in a form SVG understands, as (hex color, opacity).
+
+    Every color except 'none' goes through matplotlib.colors, so
+    matplotlib's own names such as 'k', 'C0' or 'tab:blue' come out as
+    valid SVG colors. The alpha is returned separately, since SVG keeps
+    it in fill-opacity and stroke-opacity.
+    """
+    if isinstance(color, str) and color.lower() == 'none':
+        return 'none', 1.0
+    from matplotlib.colors import to_hex, to_rgba
+    rgba = to_rgba(color)
+    return to_hex(rgba, keep_alpha=False), rgba[3]
+
+
+def _number(value):
+    return format(value, '.6g')
+
+
+def _paint(attribute, color):
+    """Format a fill or stroke attribute, plus its opacity if the color is translucent."""
+    value, opacity = svg_color(color)
+    paint = f'{attribute}={quoteattr(value)}'
+    if opacity < 1:
+        paint += f' {attribute}-opacity="{_number(opacity)}"'
+    return paint
+
+
+def iter_svg(canvas, chunk_size=4096):
+    """
+    Generate an SVG document for a canvas piece by piece.
+
+    Shapes are read from the canvas store a chunk at a time and text items
+    one at a time, so memory use does not depend on the size of the scene.
+    Consecutive items with the same style share one <g> element that
+    carries the style, which keeps the output small while preserving the
+    drawing order.
+
+    Args:
+        canvas: A Canvas (or text Canvas)
+        chunk_size: Number of shapes formatted per chunk (default: 4096)
+
+    Yields:
+        Strings that together form the SVG document
+    """
+    width, height = canvas.width, canvas.height
+    yield ('<svg xmlns="http://www.w3.org/2000/svg" '
+           f'width="{_number(width)}" height="{_number(height)}" '
+           f'viewBox="0 0 {_number(width)} {_number(height)}">\n')
+    yield f'<rect width="100%" height="100%" {_paint("fill", canvas.background_color)}/>\n'
+
+    store = canvas.store
+    fills = [_paint('fill', name) for name in store.styles.names]
+    strokes = [_paint('stroke', name) for name in store.styles.names]
+    rows = store.rows()
+    current_style = None
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        circles = (store.kind[chunk] == store.CIRCLE).tolist()
+        xs = store.x[chunk].tolist()
+        ys = store.y[chunk].tolist()
+        ws = store.width[chunk].tolist()
+        hs = store.height[chunk].tolist()
+        lines = (store.stroke_width[chunk] * POINTS_TO_UNITS).tolist()
+        fill_ids = store.fill_id[chunk].tolist()
+        stroke_ids = store.stroke_id[chunk].tolist()
+        parts = []
+        for i in range(len(chunk)):
+            style = (fill_ids[i], stroke_ids[i], lines[i])
+            if style != current_style:
+                if current_style is not None:
+                    parts.append('</g>\n')
+                parts.append(f'<g {fills[fill_ids[i]]} {strokes[stroke_ids[i]]} '
+                             f'stroke-width="{_number(lines[i])}">\n')
+                current_style = style
+            # SVG's y axis points down, the canvas's points up
+            if circles[i]:
+                parts.append(f'<circle cx="{_number(xs[i])}" cy="{_number(height - ys[i])}" '
+                             f'r="{_number(ws[i])}"/>\n')
+            else:
+                parts.append(f'<rect x="{_number(xs[i])}" y="{_number(height - ys[i] - hs[i])}" '
+                             f'width="{_number(ws[i])}" height="{_number(hs[i])}"/>\n')
+        yield ''.join(parts)
+    if current_style is not None:
+        yield '</g>\n'
+
+    current_style = None
+    for text in getattr(canvas, 'texts', ()):
+        style = (text.color, text.font_family, text.font_size, text.bold, text.italic,
+                 text.alignment)
+        if style != current_style:
+            if current_style is not None:
+                yield '</g>\n'
+            weight = ' font-weight="bold"' if text.bold else ''
+            italic = ' font-style="italic"' if text.italic else ''
+            yield (f'<g {_paint("fill", text.color)} '
+                   f'font-family={quoteattr(text.font_family)} '
+                   f'font-size="{_number(text.font_size * POINTS_TO_UNITS)}"{weight}{italic} '
+                   f'text-anchor="{ANCHORS.get(text.alignment, "start")}" '
+                   f'dominant-baseline="text-after-edge">\n')
+            current_style = style
+        yield (f'<text x="{_number(text.x)}" y="{_number(height - text.y)}">'
+               f'{escape(str(text.content))}</text>\n')
+    if current_style is not None:
+        yield '</g>\n'
+    yield '</svg>\n'
+
+
+def write_svg(canvas, file, chunk_size=4096):
+    """
+    Stream a canvas as SVG to a file path or a writable object.
+
+    Args:
+        canvas: A Canvas (or text Canvas)
+        file: A path, a text file object, or any object with a write()
+            method taking bytes, such as a binary file or socket.makefile('wb')
+        chunk_size: Number of shapes formatted per chunk (default: 4096)
+    """
+    if isinstance(file, (str, bytes)) or hasattr(file, '__fspath__'):
+        with open(file, 'w', encoding='utf-8') as f:
+            for part in iter_svg(canvas, chunk_size):
+                f.write(part)
+        return
+    binary = not isinstance(file, io.TextIOBase)
+    for part in iter_svg(canvas, chunk_size):
+        file.write(part.encode('utf-8') if binary else part)
@@ -0,0 +1,369 @@
+"""
+A compact binary file format for canvases.
+
+Layout of a scene file:
+
+    header     64 bytes: magic b'SCN1', version, canvas width and height,
+               string ids of the background color and title
+    records    one 56-byte record per shape or text item (RECORD_DTYPE)
+    strings    string table: count, then (length, UTF-8 bytes) per string
+    trailer    32 bytes: record count, offset of the records, offset of
+               the string table, magic b'SCNE'
+
+Colors, font families and text contents are stored once in the string
+table and referenced by id. The counts and the string table come at the
+end, so a SceneWriter can stream to pipes and sockets. A SceneReader
+memory-maps the records and hands them out in chunks, so a scene can be
+loaded or rendered without creating one Python object per shape.
+"""
+import struct
+
+import numpy as np
+
+MAGIC = b'SCN1'
+TRAILER_MAGIC = b'SCNE'
+VERSION = 1
+HEADER_SIZE = 64
+_HEADER = struct.Struct('<4sH2xddII')
+_TRAILER = struct.Struct('<QQQ4s4x')
+
+CIRCLE = 0
+RECTANGLE = 1
+TEXT = 2
+
+BOLD = 1
+ITALIC = 2
+ALIGNMENTS = ('left', 'center', 'right')
+
+# For shapes: style0/style1 are fill/stroke and a/b/c are the width (radius),
+# height (radius) and stroke width. For text: style0/style1 are the color and
+# font family, text is the content and a is the font size.
+RECORD_DTYPE = np.dtype([
+    ('kind', 'u1'),
+    ('flags', 'u1'),
+    ('align', 'u1'),
+    ('pad', 'u1'),
+    ('style0', '<u4'),
+    ('style1', '<u4'),
+    ('text', '<u4'),
+    ('x', '<f8'),
+    ('y', '<f8'),
+    ('a', '<f8'),
+    ('b', '<f8'),
+    ('c', '<f8'),
+])
+
+
+def _color_name(color):
+    """Return a string for a color, converting tuples to hex."""
+    if isinstance(color, str):
+        return color
+    from matplotlib.colors import to_hex
+    return to_hex(color, keep_alpha=True)
+
+
+class SceneWriter:
+    """Writes a scene file record by record."""
+
+    def __init__(self, file, width=800, height=600, background_color='white',
+                 title='Canvas', chunk_size=65536):
+        """
+        Initialize a SceneWriter and write the header.
+
+        Args:
+            file: Path to write to, or a writable binary file object
+            width: Width of the canvas (default: 800)
+            height: Height of the canvas (default: 600)
+            background_color: Background color (default: 'white')
+            title: Title of the canvas (default: 'Canvas')
+            chunk_size: Number of records buffered before writing (default: 65536)
+        """
+        self._owns_file = isinstance(file, (str, bytes)) or hasattr(file, '__fspath__')
+        self._file = open(file, 'wb') if self._owns_file else file
+        self._strings = []
+        self._string_ids = {}
+        self._buffer = np.zeros(chunk_size, dtype=RECORD_DTYPE)
+        self._buffered = 0
+        self.count = 0
+        self._offset = HEADER_SIZE
+        header = _HEADER.pack(MAGIC, VERSION, width, height,
+                              self._intern(_color_name(background_color)), self._intern(title))
+        self._file.write(header.ljust(HEADER_SIZE, b'\0'))
+
+    def _intern(self, string):
+        string_id = self._string_ids.get(string)
+        if string_id is None:
+            string_id = len(self._strings)
+            self._string_ids[string] = string_id
+            self._strings.append(string)
+        return string_id
+
+    def _flush(self):
+        if self._buffered:
+            self._file.write(self._buffer[:self._buffered].tobytes())
+            self._buffered = 0
+
+    def _record(self):
+        if self._buffered == len(self._buffer):
+            self._flush()
+        # The buffer is reused, so clear fields left over from an earlier record
+        self._buffer[self._buffered] = 0
+        record = self._buffer[self._buffered]
+        self._buffered += 1
+        self.count += 1
+        return record
+
+    def write_shape(self, shape):
+        """Write one Circle or Rectangle."""
+        record = self._record()
+        if hasattr(shape, 'radius'):
+            record['kind'] = CIRCLE
+            record['a'] = record['b'] = shape.radius
+        else:
+            record['kind'] = RECTANGLE
+            record['a'] = shape.width
+            record['b'] = shape.height
+        record['x'] = shape.x
+        record['y'] = shape.y
+        record['c'] = shape.stroke_width
+        record['style0'] = self._intern(_color_name(shape.fill))
+        record['style1'] = self._intern(_color_name(shape.stroke))
+
+    def write_text(self, text):
+        """Write one Text item."""
+        record = self._record()
+        record['kind'] = TEXT
+        record['flags'] = (BOLD if text.bold else 0) | (ITALIC if text.italic else 0)
+        record['align'] = ALIGNMENTS.index(text.alignment)
+        record['style0'] = self._intern(_color_name(text.color))
+        record['style1'] = self._intern(text.font_family)
+        record['text'] = self._intern(text.content)
+        record['x'] = text.x
+        record['y'] = text.y
+        record['a'] = text.font_size
+
+    def write_store(self, store, rows=None):
+        """
+        Write shapes straight from a ShapeStore's columns.
+
+        Args:
+            store: The ShapeStore to write
+            rows: Rows to write (default: all live rows in drawing order)
+        """
+        if rows is None:
+            rows = store.rows()
+        remap = np.array([self._intern(_color_name(name)) for name in store.styles.names],
+                         dtype=np.uint32)
+        self._flush()
+        for start in range(0, len(rows), len(self._buffer)):
+            chunk = rows[start:start + len(self._buffer)]
+            records = np.zeros(len(chunk), dtype=RECORD_DTYPE)
+            records['kind'] = np.where(store.kind[chunk] == store.CIRCLE, CIRCLE, RECTANGLE)
+            records['x'] = store.x[chunk]
+            records['y'] = store.y[chunk]
+            records['a'] = store.width[chunk]
+            records['b'] = store.height[chunk]
+            records['c'] = store.stroke_width[chunk]
+            records['style0'] = remap[store.fill_id[chunk]]
+            records['style1'] = remap[store.stroke_id[chunk]]
+            self._file.write(records.tobytes())
+            self.count += len(chunk)
+
+    def write_canvas(self, canvas):
+        """Write every shape and text item of a canvas."""
+        self.write_store(canvas.store)
+        for text in getattr(canvas, 'texts', ()):
+            self.write_text(text)
+
+    def close(self):
+        """Write the string table and trailer, then close the file if we opened it."""
+        self._flush()
+        records_end = HEADER_SIZE + self.count * RECORD_DTYPE.itemsize
+        parts = [struct.pack('<I', len(self._strings))]
+        for string in self._strings:
+            data = string.encode('utf-8')
+            parts.append(struct.pack('<I', len(data)))
+            parts.append(data)
+        self._file.write(b''.join(parts))
+        self._file.write(_TRAILER.pack(self.count, HEADER_SIZE, records_end, TRAILER_MAGIC))
+        if self._owns_file:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def save_canvas(canvas, path):
+    """Write a canvas to a scene file."""
+    with SceneWriter(path, canvas.width, canvas.height,
+                     canvas.background_color, canvas.title) as writer:
+        writer.write_canvas(canvas)
+
+
+class SceneReader:
+    """
+    Reads a scene file, memory-mapping its records.
+
+    Attributes:
+        width, height, background_color, title: The canvas settings
+        strings: The string table
+        records: Memory-mapped array of all records (RECORD_DTYPE)
+    """
+
+    def __init__(self, path):
+        """
+        Open a scene file and read its header, trailer and string table.
+
+        Raises:
+            ValueError: If the file is not a scene file
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+            f.seek(-_TRAILER.size, 2)
+            trailer = f.read(_TRAILER.size)
+            magic, version, self.width, self.height, background_id, title_id = \
+                _HEADER.unpack_from(header)
+            count, records_offset, strings_offset, trailer_magic = _TRAILER.unpack(trailer)
+            if magic != MAGIC or trailer_magic != TRAILER_MAGIC:
+                raise ValueError(f"{path} is not a scene file")
+            if version != VERSION:
+                raise ValueError(f"Unsupported scene file version: {version}")
+            f.seek(strings_offset)
+            (string_count,) = struct.unpack('<I', f.read(4))
+            self.strings = []
+            for _ in range(string_count):
+                (length,) = struct.unpack('<I', f.read(4))
+                self.strings.append(f.read(length).decode('utf-8'))
+        self.background_color = self.strings[background_id]
+        self.title = self.strings[title_id]
+        if count:
+            self.records = np.memmap(path, dtype=RECORD_DTYPE, mode='r',
+                                     offset=records_offset, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=RECORD_DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    def chunks(self, chunk_size=65536):
+        """Yield consecutive slices of the memory-mapped records."""
+        for start in range(0, len(self.records), chunk_size):
+            yield self.records[start:start + chunk_size]
+
+    def __iter__(self):
+        """Yield a Circle, Rectangle or Text object per record, one at a time."""
+        from Shapes import Circle, Rectangle
+        strings = self.strings
+        for chunk in self.chunks():
+            for record in chunk:
+                kind = record['kind']
+                if kind == CIRCLE:
+                    yield Circle(float(record['a']), float(record['x']), float(record['y']),
+                                 strings[record['style0']], strings[record['style1']],
+                                 float(record['c']))
+                elif kind == RECTANGLE:
+                    yield Rectangle(float(record['a']), float(record['b']),
+                                    float(record['x']), float(record['y']),
+                                    strings[record['style0']], strings[record['style1']],
+                                    float(record['c']))
+                else:
+                    yield self._text(record)
+
+    def _text(self, record):
+        from Text import Text
+        return Text(self.strings[record['text']], float(record['x']), float(record['y']),
+                    font_size=float(record['a']),
+                    font_family=self.strings[record['style1']],
+                    color=self.strings[record['style0']],
+                    bold=bool(record['flags'] & BOLD),
+                    italic=bool(record['flags'] & ITALIC),
+                    alignment=ALIGNMENTS[record['align']])
+
+    def append_shapes(self, store, records):
+        """
+        Append the shape records of a chunk to a ShapeStore in bulk.
+
+        Returns:
+            The new rows in the store
+        """
+        records = records[records['kind'] != TEXT]
+        # Map file string ids to the store's style ids, only for ids in use
+        used = np.unique(np.concatenate([records['style0'], records['style1']]))
+        remap = np.zeros(len(self.strings), dtype=np.int32)
+        remap[used] = [store.styles.intern(self.strings[i]) for i in used]
+        kind = np.where(records['kind'] == CIRCLE, store.CIRCLE, store.RECTANGLE)
+        return store.extend(kind, records['x'], records['y'], records['a'], records['b'],
+                            records['c'], remap[records['style0']], remap[records['style1']])
+
+    def load(self, canvas=None, chunk_size=65536):
+        """
+        Load the scene into a canvas without creating per-shape objects.
+
+        Args:
+            canvas: Canvas to add to (default: a new Canvas, or a text Canvas
+                if the file has text items)
+            chunk_size: Number of records processed at a time (default: 65536)
+
+        Returns:
+            The canvas
+
+        Raises:
+            ValueError: If the file has text items and the canvas given
+                cannot hold text; nothing is added to it then
+        """
+        if canvas is None or not hasattr(canvas, 'add_text'):
+            has_text = any((chunk['kind'] == TEXT).any() for chunk in self.chunks(chunk_size))
+            if canvas is not None and has_text:
+                raise ValueError("The scene has text items, which need a text Canvas")
+        if canvas is None:
+            if has_text:
+                from Text import Canvas
+            else:
+                from Canvas import Canvas
+            canvas = Canvas(self.width, self.height, self.background_color, self.title)
+        for chunk in self.chunks(chunk_size):
+            self.append_shapes(canvas.store, chunk)
+            for record in chunk[chunk['kind'] == TEXT]:
+                canvas.add_text(self._text(record))
+        return canvas
+
+
+def load_canvas(path):
+    """Read a scene file into a new canvas."""
+    return SceneReader(path).load()
+
+
+def render_file(path, scale=1.0, antialias=True, chunk_size=65536):
+    """
+    Render a scene file with the raster backend, one chunk at a time, so
+    only one chunk of shapes is in memory besides the image.
+
+    Text items are composited on top of all shapes once the shapes are
+    drawn, the same way a text Canvas renders them.
+
+    Returns:
+        A uint8 RGBA array of shape (height, width, 4)
+    """
+    from Raster import CANVAS_DPI, rasterize, to_rgba8
+    from Shapes import ShapeStore
+    reader = SceneReader(path)
+    buffer = None
+    texts = []
+    for chunk in reader.chunks(chunk_size):
+        store = ShapeStore(capacity=len(chunk))
+        reader.append_shapes(store, chunk)
+        buffer = rasterize(store, reader.width, reader.height, reader.background_color,
+                           scale, antialias, buffer=buffer)
+        texts.extend(reader._text(record) for record in chunk[chunk['kind'] == TEXT])
+    if buffer is None:
+        buffer = rasterize(ShapeStore(), reader.width, reader.height,
+                           reader.background_color, scale, antialias)
+    if texts:
+        from Labels import composite_labels
+        anchors = [(text.x * scale, (reader.height - text.y) * scale) for text in texts]
+        composite_labels(buffer, texts, anchors, CANVAS_DPI * scale)
+    return to_rgba8(buffer)
@@ -0,0 +1,480 @@
+"""
+A long-running local render service.
+
+The server speaks plain HTTP/1.1 on localhost or on a Unix socket, so
+clients skip the cost of starting Python and importing matplotlib for
+every image:
+
+    POST /render    body: a scene dict as JSON (see Export), answered
+                    with the PNG or SVG bytes
+    GET  /metrics   queue depth, request counts and latency percentiles
+    GET  /health    "ok"
+
+Renders run in a pool of worker processes that are started and warmed
+up (matplotlib loaded, one figure created) before the server accepts
+connections. At most two renders per worker are in flight; further
+requests wait in a bounded queue, and once that is full they are
+refused with 503 so clients back off. A request that takes longer than
+the timeout gets 504. An invalid scene gets 400, any other failure 500;
+if a worker process dies, the pool is started again.
+
+    python Server.py --port 8765 --workers 4
+    python Server.py --socket /tmp/render.sock
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from Export import init_worker, run_job
+
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+    'pdf': 'application/pdf',
+}
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable',
+           504: 'Gateway Timeout'}
+
+# A tiny scene rendered once per worker at startup
+_WARM_UP_SCENE = {'type': 'canvas', 'width': 8, 'height': 8, 'shapes': []}
+
+
+class ServerBusy(Exception):
+    """Raised when the render queue is full."""
+
+
+class RenderFailed(Exception):
+    """Raised when a render fails for a reason other than an invalid scene."""
+
+
+class ServerMetrics:
+    """Request counters and a window of recent latencies."""
+
+    def __init__(self, window=1000):
+        """
+        Initialize a ServerMetrics.
+
+        Args:
+            window: Number of recent requests the latency percentiles are
+                computed over (default: 1000)
+        """
+        self.requests = 0
+        self.errors = 0         # Invalid scenes (400)
+        self.failures = 0       # Renders that failed on the server side (500)
+        self.pool_restarts = 0  # Times the worker pool was started again
+        self.rejected = 0
+        self.timeouts = 0
+        self.queued = 0     # Requests waiting for a free render slot
+        self.in_flight = 0  # Requests being rendered
+        self.latencies = deque(maxlen=window)
+        self.render_seconds = deque(maxlen=window)
+
+    def record(self, latency, render_seconds):
+        """Record the latency of a finished request and the worker's render time."""
+        self.latencies.append(latency)
+        self.render_seconds.append(render_seconds)
+
+    @staticmethod
+    def _percentiles(values):
+        if not values:
+            return {'p50': None, 'p95': None, 'p99': None}
+        ordered = sorted(values)
+        last = len(ordered) - 1
+        return {name: ordered[round(last * q)] for name, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))}
+
+    def as_dict(self):
+        """Return the metrics as plain data, as served on /metrics."""
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'failures': self.failures,
+            'pool_restarts': self.pool_restarts,
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+            'queue_depth': self.queued,
+            'in_flight': self.in_flight,
+            'latency_seconds': self._percentiles(self.latencies),
+            'render_seconds': self._percentiles(self.render_seconds),
+        }
+
+
+class RenderServer:
+    """Renders scenes in warm worker processes and serves them over HTTP."""
+
+    def __init__(self, workers=None, max_queue=64, timeout=30.0, cache_dir=None,
+                 max_body_bytes=64 << 20):
+        """
+        Initialize a RenderServer. Call start() to launch it.
+
+        Args:
+            workers: Number of worker processes (default: number of CPUs)
+            max_queue: Requests allowed to wait for a free worker before new
+                ones are refused (default: 64)
+            timeout: Seconds a request may take before it fails (default: 30)
+            cache_dir: Directory of a render cache shared by the workers
+                (default: None)
+            max_body_bytes: Largest accepted request body (default: 64 MiB)
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        self.max_body_bytes = max_body_bytes
+        self.metrics = ServerMetrics()
+        self._pool = None
+        self._slots = None
+        self._server = None
+
+    async def start(self, host='127.0.0.1', port=8765, path=None):
+        """
+        Start the workers, warm them up and begin accepting connections.
+
+        Args:
+            host: Address to listen on (default: localhost only)
+            port: TCP port; 0 picks a free one (default: 8765)
+            path: Listen on this Unix socket instead of TCP
+        """
+        loop = asyncio.get_running_loop()
+        self._pool = self._new_pool()
+        self._slots = asyncio.Semaphore(2 * self.workers)
+        # One job per worker starts every process before the first request
+        await asyncio.gather(*(loop.run_in_executor(self._pool, run_job, 0, _WARM_UP_SCENE)
+                               for _ in range(self.workers)))
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._serve, path=path)
+        else:
+            self._server = await asyncio.start_server(self._serve, host, port)
+        return self
+
+    def _new_pool(self):
+        # Forking the threaded server process can leave a worker stuck on a
+        # lock another thread held, so workers come from a fork server
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else None)
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                   initializer=init_worker, initargs=(self.cache_dir,))
+
+    def _restart_pool(self, broken):
+        """Replace a broken pool, unless another request already did."""
+        if self._pool is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._new_pool()
+            self.metrics.pool_restarts += 1
+
+    @property
+    def address(self):
+        """The (host, port) or socket path the server listens on."""
+        return self._server.sockets[0].getsockname()
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        """Stop accepting connections and shut the workers down."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._pool is not None:
+            # Queued renders are dropped; running ones are left to finish
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def render(self, scene):
+        """
+        Render a scene in a worker process.
+
+        Args:
+            scene: A scene dict (see Export); any 'output' path is ignored
+
+        Returns:
+            (data, content type, seconds the worker spent rendering)
+
+        Raises:
+            ServerBusy: If the queue is full
+            asyncio.TimeoutError: If waiting and rendering together took
+                longer than the timeout
+            ValueError: If the scene is invalid
+            RenderFailed: If the render failed for another reason
+        """
+        metrics = self.metrics
+        if self._slots.locked() and metrics.queued >= self.max_queue:
+            metrics.rejected += 1
+            raise ServerBusy(f"{metrics.queued} requests are already waiting")
+        scene = {name: value for name, value in scene.items() if name != 'output'}
+        image_format = scene.get('format', 'png')
+        loop = asyncio.get_running_loop()
+        # Waiting for a slot and rendering share one timeout
+        deadline = loop.time() + self.timeout
+
+        metrics.queued += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        finally:
+            metrics.queued -= 1
+        metrics.in_flight += 1
+
+        def finished(_=None):
+            # The slot is held until the worker is really done, even if the
+            # request timed out, so a stuck render cannot oversubscribe the pool
+            metrics.in_flight -= 1
+            self._slots.release()
+
+        pool = self._pool
+        try:
+            future = loop.run_in_executor(pool, run_job, 0, scene)
+        except BrokenProcessPool:
+            finished()
+            self._restart_pool(pool)
+            raise RenderFailed("The worker pool was broken and has been restarted")
+        future.add_done_callback(finished)
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), max(deadline - loop.time(), 0))
+        except BrokenProcessPool:
+            self._restart_pool(pool)
+            raise RenderFailed("A worker process died during the render; the pool has been restarted")
+        if not result.ok:
+            message = result.error.strip().splitlines()[-1]
+            raise ValueError(message) if result.invalid else RenderFailed(message)
+        return result.data, CONTENT_TYPES.get(image_format, 'application/octet-stream'), result.seconds
+
+    async def _serve(self, reader, writer):
+        """Handle the requests of one connection (kept alive between requests)."""
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except ValueError as error:
+                    await self._respond(writer, 400, str(error).encode(), 'text/plain', close=True)
+                    break
+                if request is None:
+                    break
+                method, target, headers, body = request
+                close = headers.get('connection', '').lower() == 'close'
+                status, data, content_type = await self._dispatch(method, target, body)
+                await self._respond(writer, status, data, content_type, close)
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        """Read one HTTP request. Returns None when the client closed the connection."""
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError as error:
+            if not error.partial:
+                return None
+            raise
+        except asyncio.LimitOverrunError:
+            raise ValueError("Request header too large")
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            raise ValueError("Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length > self.max_body_bytes:
+            raise ValueError("Request body too large")
+        body = await reader.readexactly(length) if length else b''
+        return method, target, headers, body
+
+    async def _dispatch(self, method, target, body):
+        """Return (status, body, content type) for a request."""
+        path = target.split('?', 1)[0]
+        if path == '/health':
+            return 200, b'ok', 'text/plain'
+        if path == '/metrics':
+            return 200, json.dumps(self.metrics.as_dict()).encode(), 'application/json'
+        if path != '/render':
+            return 404, b'Not found', 'text/plain'
+        if method != 'POST':
+            return 405, b'Use POST', 'text/plain'
+
+        metrics = self.metrics
+        metrics.requests += 1
+        start = time.perf_counter()
+        try:
+            scene = json.loads(body)
+            if not isinstance(scene, dict):
+                raise ValueError("The scene must be a JSON object")
+            data, content_type, render_seconds = await self.render(scene)
+        except ServerBusy as error:
+            return 503, str(error).encode(), 'text/plain'
+        except asyncio.TimeoutError:
+            metrics.timeouts += 1
+            return 504, f"Render took longer than {self.timeout}s".encode(), 'text/plain'
+        except ValueError as error:
+            metrics.errors += 1
+            return 400, str(error).encode(), 'text/plain'
+        except RenderFailed as error:
+            metrics.failures += 1
+            return 500, str(error).encode(), 'text/plain'
+        metrics.record(time.perf_counter() - start, render_seconds)
+        return 200, data, content_type
+
+    @staticmethod
+    async def _respond(writer, status, data, content_type, close=False):
+        head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+                f"Content-Type: {content_type}",
+                f"Content-Length: {len(data)}"]
+        if status == 503:
+            head.append("Retry-After: 1")
+        if close:
+            head.append("Connection: close")
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + data)
+        await writer.drain()
+
+
+class RenderClient:
+    """
+    A small blocking client for a RenderServer that keeps its connection open.
+
+        client = RenderClient(port=8765)
+        png = client.render(canvas.to_scene())
+        print(client.metrics()['latency_seconds'])
+    """
+
+    def __init__(self, host='127.0.0.1', port=8765, path=None, timeout=60.0):
+        """
+        Initialize a RenderClient.
+
+        Args:
+            host: Host of the server (default: localhost)
+            port: Port of the server (default: 8765)
+            path: Unix socket path of the server, instead of host and port
+            timeout: Socket timeout in seconds (default: 60)
+        """
+        self.host = host
+        self.port = port
+        self.path = path
+        self.timeout = timeout
+        self._socket = None
+        self._file = None
+
+    def _connect(self):
+        if self.path is not None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+        else:
+            sock = socket.create_connection((self.host, self.port), self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket = sock
+        self._file = sock.makefile('rb')
+
+    def request(self, method, target, body=b''):
+        """
+        Send one request.
+
+        Returns:
+            (status, headers, body)
+        """
+        if self._socket is None:
+            self._connect()
+        head = f"{method} {target} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n"
+        try:
+            self._socket.sendall(head.encode('latin-1') + body)
+            status_line = self._file.readline()
+            if not status_line:
+                raise ConnectionError("The server closed the connection")
+        except (ConnectionError, OSError):
+            self.close()
+            raise
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = self._file.readline().decode('latin-1').strip()
+            if not line:
+                break
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        data = self._file.read(int(headers.get('content-length', 0)))
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, headers, data
+
+    def render(self, scene):
+        """
+        Render a scene dict and return the image bytes.
+
+        Raises:
+            RuntimeError: If the server answered with an error
+        """
+        status, _, data = self.request('POST', '/render', json.dumps(scene).encode())
+        if status != 200:
+            raise RuntimeError(f"Render failed ({status}): {data.decode(errors='replace')}")
+        return data
+
+    def metrics(self):
+        """Return the server metrics as a dict."""
+        return json.loads(self.request('GET', '/metrics')[2])
+
+    def close(self):
+        if self._socket is not None:
+            self._file.close()
+            self._socket.close()
+            self._socket = None
+            self._file = None
+
+
+async def _main(args):
+    server = RenderServer(args.workers, args.max_queue, args.timeout, args.cache_dir)
+    await server.start(args.host, args.port, args.socket)
+    print(f"Serving on {server.address}", file=sys.stderr, flush=True)
+    serving = asyncio.ensure_future(server.serve_forever())
+    # Shut the workers down cleanly on SIGTERM as well as Ctrl+C
+    loop = asyncio.get_running_loop()
+    for name in ('SIGINT', 'SIGTERM'):
+        if hasattr(signal, name):
+            try:
+                loop.add_signal_handler(getattr(signal, name), serving.cancel)
+            except NotImplementedError:  # Windows event loops
+                pass
+    try:
+        await serving
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve scene renders over local HTTP.")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on")
+    parser.add_argument('--port', type=int, default=8765, help="TCP port to listen on")
+    parser.add_argument('--socket', default=None, help="Listen on a Unix socket instead")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument('--max-queue', type=int, default=64,
+                        help="Waiting requests allowed before new ones are refused")
+    parser.add_argument('--timeout', type=float, default=30.0, help="Seconds allowed per request")
+    parser.add_argument('--cache-dir', default=None, help="Directory of a shared render cache")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
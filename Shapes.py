@@ -0,0 +1,607 @@
+import math
+import weakref
+
+import numpy as np
+
+
+class StyleTable:
+    """A table that interns color names so shapes can store small integer ids."""
+
+    def __init__(self):
+        """Initialize an empty StyleTable."""
+        self.names = []
+        self._ids = {}
+
+    def intern(self, name):
+        """
+        Return the id for a color, adding it to the table if it is new.
+
+        Args:
+            name: Any matplotlib color specification
+        """
+        key = name if isinstance(name, str) else tuple(name)
+        style_id = self._ids.get(key)
+        if style_id is None:
+            style_id = len(self.names)
+            self._ids[key] = style_id
+            self.names.append(name)
+        return style_id
+
+    def name(self, style_id):
+        """Return the color stored under an id."""
+        return self.names[style_id]
+
+    def __len__(self):
+        return len(self.names)
+
+
+class ShapeStore:
+    """
+    Columnar storage for circles and rectangles.
+
+    Every shape is one row in a set of NumPy arrays. Circles keep their
+    radius in both the width and height columns; rectangles keep their
+    size there and (x, y) is their bottom-left corner. Removed rows are
+    recycled, and the order column remembers insertion order so drawing
+    order does not change when rows are reused.
+
+    Objects in the observers list are told about every change through
+    shape_added(row), shape_removed(row), shape_changed(row) and
+    store_cleared(), which is how indexes stay up to date.
+
+    Each row has at most one shape object over it (see view()). When a
+    row is removed or the store is cleared while its shape object is
+    still around, the shape's data moves to a loose row first, so the
+    object never ends up over a row that is reused for another shape.
+    """
+
+    CIRCLE = 0
+    RECTANGLE = 1
+
+    _FLOAT_COLUMNS = ('x', 'y', 'width', 'height', 'stroke_width')
+    _INT_COLUMNS = ('fill_id', 'stroke_id')
+
+    def __init__(self, capacity=16, styles=None):
+        """
+        Initialize an empty ShapeStore.
+
+        Args:
+            capacity: Number of rows to allocate up front (default: 16)
+            styles: StyleTable to intern colors into (default: a new table)
+        """
+        self.styles = styles if styles is not None else StyleTable()
+        self._allocate(max(int(capacity), 1))
+        self.size = 0       # High-water mark of used rows
+        self.count = 0      # Number of live rows
+        self._free = []
+        self._next_order = 0
+        self._reused = False
+        self.observers = []
+        views = self._views = {}  # row -> weak reference to the shape object over it
+
+        def forget(ref):
+            # A shape died: drop its entry, unless its row has a newer shape
+            if views.get(ref.key) is ref:
+                del views[ref.key]
+        self._forget = forget
+
+    def _allocate(self, capacity):
+        self.kind = np.zeros(capacity, dtype=np.int8)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.order = np.zeros(capacity, dtype=np.int64)
+        for name in self._FLOAT_COLUMNS:
+            setattr(self, name, np.zeros(capacity, dtype=np.float64))
+        for name in self._INT_COLUMNS:
+            setattr(self, name, np.zeros(capacity, dtype=np.int32))
+
+    def _grow(self):
+        capacity = len(self.kind) * 2
+        for name in ('kind', 'alive', 'order') + self._FLOAT_COLUMNS + self._INT_COLUMNS:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def add(self, kind, x, y, width, height, stroke_width, fill, stroke):
+        """
+        Add a shape and return its row.
+
+        Args:
+            kind: ShapeStore.CIRCLE or ShapeStore.RECTANGLE
+            x, y: Position of the shape
+            width, height: Size of the shape (the radius twice for circles)
+            stroke_width: Width of the boundary line
+            fill: Fill color
+            stroke: Boundary color
+        """
+        if self._free:
+            row = self._free.pop()
+            self._reused = True
+        else:
+            if self.size == len(self.kind):
+                self._grow()
+            row = self.size
+            self.size += 1
+        self.kind[row] = kind
+        self.alive[row] = True
+        self.order[row] = self._next_order
+        self._next_order += 1
+        self.x[row] = x
+        self.y[row] = y
+        self.width[row] = width
+        self.height[row] = height
+        self.stroke_width[row] = stroke_width
+        self.fill_id[row] = self.styles.intern(fill)
+        self.stroke_id[row] = self.styles.intern(stroke)
+        self.count += 1
+        for observer in self.observers:
+            observer.shape_added(row)
+        return row
+
+    def extend(self, kind, x, y, width, height, stroke_width, fill_id, stroke_id):
+        """
+        Append many shapes at once from arrays, without creating shape objects.
+
+        Args:
+            kind, x, y, width, height, stroke_width: Arrays with one entry per shape
+            fill_id, stroke_id: Arrays of ids in this store's style table
+
+        Returns:
+            The new rows as an array
+        """
+        n = len(x)
+        while self.size + n > len(self.kind):
+            self._grow()
+        rows = np.arange(self.size, self.size + n)
+        self.size += n
+        self.kind[rows] = kind
+        self.alive[rows] = True
+        self.order[rows] = np.arange(self._next_order, self._next_order + n)
+        self._next_order += n
+        self.x[rows] = x
+        self.y[rows] = y
+        self.width[rows] = width
+        self.height[rows] = height
+        self.stroke_width[rows] = stroke_width
+        self.fill_id[rows] = fill_id
+        self.stroke_id[rows] = stroke_id
+        self.count += n
+        for observer in self.observers:
+            for row in rows.tolist():
+                observer.shape_added(row)
+        return rows
+
+    def set(self, row, column, value):
+        """
+        Change one value of a shape.
+
+        Args:
+            row: The row of the shape
+            column: Name of the column, e.g. 'x' or 'fill_id'
+            value: The new value
+
+        Raises:
+            ValueError: If the row holds no shape
+        """
+        if not self.alive[row]:
+            raise ValueError(f"Row {row} holds no shape")
+        getattr(self, column)[row] = value
+        for observer in self.observers:
+            observer.shape_changed(row)
+
+    def remove(self, row):
+        """Free a row so it can be reused."""
+        if not self.alive[row]:
+            return
+        ref = self._views.pop(row, None)
+        if ref is not None and ref() is not None:
+            _release(ref())
+        for observer in self.observers:
+            observer.shape_removed(row)
+        self.alive[row] = False
+        self._free.append(row)
+        self.count -= 1
+
+    def clear(self):
+        """Remove every shape from the store."""
+        for row, ref in list(self._views.items()):
+            shape = ref()
+            if shape is not None and self.alive[row]:
+                _release(shape)
+        self._views.clear()
+        self.alive[:self.size] = False
+        self.size = 0
+        self.count = 0
+        self._free = []
+        self._reused = False
+        for observer in self.observers:
+            observer.store_cleared()
+
+    def take(self, other, row):
+        """
+        Move a row out of another store into this one.
+
+        Args:
+            other: The ShapeStore that currently owns the row
+            row: The row in the other store
+
+        Returns:
+            The row of the shape in this store; its shape object, if any, is
+            no longer registered with the other store
+        """
+        new_row = self._copy(other, row)
+        other._views.pop(row, None)
+        other.remove(row)
+        return new_row
+
+    def _copy(self, other, row):
+        """Add a copy of a row of another store and return the new row."""
+        return self.add(
+            other.kind[row], other.x[row], other.y[row],
+            other.width[row], other.height[row], other.stroke_width[row],
+            other.styles.name(other.fill_id[row]),
+            other.styles.name(other.stroke_id[row])
+        )
+
+    def rows(self):
+        """Return the live rows as an array, in the order they were added."""
+        rows = np.flatnonzero(self.alive[:self.size])
+        if self._reused:
+            rows = rows[np.argsort(self.order[rows], kind='stable')]
+        return rows
+
+    def columns(self, rows=None):
+        """
+        Return the columns for the given rows (default: all live rows).
+
+        Returns:
+            A dict of arrays keyed by column name, including is_circle
+        """
+        if rows is None:
+            rows = self.rows()
+        columns = {name: getattr(self, name)[rows]
+                   for name in self._FLOAT_COLUMNS + self._INT_COLUMNS}
+        columns['is_circle'] = self.kind[rows] == self.CIRCLE
+        return columns
+
+    def bounds(self, rows=None):
+        """
+        Return the bounding boxes of shapes (default: all live shapes).
+
+        Returns:
+            Four arrays (x0, y0, x1, y1)
+        """
+        if rows is None:
+            rows = self.rows()
+        x = self.x[rows]
+        y = self.y[rows]
+        width = self.width[rows]
+        height = self.height[rows]
+        is_circle = self.kind[rows] == self.CIRCLE
+        x0 = np.where(is_circle, x - width, x)
+        y0 = np.where(is_circle, y - height, y)
+        return x0, y0, x + width, y + height
+
+    def bounds_of(self, row):
+        """Return the bounding box (x0, y0, x1, y1) of a single shape."""
+        x = float(self.x[row])
+        y = float(self.y[row])
+        width = float(self.width[row])
+        height = float(self.height[row])
+        if self.kind[row] == self.CIRCLE:
+            return (x - width, y - height, x + width, y + height)
+        return (x, y, x + width, y + height)
+
+    def contains_point(self, rows, px, py):
+        """
+        Test which of the given shapes contain a point.
+
+        Returns:
+            A boolean array, one entry per row
+        """
+        dx = px - self.x[rows]
+        dy = py - self.y[rows]
+        width = self.width[rows]
+        height = self.height[rows]
+        in_circle = dx * dx + dy * dy <= width * width
+        in_rect = (dx >= 0) & (dx <= width) & (dy >= 0) & (dy <= height)
+        return np.where(self.kind[rows] == self.CIRCLE, in_circle, in_rect)
+
+    def sort_by_order(self, rows):
+        """Return rows sorted into drawing order."""
+        rows = np.asarray(rows, dtype=np.intp)
+        return rows[np.argsort(self.order[rows], kind='stable')]
+
+    def areas(self, rows=None):
+        """Return the area of every live shape as an array."""
+        if rows is None:
+            rows = self.rows()
+        width = self.width[rows]
+        height = self.height[rows]
+        return np.where(self.kind[rows] == self.CIRCLE,
+                        math.pi * np.float_power(width, 2), width * height)
+
+    def view(self, row):
+        """
+        Return the Circle or Rectangle over a row.
+
+        The same object is returned for as long as it is referenced, so
+        every holder sees it leave the store when it is removed.
+        """
+        row = int(row)
+        ref = self._views.get(row)
+        shape = ref() if ref is not None else None
+        if shape is None:
+            cls = Circle if self.kind[row] == self.CIRCLE else Rectangle
+            shape = object.__new__(cls)
+            shape._store = self
+            shape._row = row
+            self._register(row, shape)
+        return shape
+
+    def _register(self, row, shape):
+        """Make a shape object the one view() returns for a row, while it lives."""
+        self._views[row] = weakref.KeyedRef(shape, self._forget, row)
+
+    def __len__(self):
+        return self.count
+
+
+# Shapes that are not on any canvas live here until they are added to one
+_loose = ShapeStore()
+
+
+def attach(shape, store):
+    """
+    Move a shape's row into a store, e.g. the store of a canvas.
+
+    Args:
+        shape: A Circle or Rectangle
+        store: The ShapeStore that should own the shape
+    """
+    if shape._store is not store:
+        shape._row = store.take(shape._store, shape._row)
+        shape._store = store
+        store._register(shape._row, shape)
+
+
+def _release(shape):
+    """Copy the row of a shape that is leaving its store into a loose row."""
+    store = shape._store
+    if store is _loose:
+        # Loose rows only go away with their shape, so there is nowhere to move to
+        return
+    shape._row = _loose._copy(store, shape._row)
+    shape._store = _loose
+    _loose._register(shape._row, shape)
+
+
+def detach(shape):
+    """Move a shape out of its store so it no longer belongs to any canvas."""
+    attach(shape, _loose)
+
+
+def shape_to_dict(shape):
+    """Describe a Circle or Rectangle as a plain dict."""
+    if isinstance(shape, Circle):
+        data = {'type': 'circle', 'radius': shape.radius}
+    else:
+        data = {'type': 'rectangle', 'width': shape.width, 'height': shape.height}
+    data.update(x=shape.x, y=shape.y, fill=shape.fill, stroke=shape.stroke,
+                stroke_width=shape.stroke_width)
+    return data
+
+
+def shape_from_dict(data):
+    """
+    Create a Circle or Rectangle from a dict made by shape_to_dict().
+
+    Raises:
+        ValueError: If the shape type is unknown
+    """
+    data = dict(data)
+    shape_type = data.pop('type', None)
+    if shape_type == 'circle':
+        return Circle(**data)
+    if shape_type == 'rectangle':
+        return Rectangle(**data)
+    raise ValueError(f"Unknown shape type: {shape_type!r}")
+
+
+class ShapeList:
+    """A read-only sequence of the shapes in a ShapeStore."""
+
+    __slots__ = ('_store',)
+
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return self._store.count
+
+    def __iter__(self):
+        store = self._store
+        for row in store.rows():
+            yield store.view(row)
+
+    def __getitem__(self, index):
+        rows = self._store.rows()
+        if isinstance(index, slice):
+            return [self._store.view(row) for row in rows[index]]
+        return self._store.view(rows[index])
+
+    def __contains__(self, shape):
+        return (getattr(shape, '_store', None) is self._store
+                and bool(self._store.alive[shape._row]))
+
+
+class _Shape:
+    """Base class for shapes that are views over a row in a ShapeStore."""
+
+    __slots__ = ('_store', '_row', '__weakref__')
+
+    def _set(self, column, value):
+        self._store.set(self._row, column, value)
+
+    @property
+    def row(self):
+        """The row of the shape in its store; it changes when the shape moves to another canvas."""
+        return self._row
+
+    @property
+    def x(self):
+        return float(self._store.x[self._row])
+
+    @x.setter
+    def x(self, value):
+        self._set('x', value)
+
+    @property
+    def y(self):
+        return float(self._store.y[self._row])
+
+    @y.setter
+    def y(self, value):
+        self._set('y', value)
+
+    @property
+    def fill(self):
+        store = self._store
+        return store.styles.name(store.fill_id[self._row])
+
+    @fill.setter
+    def fill(self, value):
+        self._set('fill_id', self._store.styles.intern(value))
+
+    @property
+    def stroke(self):
+        store = self._store
+        return store.styles.name(store.stroke_id[self._row])
+
+    @stroke.setter
+    def stroke(self, value):
+        self._set('stroke_id', self._store.styles.intern(value))
+
+    @property
+    def stroke_width(self):
+        return float(self._store.stroke_width[self._row])
+
+    @stroke_width.setter
+    def stroke_width(self, value):
+        self._set('stroke_width', value)
+
+    def __del__(self):
+        # Rows on a canvas belong to the canvas; only loose rows die with the shape
+        try:
+            if self._store is _loose:
+                _loose.remove(self._row)
+        except (AttributeError, TypeError):
+            pass
+
+
+class Circle(_Shape):
+    """A class to represent a circle with position and graphical attributes."""
+
+    __slots__ = ()
+
+    def __init__(self, radius, x=0, y=0, fill='blue', stroke='black', stroke_width=2):
+        """
+        Initialize a Circle.
+
+        Args:
+            radius: The radius of the circle
+            x: X-coordinate of the circle's center (default: 0)
+            y: Y-coordinate of the circle's center (default: 0)
+            fill: Color to fill the inside (default: 'blue')
+            stroke: Color of the boundary line (default: 'black')
+            stroke_width: Width of the boundary line (default: 2)
+        """
+        self._store = _loose
+        self._row = _loose.add(ShapeStore.CIRCLE, x, y, radius, radius,
+                               stroke_width, fill, stroke)
+        _loose._register(self._row, self)
+
+    @property
+    def radius(self):
+        return float(self._store.width[self._row])
+
+    @radius.setter
+    def radius(self, value):
+        self._set('width', value)
+        self._set('height', value)
+
+    def area(self):
+        """Calculate and return the area of the circle."""
+        return math.pi * self.radius ** 2
+
+    def circumference(self):
+        """Calculate and return the circumference of the circle."""
+        return 2 * math.pi * self.radius
+
+    def diameter(self):
+        """Calculate and return the diameter of the circle."""
+        return 2 * self.radius
+
+    def __str__(self):
+        return f"Circle(radius={self.radius}, pos=({self.x},{self.y}), fill={self.fill})"
+
+
+
+class Rectangle(_Shape):
+    """A class to represent a rectangle with position and graphical attributes."""
+
+    __slots__ = ()
+
+    def __init__(self, width, height, x=0, y=0, fill='red', stroke='black', stroke_width=2):
+        """
+        Initialize a Rectangle.
+
+        Args:
+            width: The width of the rectangle
+            height: The height of the rectangle
+            x: X-coordinate of the rectangle's bottom-left corner (default: 0)
+            y: Y-coordinate of the rectangle's bottom-left corner (default: 0)
+            fill: Color to fill the inside (default: 'red')
+            stroke: Color of the boundary line (default: 'black')
+            stroke_width: Width of the boundary line (default: 2)
+        """
+        self._store = _loose
+        self._row = _loose.add(ShapeStore.RECTANGLE, x, y, width, height,
+                               stroke_width, fill, stroke)
+        _loose._register(self._row, self)
+
+    @property
+    def width(self):
+        return float(self._store.width[self._row])
+
+    @width.setter
+    def width(self, value):
+        self._set('width', value)
+
+    @property
+    def height(self):
+        return float(self._store.height[self._row])
+
+    @height.setter
+    def height(self, value):
+        self._set('height', value)
+
+    def area(self):
+        """Calculate and return the area of the rectangle."""
+        return self.width * self.height
+
+    def perimeter(self):
+        """Calculate and return the perimeter of the rectangle."""
+        return 2 * (self.width + self.height)
+
+    def diagonal(self):
+        """Calculate and return the diagonal of the rectangle."""
+        return math.sqrt(self.width**2 + self.height**2)
+
+    def bounding_box(self):
+        """Return the bounding box of the rectangle."""
+        return (self.width, self.height)
+
+    def __str__(self):
+        return f"Rectangle(width={self.width}, height={self.height}, pos=({self.x},{self.y}), fill={self.fill})"
+
@@ -0,0 +1,120 @@
+import math
+
+import numpy as np
+
+
+class GridIndex:
+    """
+    A uniform grid over the bounding boxes of the shapes in a ShapeStore.
+
+    Each shape is registered in every grid cell its bounding box touches,
+    so point and rectangle queries only look at shapes in nearby cells.
+    The index observes its store and updates itself when shapes are added,
+    removed, changed or cleared.
+    """
+
+    def __init__(self, store, cell_size=64):
+        """
+        Initialize a GridIndex and register the shapes already in the store.
+
+        Args:
+            store: The ShapeStore to index
+            cell_size: Width and height of a grid cell (default: 64)
+        """
+        if cell_size <= 0:
+            raise ValueError("cell_size must be positive")
+        self.store = store
+        self.cell_size = cell_size
+        self._cells = {}      # (i, j) -> set of rows
+        self._row_cells = {}  # row -> list of (i, j) the row is registered in
+        for row in store.rows():
+            self._insert(int(row))
+        store.observers.append(self)
+
+    def close(self):
+        """Stop following the store."""
+        if self in self.store.observers:
+            self.store.observers.remove(self)
+
+    def _cell_range(self, x0, y0, x1, y1):
+        size = self.cell_size
+        return (math.floor(x0 / size), math.floor(y0 / size),
+                math.floor(x1 / size), math.floor(y1 / size))
+
+    def _insert(self, row):
+        i0, j0, i1, j1 = self._cell_range(*self.store.bounds_of(row))
+        keys = [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+        for key in keys:
+            self._cells.setdefault(key, set()).add(row)
+        self._row_cells[row] = keys
+
+    def _delete(self, row):
+        for key in self._row_cells.pop(row, ()):
+            cell = self._cells[key]
+            cell.discard(row)
+            if not cell:
+                del self._cells[key]
+
+    # Store observer interface
+
+    def shape_added(self, row):
+        self._insert(row)
+
+    def shape_removed(self, row):
+        self._delete(row)
+
+    def shape_changed(self, row):
+        self._delete(row)
+        self._insert(row)
+
+    def store_cleared(self):
+        self._cells = {}
+        self._row_cells = {}
+
+    # Queries
+
+    def rows_at(self, x, y):
+        """
+        Return the rows of shapes that contain a point, in drawing order.
+
+        Args:
+            x: X-coordinate of the point
+            y: Y-coordinate of the point
+        """
+        i, j, _, _ = self._cell_range(x, y, x, y)
+        candidates = self._cells.get((i, j))
+        if not candidates:
+            return np.empty(0, dtype=np.intp)
+        rows = np.fromiter(candidates, dtype=np.intp, count=len(candidates))
+        rows = rows[self.store.contains_point(rows, x, y)]
+        return self.store.sort_by_order(rows)
+
+    def rows_in(self, x0, y0, x1, y1):
+        """
+        Return the rows of shapes whose bounding box overlaps a rectangle,
+        in drawing order.
+
+        Args:
+            x0, y0: Lower-left corner of the rectangle
+            x1, y1: Upper-right corner of the rectangle
+        """
+        i0, j0, i1, j1 = self._cell_range(x0, y0, x1, y1)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self._cells):
+            keys = [key for key in self._cells
+                    if i0 <= key[0] <= i1 and j0 <= key[1] <= j1]
+        else:
+            keys = [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+        found = set()
+        for key in keys:
+            cell = self._cells.get(key)
+            if cell:
+                found.update(cell)
+        if not found:
+            return np.empty(0, dtype=np.intp)
+        rows = np.fromiter(found, dtype=np.intp, count=len(found))
+        bx0, by0, bx1, by1 = self.store.bounds(rows)
+        rows = rows[(bx0 <= x1) & (bx1 >= x0) & (by0 <= y1) & (by1 >= y0)]
+        return self.store.sort_by_order(rows)
+
+    def __len__(self):
+        return len(self._row_cells)
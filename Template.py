@@ -0,0 +1,389 @@
+"""
+Declarative scene templates, compiled once and re-rendered by scaling.
+
+A Template lists its elements (stripes, rectangles, ellipses and lines)
+in template units, inside a width x height box, and names its colors by
+role. Compiling it turns every element into filled outlines: one vertex
+array with matplotlib path codes, the start of each outline and the
+color role it is filled with. Strokes and lines become filled outlines
+too (rings and quads), so their widths are template units and scale
+with the rest.
+
+Rendering a CompiledScene at another size or resolution only scales the
+vertex array, and another color scheme only swaps the color table; the
+construction code is not run again. That makes many variants cheap:
+
+    scene = template.compile()
+    for palette in palettes:
+        png = scene.render_png(None, width=600, palette=palette)
+"""
+import math
+from collections import OrderedDict
+
+import numpy as np
+
+# matplotlib.path.Path codes
+MOVETO, LINETO, CURVE4, CLOSEPOLY = 1, 2, 4, 79
+
+
+def _unit_circle():
+    """Return the vertices and codes of a closed circle made of four cubic Beziers."""
+    k = 4 / 3 * math.tan(math.pi / 8)
+    vertices = [(1.0, 0.0)]
+    for quarter in range(4):
+        a = quarter * math.pi / 2
+        b = a + math.pi / 2
+        start, end = (math.cos(a), math.sin(a)), (math.cos(b), math.sin(b))
+        vertices += [(start[0] - k * start[1], start[1] + k * start[0]),
+                     (end[0] + k * end[1], end[1] - k * end[0]),
+                     end]
+    vertices.append((1.0, 0.0))
+    codes = [MOVETO] + [CURVE4] * 12 + [CLOSEPOLY]
+    return np.array(vertices), np.array(codes, dtype=np.uint8)
+
+
+_CIRCLE_VERTICES, _CIRCLE_CODES = _unit_circle()
+_BOX_CODES = np.array([MOVETO, LINETO, LINETO, LINETO, CLOSEPOLY], dtype=np.uint8)
+
+
+def _box(x, y, width, height):
+    return (np.array([(x, y), (x + width, y), (x + width, y + height), (x, y + height), (x, y)]),
+            _BOX_CODES)
+
+
+def _ellipse(cx, cy, width, height, reverse=False):
+    vertices = _CIRCLE_VERTICES * (width / 2, height / 2) + (cx, cy)
+    if reverse:
+        # The same curves walked the other way round, to cut a hole; the
+        # last vertex only closes the path
+        vertices = np.concatenate([vertices[-2::-1], vertices[-1:]])
+    return vertices, _CIRCLE_CODES
+
+
+class Stripe:
+    """A band across the whole width of the template."""
+
+    def __init__(self, y, height, color):
+        """
+        Initialize a Stripe.
+
+        Args:
+            y: Bottom of the stripe
+            height: Height of the stripe
+            color: Color role (or a color) to fill it with
+        """
+        self.y = y
+        self.height = height
+        self.color = color
+
+    def outlines(self, template):
+        """Return a list of (vertices, codes, color) outlines."""
+        return [(*_box(0, self.y, template.width, self.height), self.color)]
+
+
+class Box:
+    """An axis-aligned rectangle."""
+
+    def __init__(self, x, y, width, height, color):
+        """
+        Initialize a Box.
+
+        Args:
+            x, y: Bottom-left corner
+            width, height: Size of the rectangle
+            color: Color role (or a color) to fill it with
+        """
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.color = color
+
+    def outlines(self, template):
+        return [(*_box(self.x, self.y, self.width, self.height), self.color)]
+
+
+class Ellipse:
+    """An axis-aligned ellipse, optionally with a stroke around its edge."""
+
+    def __init__(self, cx, cy, width, height, fill, stroke=None, stroke_width=0.0):
+        """
+        Initialize an Ellipse.
+
+        Args:
+            cx, cy: Center
+            width, height: Diameters along x and y
+            fill: Color role (or a color) to fill it with
+            stroke: Color role of the edge (default: None, no edge)
+            stroke_width: Width of the edge in template units, centered on
+                the outline (default: 0.0)
+        """
+        self.cx = cx
+        self.cy = cy
+        self.width = width
+        self.height = height
+        self.fill = fill
+        self.stroke = stroke
+        self.stroke_width = stroke_width
+
+    def scaled(self, x_factor, y_factor, fill):
+        """Return a plain ellipse with the same center, scaled relative to this one."""
+        return Ellipse(self.cx, self.cy, self.width * x_factor, self.height * y_factor, fill)
+
+    def outlines(self, template):
+        outlines = [(*_ellipse(self.cx, self.cy, self.width, self.height), self.fill)]
+        if self.stroke is not None and self.stroke_width > 0:
+            w = self.stroke_width
+            outer, codes = _ellipse(self.cx, self.cy, self.width + w, self.height + w)
+            inner, _ = _ellipse(self.cx, self.cy, max(self.width - w, 0), max(self.height - w, 0),
+                                reverse=True)
+            outlines.append((np.concatenate([outer, inner]), np.concatenate([codes, codes]),
+                             self.stroke))
+        return outlines
+
+
+class Line:
+    """A straight line with square ends that reach half its width past the endpoints."""
+
+    def __init__(self, x0, y0, x1, y1, color, width):
+        """
+        Initialize a Line.
+
+        Args:
+            x0, y0: Start point
+            x1, y1: End point
+            color: Color role (or a color) of the line
+            width: Width of the line in template units
+        """
+        self.x0 = x0
+        self.y0 = y0
+        self.x1 = x1
+        self.y1 = y1
+        self.color = color
+        self.width = width
+
+    @classmethod
+    def through(cls, cx, cy, length, angle, color, width):
+        """
+        Create a line centered on a point.
+
+        Args:
+            cx, cy: Center of the line
+            length: Length of the line
+            angle: Direction in degrees, counterclockwise from the x axis
+            color, width: See Line()
+        """
+        dx = length / 2 * math.cos(math.radians(angle))
+        dy = length / 2 * math.sin(math.radians(angle))
+        return cls(cx - dx, cy - dy, cx + dx, cy + dy, color, width)
+
+    def outlines(self, template):
+        length = math.hypot(self.x1 - self.x0, self.y1 - self.y0)
+        if length == 0:
+            return []
+        half = self.width / 2
+        ux, uy = (self.x1 - self.x0) / length * half, (self.y1 - self.y0) / length * half
+        start = (self.x0 - ux, self.y0 - uy)
+        end = (self.x1 + ux, self.y1 + uy)
+        # Corners of the line's rectangle, with the normal (-uy, ux)
+        vertices = np.array([(start[0] + uy, start[1] - ux), (end[0] + uy, end[1] - ux),
+                             (end[0] - uy, end[1] + ux), (start[0] - uy, start[1] + ux),
+                             (start[0] + uy, start[1] - ux)])
+        return [(vertices, _BOX_CODES, self.color)]
+
+
+class Template:
+    """A scene described by its elements, to be compiled once and rendered many times."""
+
+    def __init__(self, width, height, elements=(), palette=None, title=None):
+        """
+        Initialize a Template.
+
+        Args:
+            width, height: Size of the template box in template units
+            elements: Stripe, Box, Ellipse and Line objects, back to front
+            palette: Dict mapping color roles to colors; roles that are
+                not in it are used as colors directly (default: empty)
+            title: Title shown above the scene by CompiledScene.draw()
+        """
+        self.width = width
+        self.height = height
+        self.elements = list(elements)
+        self.palette = dict(palette or {})
+        self.title = title
+
+    def add(self, element):
+        """Add an element in front of the others and return it."""
+        self.elements.append(element)
+        return element
+
+    def compile(self):
+        """
+        Turn the elements into outline arrays.
+
+        Returns:
+            A CompiledScene
+        """
+        roles = {}
+        vertices, codes, starts, color_ids = [], [], [0], []
+        for element in self.elements:
+            for outline_vertices, outline_codes, color in element.outlines(self):
+                key = color if isinstance(color, str) else tuple(color)
+                color_ids.append(roles.setdefault(key, len(roles)))
+                vertices.append(outline_vertices)
+                codes.append(outline_codes)
+                starts.append(starts[-1] + len(outline_codes))
+        return CompiledScene(
+            self.width, self.height,
+            np.concatenate(vertices) if vertices else np.zeros((0, 2)),
+            np.concatenate(codes) if codes else np.zeros(0, dtype=np.uint8),
+            np.array(starts), np.array(color_ids, dtype=np.intp),
+            list(roles), self.palette, self.title)
+
+    def __str__(self):
+        return f"Template({self.width}x{self.height}, elements={len(self.elements)})"
+
+
+class CompiledScene:
+    """The outlines of a compiled Template, ready to be scaled and colored."""
+
+    def __init__(self, width, height, vertices, codes, starts, color_ids, roles, palette, title=None):
+        """
+        Initialize a CompiledScene. Use Template.compile() to make one.
+
+        Args:
+            width, height: Size of the template box
+            vertices: (n, 2) array of every outline's vertices, back to front
+            codes: matplotlib path code of every vertex
+            starts: Index of the first vertex of each outline, and the total
+            color_ids: Index into roles of each outline's color
+            roles: The color roles used
+            palette: Default colors of the roles
+            title: Title shown by draw()
+        """
+        self.width = width
+        self.height = height
+        self.vertices = vertices
+        self.codes = codes
+        self.starts = starts
+        self.color_ids = color_ids
+        self.roles = roles
+        self.palette = palette
+        self.title = title
+        self._paths = None
+        self._colors = OrderedDict()
+
+    def colors(self, palette=None):
+        """
+        Return the RGBA fill color of every outline.
+
+        Args:
+            palette: Dict of role colors overriding the default palette
+        """
+        if palette:
+            # Colors can come from JSON as lists, which cannot be hashed
+            from matplotlib.colors import to_rgba
+            palette = {role: to_rgba(color) for role, color in palette.items()}
+        key = tuple(sorted((palette or {}).items()))
+        colors = self._colors.get(key)
+        if colors is None:
+            from Raster import color_table
+            merged = {**self.palette, **(palette or {})}
+            table = color_table([merged.get(role, role) for role in self.roles])
+            colors = self._colors[key] = table[self.color_ids]
+            if len(self._colors) > 64:
+                self._colors.popitem(last=False)
+        else:
+            self._colors.move_to_end(key)
+        return colors
+
+    def paths(self):
+        """Return the outlines as matplotlib paths in template units (made once)."""
+        if self._paths is None:
+            from matplotlib.path import Path
+            self._paths = [Path(self.vertices[start:end], self.codes[start:end])
+                           for start, end in zip(self.starts[:-1], self.starts[1:])]
+        return self._paths
+
+    def draw(self, ax, palette=None):
+        """
+        Draw the scene onto matplotlib axes, in template units.
+
+        Args:
+            ax: The matplotlib axes to draw on
+            palette: Dict of role colors overriding the default palette
+
+        Returns:
+            The collection that was added
+        """
+        from matplotlib.collections import PathCollection
+
+        collection = PathCollection(self.paths(), facecolors=self.colors(palette),
+                                    edgecolors='none', linewidths=0, transform=ax.transData)
+        ax.add_collection(collection, autolim=False)
+        ax.set_xlim(0, self.width)
+        ax.set_ylim(0, self.height)
+        ax.set_aspect('equal')
+        ax.axis('off')
+        return collection
+
+    def render_array(self, width, height=None, palette=None, background='none'):
+        """
+        Render the scene to pixels, without a figure.
+
+        The outlines are drawn straight onto an Agg renderer through a
+        scaling transform, so nothing else of matplotlib is involved.
+
+        Args:
+            width: Width of the image in pixels
+            height: Height of the image in pixels (default: keep the
+                template's aspect ratio)
+            palette: Dict of role colors overriding the default palette
+            background: Color behind the scene (default: 'none', transparent)
+
+        Returns:
+            A uint8 array of shape (height, width, 4)
+        """
+        from matplotlib.backends.backend_agg import RendererAgg
+        from matplotlib.colors import to_rgba
+        from matplotlib.transforms import Affine2D
+
+        width = max(int(round(width)), 1)
+        if height is None:
+            height = width * self.height / self.width
+        height = max(int(round(height)), 1)
+        renderer = RendererAgg(width, height, 72)
+        gc = renderer.new_gc()
+        gc.set_linewidth(0)
+        if to_rgba(background)[3] > 0:
+            from matplotlib.path import Path
+            renderer.draw_path(gc, Path.unit_rectangle(), Affine2D().scale(width, height),
+                               to_rgba(background))
+        transform = Affine2D().scale(width / self.width, height / self.height)
+        for path, color in zip(self.paths(), self.colors(palette)):
+            renderer.draw_path(gc, path, transform, tuple(color))
+        gc.restore()
+        return np.asarray(renderer.buffer_rgba()).copy()
+
+    def render_png(self, file, width, height=None, palette=None, background='none'):
+        """
+        Render the scene to a PNG file, or to PNG bytes if file is None.
+
+        Args:
+            file: Path to write to, or None
+            width, height, palette, background: See render_array()
+        """
+        from Raster import encode_png
+        data = encode_png(self.render_array(width, height, palette, background))
+        if file is None:
+            return data
+        with open(file, 'wb') as f:
+            f.write(data)
+        return None
+
+    def __len__(self):
+        return len(self.color_ids)
+
+    def __str__(self):
+        return (f"CompiledScene({self.width}x{self.height}, outlines={len(self)}, "
+                f"vertices={len(self.vertices)}, roles={self.roles})")
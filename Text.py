@@ -1,6 +1,7 @@
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-import math
+from Canvas import Canvas as ShapeCanvas
+from Labels import OVERLAP_MODES, composite_labels
+from Shapes import Circle, Rectangle
+from TextLayout import CANVAS_DPI, layout_text
 
 
 class Text:
@@ -36,6 +37,22 @@ class Text:
         """Return the number of characters in the text."""
         return len(self.content)
     
+    def layout(self, max_width=None):
+        """
+        Measure the text and break it into lines without drawing it.
+        
+        Args:
+            max_width: Wrap lines at spaces to fit this width (default: None)
+        
+        Returns:
+            A TextLayout with the lines, their offsets and the bounding box
+        """
+        return layout_text(self, max_width)
+    
+    def get_bbox(self):
+        """Return the bounding box (x0, y0, x1, y1) of the text in canvas units."""
+        return layout_text(self).bbox
+    
     def to_uppercase(self):
         """Convert the text content to uppercase."""
         self.content = self.content.upper()
@@ -49,31 +66,21 @@ class Text:
         return f"Text('{self.content}', pos=({self.x},{self.y}), size={self.font_size})"
 
 
-class Canvas:
+class Canvas(ShapeCanvas):
     """A class to represent a canvas where shapes and text can be displayed."""
     
     def __init__(self, width=800, height=600, background_color='white', title='Canvas'):
         """Initialize a Canvas."""
-        self.width = width
-        self.height = height
-        self.background_color = background_color
-        self.title = title
-        self.shapes = []
+        super().__init__(width, height, background_color, title)
         self.texts = []
-    
-    def add_shape(self, shape):
-        """Add a shape to the canvas."""
-        self.shapes.append(shape)
+        # How batched and raster renders treat overlapping labels:
+        # None draws them all, 'drop' or 'merge' (see Labels.select_labels)
+        self.label_overlap = None
     
     def add_text(self, text):
         """Add text to the canvas."""
         self.texts.append(text)
     
-    def remove_shape(self, shape):
-        """Remove a shape from the canvas."""
-        if shape in self.shapes:
-            self.shapes.remove(shape)
-    
     def remove_text(self, text):
         """Remove text from the canvas."""
         if text in self.texts:
@@ -81,37 +88,45 @@ class Canvas:
     
     def clear(self):
         """Remove all shapes and text from the canvas."""
-        self.shapes = []
+        super().clear()
         self.texts = []
     
-    def display(self):
-        """Display the canvas with all its shapes and text."""
-        fig, ax = plt.subplots(figsize=(self.width/100, self.height/100))
-        ax.set_facecolor(self.background_color)
+    def set_label_overlap(self, overlap):
+        """
+        Choose how overlapping labels are drawn by batched and raster renders.
+        
+        Args:
+            overlap: None to draw every label, 'drop' to leave out labels
+                that overlap an earlier one, or 'merge' to draw one label
+                per group of overlapping labels
+        """
+        if overlap not in OVERLAP_MODES:
+            raise ValueError(f"overlap must be one of {OVERLAP_MODES}, not {overlap!r}")
+        self.label_overlap = overlap
+    
+    def _rasterize(self, scale, antialias, incremental):
+        """Rasterize the shapes, then composite all text on top of them."""
+        buffer = super()._rasterize(scale, antialias, incremental)
+        if self.texts:
+            if incremental:
+                # The kept frame holds only shapes, so its regions can be redrawn
+                buffer = buffer.copy()
+            anchors = [(text.x * scale, (self.height - text.y) * scale) for text in self.texts]
+            composite_labels(buffer, self.texts, anchors, CANVAS_DPI * scale, self.label_overlap)
+        return buffer
+    
+    def _draw(self, ax, batched, rows=None):
+        """
+        Draw the shapes, then all text on top of them. Batched renders
+        composite the text from a glyph atlas as one image.
+        """
+        super()._draw(ax, batched, rows)
         
-        # Draw all shapes
-        for shape in self.shapes:
-            if isinstance(shape, Circle):
-                circle = mpatches.Circle(
-                    (shape.x, shape.y),
-                    shape.radius,
-                    facecolor=shape.fill,
-                    edgecolor=shape.stroke,
-                    linewidth=shape.stroke_width
-                )
-                ax.add_patch(circle)
-            elif isinstance(shape, Rectangle):
-                rectangle = mpatches.Rectangle(
-                    (shape.x, shape.y),
-                    shape.width,
-                    shape.height,
-                    facecolor=shape.fill,
-                    edgecolor=shape.stroke,
-                    linewidth=shape.stroke_width
-                )
-                ax.add_patch(rectangle)
+        if batched:
+            from Render import draw_labels_batched
+            draw_labels_batched(ax, self.texts, self.label_overlap)
+            return
         
-        # Draw all text
         for text in self.texts:
             font_weight = 'bold' if text.bold else 'normal'
             font_style = 'italic' if text.italic else 'normal'
@@ -128,58 +143,31 @@ class Canvas:
                 ha=text.alignment,
                 va='bottom'
             )
-        
-        ax.set_xlim(0, self.width)
-        ax.set_ylim(0, self.height)
-        ax.set_aspect('equal')
-        ax.set_title(self.title, fontsize=14, fontweight='bold')
-        plt.tight_layout()
-        plt.show()
+    
+    def to_scene(self):
+        """Describe the canvas, including its text, as a plain dict."""
+        scene = super().to_scene()
+        scene['texts'] = [dict(vars(text)) for text in self.texts]
+        if self.label_overlap is not None:
+            scene['label_overlap'] = self.label_overlap
+        return scene
+    
+    @classmethod
+    def from_scene(cls, scene):
+        """Build a canvas with shapes and text from a scene description."""
+        canvas = super().from_scene(scene)
+        for data in scene.get('texts', ()):
+            canvas.add_text(Text(**data))
+        canvas.set_label_overlap(scene.get('label_overlap'))
+        return canvas
     
     def get_item_count(self):
         """Return the total number of items (shapes + text) on the canvas."""
-        return len(self.shapes) + len(self.texts)
+        return self.store.count + len(self.texts)
     
     def __str__(self):
         """String representation of the Canvas."""
-        return f"Canvas(width={self.width}, height={self.height}, shapes={len(self.shapes)}, texts={len(self.texts)})"
-
-
-class Circle:
-    """A class to represent a circle."""
-    
-    def __init__(self, radius, x=0, y=0, fill='blue', stroke='black', stroke_width=2):
-        self.radius = radius
-        self.x = x
-        self.y = y
-        self.fill = fill
-        self.stroke = stroke
-        self.stroke_width = stroke_width
-    
-    def area(self):
-        return math.pi * self.radius ** 2
-    
-    def __str__(self):
-        return f"Circle(radius={self.radius}, pos=({self.x},{self.y}))"
-
-
-class Rectangle:
-    """A class to represent a rectangle."""
-    
-    def __init__(self, width, height, x=0, y=0, fill='red', stroke='black', stroke_width=2):
-        self.width = width
-        self.height = height
-        self.x = x
-        self.y = y
-        self.fill = fill
-        self.stroke = stroke
-        self.stroke_width = stroke_width
-    
-    def area(self):
-        return self.width * self.height
-    
-    def __str__(self):
-        return f"Rectangle(width={self.width}, height={self.height}, pos=({self.x},{self.y}))"
+        return f"Canvas(width={self.width}, height={self.height}, shapes={self.store.count}, texts={len(self.texts)})"
 
 
 # Test the Text class
@@ -203,7 +191,8 @@ if __name__ == "__main__":
     print("Original text4:", text4.content)
     text4.to_uppercase()
     print("After uppercase:", text4.content)
-    print(f"Length: {text4.get_length()} characters\n")
+    print(f"Length: {text4.get_length()} characters")
+    print(f"Bounding box: {tuple(round(v, 1) for v in text4.get_bbox())}\n")
     
     # Add shapes for background
     rect_bg = Rectangle(width=500, height=80, x=50, y=270, 
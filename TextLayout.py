@@ -0,0 +1,216 @@
+from collections import OrderedDict
+
+# Canvas units are pixels at this resolution, see Raster.CANVAS_DPI
+CANVAS_DPI = 100
+
+# Distance between baselines as a multiple of the font size, as in matplotlib
+LINE_SPACING = 1.2
+
+
+def font_key(text):
+    """Return the font settings of a Text object as a hashable key."""
+    return (text.font_family, float(text.font_size), bool(text.bold), bool(text.italic))
+
+
+def find_font(key):
+    """Return matplotlib's FT2Font for a font key, picked the way matplotlib would."""
+    from matplotlib.font_manager import FontProperties, findfont, get_font
+    family, size, bold, italic = key
+    properties = FontProperties(family=family, size=size,
+                                weight='bold' if bold else 'normal',
+                                style='italic' if italic else 'normal')
+    return get_font(findfont(properties))
+
+
+class GlyphCache:
+    """
+    A bounded LRU cache of glyph advances and font metrics.
+
+    Advances are looked up once per (font settings, character) through
+    FreeType, using the same font files matplotlib would pick, and are
+    then served from the cache. The least recently used entries are
+    dropped when the cache is full.
+    """
+
+    def __init__(self, maxsize=65536, dpi=CANVAS_DPI):
+        """
+        Initialize a GlyphCache.
+
+        Args:
+            maxsize: Maximum number of glyph advances kept (default: 65536)
+            dpi: Resolution the metrics are computed for (default: 100)
+        """
+        self.maxsize = maxsize
+        self.dpi = dpi
+        self.hits = 0
+        self.misses = 0
+        self._advances = OrderedDict()
+        self._fonts = {}
+
+    def _font(self, key):
+        """Return (FT2Font, ascent, descent) for a font key."""
+        font = self._fonts.get(key)
+        if font is None:
+            ft_font = find_font(key)
+            pixels = key[1] * self.dpi / 72.0
+            ascent = ft_font.ascender / ft_font.units_per_EM * pixels
+            descent = -ft_font.descender / ft_font.units_per_EM * pixels
+            font = (ft_font, ascent, descent)
+            self._fonts[key] = font
+        return font
+
+    def advance(self, key, char):
+        """
+        Return the horizontal advance of a character in canvas units.
+
+        Args:
+            key: Font settings as returned by font_key()
+            char: A single character
+        """
+        entry = (key, char)
+        advance = self._advances.get(entry)
+        if advance is not None:
+            self.hits += 1
+            self._advances.move_to_end(entry)
+            return advance
+        self.misses += 1
+        from matplotlib.ft2font import LoadFlags
+        ft_font = self._font(key)[0]
+        # The font objects are shared with matplotlib, so always set the size
+        ft_font.set_size(key[1], self.dpi)
+        advance = ft_font.load_char(ord(char), flags=LoadFlags.NO_HINTING).linearHoriAdvance / 65536
+        self._advances[entry] = advance
+        if len(self._advances) > self.maxsize:
+            self._advances.popitem(last=False)
+        return advance
+
+    def line_width(self, key, line):
+        """Return the width of a single line of text in canvas units."""
+        advance = self.advance
+        return sum(advance(key, char) for char in line)
+
+    def vertical_metrics(self, key):
+        """Return (ascent, descent, line_height) of a font in canvas units."""
+        _, ascent, descent = self._font(key)
+        return ascent, descent, key[1] * self.dpi / 72.0 * LINE_SPACING
+
+    def clear(self):
+        """Drop every cached entry."""
+        self._advances.clear()
+        self._fonts.clear()
+
+    def __len__(self):
+        return len(self._advances)
+
+
+class TextLayout:
+    """The measured lines and extent of a Text object."""
+
+    def __init__(self, lines, line_widths, line_offsets, bbox, line_height):
+        """
+        Initialize a TextLayout.
+
+        Args:
+            lines: The lines of text after line breaking
+            line_widths: Width of each line
+            line_offsets: X offset of each line from the left edge of the block
+            bbox: Bounding box (x0, y0, x1, y1) of the whole block
+            line_height: Distance between baselines
+        """
+        self.lines = lines
+        self.line_widths = line_widths
+        self.line_offsets = line_offsets
+        self.bbox = bbox
+        self.line_height = line_height
+
+    @property
+    def width(self):
+        return self.bbox[2] - self.bbox[0]
+
+    @property
+    def height(self):
+        return self.bbox[3] - self.bbox[1]
+
+    def __str__(self):
+        return f"TextLayout(lines={len(self.lines)}, bbox={self.bbox})"
+
+
+def wrap_line(cache, key, line, max_width):
+    """
+    Break one line into lines no wider than max_width, at spaces.
+
+    Words that are wider than max_width on their own get a line to themselves.
+    """
+    words = line.split(' ')
+    space = cache.advance(key, ' ')
+    lines = []
+    current = []
+    current_width = 0.0
+    for word in words:
+        word_width = cache.line_width(key, word)
+        if current and current_width + space + word_width > max_width:
+            lines.append(' '.join(current))
+            current = [word]
+            current_width = word_width
+        else:
+            current_width += (space if current else 0.0) + word_width
+            current.append(word)
+    lines.append(' '.join(current))
+    return lines
+
+
+# Shared cache used when no cache is given
+default_cache = GlyphCache()
+
+
+def layout_text(text, max_width=None, cache=None):
+    """
+    Lay out a Text object without rendering it.
+
+    Lines are split at newlines and, if max_width is given, wrapped at
+    spaces. The block is aligned around text.x according to
+    text.alignment, with its bottom at text.y like Canvas.display() draws it.
+
+    Args:
+        text: The Text object
+        max_width: Maximum line width in canvas units (default: no wrapping)
+        cache: GlyphCache to use (default: the shared default_cache)
+
+    Returns:
+        A TextLayout
+    """
+    cache = cache if cache is not None else default_cache
+    key = font_key(text)
+    lines = []
+    for line in text.content.split('\n'):
+        if max_width is None:
+            lines.append(line)
+        else:
+            lines.extend(wrap_line(cache, key, line, max_width))
+
+    widths = [cache.line_width(key, line) for line in lines]
+    width = max(widths) if widths else 0.0
+    ascent, descent, line_height = cache.vertical_metrics(key)
+    height = ascent + descent + line_height * (len(lines) - 1)
+
+    if text.alignment == 'center':
+        x0 = text.x - width / 2
+        offsets = [(width - w) / 2 for w in widths]
+    elif text.alignment == 'right':
+        x0 = text.x - width
+        offsets = [width - w for w in widths]
+    else:
+        x0 = text.x
+        offsets = [0.0] * len(widths)
+    bbox = (x0, text.y, x0 + width, text.y + height)
+    return TextLayout(lines, widths, offsets, bbox, line_height)
+
+
+def text_bboxes(texts, cache=None):
+    """
+    Measure many Text objects at once.
+
+    Returns:
+        A list of (x0, y0, x1, y1) bounding boxes, one per text
+    """
+    return [layout_text(text, cache=cache).bbox for text in texts]
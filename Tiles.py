@@ -0,0 +1,270 @@
+"""
+Tiled rendering of very large canvases.
+
+The output image is split into square tiles. Every shape is assigned to
+the tiles its bounding box touches, and the tiles are rasterized in
+worker processes, each receiving only the columns of its own shapes.
+The tiles are either stitched into one PNG a row of tiles at a time, or
+written as a tile pyramid of {zoom}/{x}/{y}.png files, so the full image
+is never held in memory. Like render_to_array(), this draws the shapes
+only (no text).
+
+    python Tiles.py poster.scn poster.png --scale 4 --workers 8
+    python Tiles.py map.scn tiles/ --pyramid --tile-size 256
+"""
+import argparse
+import math
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from Raster import CANVAS_DPI, PNGWriter, new_buffer, rasterize, to_rgba8, write_png
+from Shapes import ShapeStore, StyleTable
+
+# Columns sent to the workers for each tile
+_COLUMNS = ('kind', 'x', 'y', 'width', 'height', 'stroke_width', 'fill_id', 'stroke_id')
+
+
+def image_size(canvas, scale=1.0):
+    """Return the (width, height) in pixels of a canvas rendered at a scale."""
+    return max(int(round(canvas.width * scale)), 1), max(int(round(canvas.height * scale)), 1)
+
+
+def assign_tiles(store, height, scale, tile_size, columns, rows_of_tiles):
+    """
+    Assign shapes to the tiles their bounding boxes touch.
+
+    Args:
+        store: The ShapeStore holding the shapes
+        height: Height of the canvas in canvas units
+        scale: Pixels per canvas unit
+        tile_size: Size of a tile in pixels
+        columns: Number of tiles across
+        rows_of_tiles: Number of tiles down
+
+    Returns:
+        A dict mapping (tx, ty) to the rows in that tile, in drawing order.
+        Tiles without shapes are left out.
+    """
+    rows = store.rows()
+    x0, y0, x1, y1 = store.bounds(rows)
+    # Pad by half the stroke and one pixel for anti-aliasing, as rasterize() does
+    pad = store.stroke_width[rows] * CANVAS_DPI / 144.0 * scale + 1
+    tx0 = np.maximum(np.floor((x0 * scale - pad) / tile_size), 0).astype(np.int64)
+    tx1 = np.minimum(np.floor((x1 * scale + pad) / tile_size), columns - 1).astype(np.int64)
+    ty0 = np.maximum(np.floor(((height - y1) * scale - pad) / tile_size), 0).astype(np.int64)
+    ty1 = np.minimum(np.floor(((height - y0) * scale + pad) / tile_size), rows_of_tiles - 1).astype(np.int64)
+
+    spans_x = np.maximum(tx1 - tx0 + 1, 0)
+    counts = spans_x * np.maximum(ty1 - ty0 + 1, 0)
+    # Expand every shape into one entry per tile it touches
+    entry_rows = np.repeat(rows, counts)
+    position = np.arange(len(entry_rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    span = np.repeat(spans_x, counts)
+    tile_x = np.repeat(tx0, counts) + position % np.maximum(span, 1)
+    tile_y = np.repeat(ty0, counts) + position // np.maximum(span, 1)
+    tile_ids = tile_y * columns + tile_x
+
+    # A stable sort keeps the drawing order within each tile
+    sort = np.argsort(tile_ids, kind='stable')
+    tile_ids, entry_rows = tile_ids[sort], entry_rows[sort]
+    unique, starts = np.unique(tile_ids, return_index=True)
+    ends = np.append(starts[1:], len(tile_ids))
+    return {(int(t % columns), int(t // columns)): entry_rows[s:e]
+            for t, s, e in zip(unique.tolist(), starts.tolist(), ends.tolist())}
+
+
+def render_tile(job):
+    """
+    Rasterize one tile (runs in a worker process).
+
+    Args:
+        job: (tx, ty, origin, size, columns, style names, settings) where
+            settings is (width, height, background, scale, antialias)
+
+    Returns:
+        (tx, ty, uint8 RGBA array of the tile)
+    """
+    tx, ty, origin, size, columns, names, settings = job
+    width, height, background, scale, antialias = settings
+    styles = StyleTable()
+    for name in names:
+        styles.intern(name)
+    store = ShapeStore(max(len(columns['x']), 1), styles)
+    store.extend(*(columns[name] for name in _COLUMNS))
+    buffer = new_buffer(size[0], size[1], background)
+    rasterize(store, width, height, background, scale, antialias,
+              buffer=buffer, origin=origin)
+    return tx, ty, to_rgba8(buffer)
+
+
+def iter_tiles(canvas, tile_size=512, scale=1.0, antialias=True, workers=None, pool=None):
+    """
+    Render a canvas tile by tile, yielding tiles as they are finished.
+
+    Tiles are submitted row by row, with at most two per worker in flight,
+    so only a few tiles are in memory at any time.
+
+    Args:
+        canvas: The Canvas to render
+        tile_size: Size of a tile in pixels (default: 512)
+        scale: Pixels per canvas unit (default: 1.0)
+        antialias: Smooth the edges of shapes (default: True)
+        workers: Number of worker processes; 1 renders in this process
+            (default: number of CPUs)
+        pool: An existing ProcessPoolExecutor to use instead of a new one
+
+    Yields:
+        (tx, ty, tile) tuples, where tile is a uint8 RGBA array. Tiles on the
+        right and bottom edges may be smaller than tile_size.
+    """
+    out_w, out_h = image_size(canvas, scale)
+    columns = math.ceil(out_w / tile_size)
+    rows_of_tiles = math.ceil(out_h / tile_size)
+    store = canvas.store
+    tiles = assign_tiles(store, canvas.height, scale, tile_size, columns, rows_of_tiles)
+    settings = (canvas.width, canvas.height, canvas.background_color, scale, antialias)
+    names = list(store.styles.names)
+    empty = to_rgba8(new_buffer(tile_size, tile_size, canvas.background_color))
+
+    def jobs():
+        for ty in range(rows_of_tiles):
+            for tx in range(columns):
+                size = (min(tile_size, out_w - tx * tile_size), min(tile_size, out_h - ty * tile_size))
+                rows = tiles.get((tx, ty))
+                if rows is None:
+                    # Tiles without shapes are plain background
+                    yield None, (tx, ty, empty[:size[1], :size[0]])
+                    continue
+                data = {name: getattr(store, name)[rows] for name in _COLUMNS}
+                yield (tx, ty, (tx * tile_size, ty * tile_size), size, data, names, settings), None
+
+    workers = workers or os.cpu_count() or 1
+    if pool is None and workers <= 1:
+        for job, blank in jobs():
+            yield blank if job is None else render_tile(job)
+        return
+
+    own_pool = pool is None
+    if own_pool:
+        pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        pending = set()
+        for job, blank in jobs():
+            if job is None:
+                yield blank
+                continue
+            pending.add(pool.submit(render_tile, job))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        if own_pool:
+            pool.shutdown(cancel_futures=True)
+
+
+def write_tiled_png(canvas, path, tile_size=512, scale=1.0, antialias=True, workers=None):
+    """
+    Render a canvas in tiles and stitch them into one PNG file.
+
+    Only one row of tiles (plus the tiles in flight) is held in memory;
+    each row is compressed and written as soon as it is complete.
+
+    Args:
+        canvas: The Canvas to render
+        path: File path of the PNG
+        tile_size: Size of a tile in pixels (default: 512)
+        scale: Pixels per canvas unit (default: 1.0)
+        antialias: Smooth the edges of shapes (default: True)
+        workers: Number of worker processes (default: number of CPUs)
+    """
+    out_w, out_h = image_size(canvas, scale)
+    columns = math.ceil(out_w / tile_size)
+    finished = {}
+    next_row = 0
+    with open(path, 'wb') as f:
+        writer = PNGWriter(f, out_w, out_h)
+        for tx, ty, tile in iter_tiles(canvas, tile_size, scale, antialias, workers):
+            finished[tx, ty] = tile
+            # Write every row of tiles that is now complete, in order
+            while all((x, next_row) in finished for x in range(columns)):
+                band = np.concatenate([finished.pop((x, next_row)) for x in range(columns)], axis=1)
+                writer.write_rows(band)
+                next_row += 1
+                if next_row * tile_size >= out_h:
+                    break
+        writer.close()
+
+
+def write_tile_pyramid(canvas, directory, tile_size=256, scale=1.0, antialias=True, workers=None):
+    """
+    Render a canvas as a pyramid of tiles for map-style viewers.
+
+    The deepest zoom level has the full resolution; each level above it
+    halves the scale, down to level 0 where the whole canvas fits in one
+    tile. Each level is rendered from the shapes, not downsampled.
+    Tiles are written to directory/{zoom}/{x}/{y}.png.
+
+    Args:
+        canvas: The Canvas to render
+        directory: Directory to write the tiles to
+        tile_size: Size of a tile in pixels (default: 256)
+        scale: Pixels per canvas unit at the deepest level (default: 1.0)
+        antialias: Smooth the edges of shapes (default: True)
+        workers: Number of worker processes (default: number of CPUs)
+
+    Returns:
+        The deepest zoom level
+    """
+    out_w, out_h = image_size(canvas, scale)
+    max_zoom = max(math.ceil(math.log2(max(out_w, out_h) / tile_size)), 0)
+    workers = workers or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for zoom in range(max_zoom, -1, -1):
+            level_scale = scale / 2 ** (max_zoom - zoom)
+            for tx, ty, tile in iter_tiles(canvas, tile_size, level_scale, antialias, workers, pool):
+                folder = os.path.join(directory, str(zoom), str(tx))
+                os.makedirs(folder, exist_ok=True)
+                write_png(os.path.join(folder, f"{ty}.png"), tile)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return max_zoom
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render a scene file in tiles.")
+    parser.add_argument('scene', help="Scene file written by SceneFile.save_canvas()")
+    parser.add_argument('output', help="PNG file, or a directory with --pyramid")
+    parser.add_argument('--pyramid', action='store_true', help="Write a tile pyramid")
+    parser.add_argument('--tile-size', type=int, default=None,
+                        help="Tile size in pixels (default: 512, or 256 with --pyramid)")
+    parser.add_argument('--scale', type=float, default=1.0, help="Pixels per canvas unit")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of worker processes (default: number of CPUs)")
+    args = parser.parse_args(argv)
+
+    from SceneFile import load_canvas
+    canvas = load_canvas(args.scene)
+    if args.pyramid:
+        zoom = write_tile_pyramid(canvas, args.output, args.tile_size or 256, args.scale,
+                                  workers=args.workers)
+        print(f"Wrote zoom levels 0-{zoom} to {args.output}")
+    else:
+        write_tiled_png(canvas, args.output, args.tile_size or 512, args.scale,
+                        workers=args.workers)
+        width, height = image_size(canvas, args.scale)
+        print(f"Wrote {width}x{height} image to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,10 @@
-import turtle
+import argparse
 
-# Set up the screen
-screen = turtle.Screen()
-screen.title("Drawing with Turtles")
-screen.bgcolor("lightblue")
-screen.setup(width=800, height=600)
+from TurtleRecorder import RecordingTurtle
 
-# Create a turtle
-t = turtle.Turtle()
-t.speed(3)  # Set drawing speed (1=slow, 10=fast, 0=instant)
+SCREEN_WIDTH = 800
+SCREEN_HEIGHT = 600
+BACKGROUND = "lightblue"
 
 
 def draw_triangle(turtle_obj, x, y, size, color):
@@ -80,33 +76,83 @@ def write_text(turtle_obj, x, y, text, font_size=20, color="black"):
     turtle_obj.write(text, align="center", font=("Arial", font_size, "bold"))
 
 
-# Main drawing code
-print("Drawing with Turtles!")
-print("=" * 40)
-
-# Set turtle pen properties
-t.pensize(2)
-t.pencolor("black")
-
-# Draw a triangle
-print("Drawing triangle...")
-draw_triangle(t, -200, 100, 100, "red")
-
-# Draw a pentagon
-print("Drawing pentagon...")
-draw_pentagon(t, 100, 100, 80, "green")
+def draw_scene(turtle_obj):
+    """
+    Draw the demo picture: a triangle, a pentagon and two lines of text.
+    
+    Args:
+        turtle_obj: A turtle.Turtle or a RecordingTurtle
+    """
+    # Set turtle pen properties
+    turtle_obj.pensize(2)
+    turtle_obj.pencolor("black")
+    
+    # Draw a triangle
+    print("Drawing triangle...")
+    draw_triangle(turtle_obj, -200, 100, 100, "red")
+    
+    # Draw a pentagon
+    print("Drawing pentagon...")
+    draw_pentagon(turtle_obj, 100, 100, 80, "green")
+    
+    # Write some text
+    print("Writing text...")
+    turtle_obj.color("darkblue")
+    write_text(turtle_obj, 0, -150, "Welcome to Turtle Graphics!", font_size=24, color="darkblue")
+    write_text(turtle_obj, 0, -200, "Triangle & Pentagon", font_size=16, color="purple")
+    
+    # Hide the turtle when done
+    turtle_obj.hideturtle()
 
-# Write some text
-print("Writing text...")
-t.color("darkblue")
-write_text(t, 0, -150, "Welcome to Turtle Graphics!", font_size=24, color="darkblue")
-write_text(t, 0, -200, "Triangle & Pentagon", font_size=16, color="purple")
 
-# Hide the turtle when done
-t.hideturtle()
+def open_screen():
+    """Set up the turtle window and return (screen, turtle)."""
+    import turtle
+    
+    # Set up the screen
+    screen = turtle.Screen()
+    screen.title("Drawing with Turtles")
+    screen.bgcolor(BACKGROUND)
+    screen.setup(width=SCREEN_WIDTH, height=SCREEN_HEIGHT)
+    
+    # Create a turtle
+    t = turtle.Turtle()
+    t.speed(3)  # Set drawing speed (1=slow, 10=fast, 0=instant)
+    return screen, t
 
-print("\nDrawing complete!")
-print("Click on the window to close it.")
 
-# Keep the window open until clicked
-screen.exitonclick()
+# Main drawing code
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draw shapes and text with turtle graphics.")
+    parser.add_argument('--instant', action='store_true',
+                        help="Record the drawing first and show it in one screen update")
+    parser.add_argument('--export', metavar='PATH',
+                        help="Save the drawing to an .svg or .png file without opening a window")
+    args = parser.parse_args()
+    
+    print("Drawing with Turtles!")
+    print("=" * 40)
+    
+    if args.export or args.instant:
+        recorder = RecordingTurtle()
+        draw_scene(recorder)
+    
+    if args.export:
+        if args.export.lower().endswith('.svg'):
+            recorder.save_svg(args.export, SCREEN_WIDTH, SCREEN_HEIGHT, BACKGROUND)
+        else:
+            recorder.save_png(args.export, SCREEN_WIDTH, SCREEN_HEIGHT, BACKGROUND)
+        print(f"\nDrawing saved to {args.export}")
+    else:
+        screen, t = open_screen()
+        if args.instant:
+            t.speed(0)
+            recorder.replay(t, screen)
+        else:
+            draw_scene(t)
+        
+        print("\nDrawing complete!")
+        print("Click on the window to close it.")
+        
+        # Keep the window open until clicked
+        screen.exitonclick()
@@ -0,0 +1,346 @@
+import math
+from array import array
+
+
+def _color_name(color):
+    """Return a turtle color as a string, converting (r, g, b) tuples to hex."""
+    if isinstance(color, str):
+        return color
+    r, g, b = color[:3]
+    if max(r, g, b) <= 1:
+        r, g, b = r * 255, g * 255, b * 255
+    return f"#{int(r):02x}{int(g):02x}{int(b):02x}"
+
+
+class TurtleRecording:
+    """
+    A compact buffer of turtle commands.
+
+    Each command is stored as an opcode and an argument count in a byte
+    array, with numeric arguments in a float array and strings in a
+    shared string table, so long drawings take little memory.
+    """
+
+    OPS = ('penup', 'pendown', 'goto', 'forward', 'left', 'right', 'setheading',
+           'pencolor', 'fillcolor', 'pensize', 'begin_fill', 'end_fill', 'write',
+           'hideturtle', 'showturtle')
+
+    def __init__(self):
+        """Initialize an empty TurtleRecording."""
+        self.ops = array('B')
+        self.arg_counts = array('B')
+        self.arg_is_string = array('B')
+        self.args = array('d')
+        self.strings = []
+        self._string_ids = {}
+
+    def append(self, op, *args):
+        """
+        Add a command to the buffer.
+
+        Args:
+            op: Name of the command, one of OPS
+            args: Numbers and strings passed to the command
+        """
+        self.ops.append(self.OPS.index(op))
+        self.arg_counts.append(len(args))
+        for arg in args:
+            if isinstance(arg, str):
+                string_id = self._string_ids.get(arg)
+                if string_id is None:
+                    string_id = len(self.strings)
+                    self._string_ids[arg] = string_id
+                    self.strings.append(arg)
+                self.arg_is_string.append(1)
+                self.args.append(string_id)
+            else:
+                self.arg_is_string.append(0)
+                self.args.append(arg)
+
+    def __iter__(self):
+        """Yield (op, args) tuples in recording order."""
+        position = 0
+        for op, count in zip(self.ops, self.arg_counts):
+            args = []
+            for i in range(position, position + count):
+                value = self.args[i]
+                args.append(self.strings[int(value)] if self.arg_is_string[i] else value)
+            position += count
+            yield self.OPS[op], args
+
+    def __len__(self):
+        return len(self.ops)
+
+
+class RecordingTurtle:
+    """
+    A stand-in for turtle.Turtle that records commands instead of drawing.
+
+    It supports the turtle methods used in Turtle.py and keeps track of
+    position and heading itself, so no Tk window is needed. A recording
+    can be replayed onto a real turtle with screen updates batched, or
+    exported straight to SVG or PNG.
+    """
+
+    def __init__(self):
+        """Initialize a RecordingTurtle at the origin, facing east."""
+        self.recording = TurtleRecording()
+
+    def _record(self, op, *args):
+        self.recording.append(op, *args)
+
+    def penup(self):
+        self._record('penup')
+
+    def pendown(self):
+        self._record('pendown')
+
+    def goto(self, x, y):
+        self._record('goto', x, y)
+
+    def forward(self, distance):
+        self._record('forward', distance)
+
+    def left(self, angle):
+        self._record('left', angle)
+
+    def right(self, angle):
+        self._record('right', angle)
+
+    def setheading(self, angle):
+        self._record('setheading', angle)
+
+    def pencolor(self, color):
+        self._record('pencolor', _color_name(color))
+
+    def fillcolor(self, color):
+        self._record('fillcolor', _color_name(color))
+
+    def color(self, pen, fill=None):
+        """Set the pen color and the fill color (both to pen if fill is omitted)."""
+        self.pencolor(pen)
+        self.fillcolor(pen if fill is None else fill)
+
+    def pensize(self, width):
+        self._record('pensize', width)
+
+    def begin_fill(self):
+        self._record('begin_fill')
+
+    def end_fill(self):
+        self._record('end_fill')
+
+    def write(self, text, move=False, align='left', font=('Arial', 8, 'normal')):
+        family, size, style = font
+        self._record('write', str(text), align, family, size, style)
+
+    def hideturtle(self):
+        self._record('hideturtle')
+
+    def showturtle(self):
+        self._record('showturtle')
+
+    def speed(self, speed=None):
+        """Speed has no effect on a recording."""
+
+    def replay(self, turtle_obj, screen=None, batch_size=None):
+        """
+        Replay the recorded commands onto a real turtle.
+
+        Screen updates are turned off while replaying and made in batches,
+        which is much faster than animating every segment.
+
+        Args:
+            turtle_obj: A turtle.Turtle to draw with
+            screen: The turtle.Screen to batch updates on (default: None)
+            batch_size: Update the screen every this many commands
+                (default: only once at the end)
+        """
+        if screen is not None:
+            screen.tracer(0)
+        for i, (op, args) in enumerate(self.recording, 1):
+            if op == 'write':
+                text, align, family, size, style = args
+                turtle_obj.write(text, align=align, font=(family, int(size), style))
+            else:
+                getattr(turtle_obj, op)(*args)
+            if screen is not None and batch_size and i % batch_size == 0:
+                screen.update()
+        if screen is not None:
+            screen.update()
+
+    def to_items(self):
+        """
+        Work out what the recording draws.
+
+        Returns:
+            A list of drawing items in painting order:
+            ('fill', points, color), ('line', points, color, width) and
+            ('text', x, y, text, color, align, family, size, style)
+        """
+        builder = _ItemBuilder()
+        for op, args in self.recording:
+            getattr(builder, op)(*args)
+        builder.finish_line()
+        return builder.items
+
+    def save_svg(self, path, width=800, height=600, bgcolor='white'):
+        """
+        Write the drawing to an SVG file without opening a window.
+
+        Args:
+            path: File path to write to
+            width: Width of the screen in pixels (default: 800)
+            height: Height of the screen in pixels (default: 600)
+            bgcolor: Background color (default: 'white')
+        """
+        from xml.sax.saxutils import escape, quoteattr
+
+        def point(x, y):
+            return f"{x + width / 2:.2f},{height / 2 - y:.2f}"
+
+        anchors = {'left': 'start', 'center': 'middle', 'right': 'end'}
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">\n')
+            f.write(f'<rect width="100%" height="100%" fill={quoteattr(bgcolor)}/>\n')
+            for item in self.to_items():
+                if item[0] == 'fill':
+                    points = ' '.join(point(x, y) for x, y in item[1])
+                    f.write(f'<polygon points="{points}" fill={quoteattr(item[2])}/>\n')
+                elif item[0] == 'line':
+                    points = ' '.join(point(x, y) for x, y in item[1])
+                    f.write(f'<polyline points="{points}" fill="none" stroke={quoteattr(item[2])} '
+                            f'stroke-width="{item[3]}" stroke-linecap="round" stroke-linejoin="round"/>\n')
+                else:
+                    _, x, y, text, color, align, family, size, style = item
+                    weight = ' font-weight="bold"' if 'bold' in style else ''
+                    italic = ' font-style="italic"' if 'italic' in style else ''
+                    sx, sy = point(x, y).split(',')
+                    f.write(f'<text x="{sx}" y="{sy}" fill={quoteattr(color)} '
+                            f'font-family={quoteattr(family)} font-size="{size}pt"{weight}{italic} '
+                            f'text-anchor="{anchors.get(align, "start")}">{escape(text)}</text>\n')
+            f.write('</svg>\n')
+
+    def save_png(self, path, width=800, height=600, bgcolor='white', dpi=100):
+        """
+        Write the drawing to a PNG file with matplotlib's Agg canvas,
+        without pyplot or a window.
+
+        Args:
+            path: File path to write to
+            width: Width of the screen in pixels (default: 800)
+            height: Height of the screen in pixels (default: 600)
+            bgcolor: Background color (default: 'white')
+            dpi: Resolution of the PNG (default: 100, one pixel per turtle unit)
+        """
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        from matplotlib.lines import Line2D
+        from matplotlib.patches import Polygon
+
+        fig = Figure(figsize=(width / 100, height / 100), dpi=dpi, facecolor=bgcolor)
+        FigureCanvasAgg(fig)
+        ax = fig.add_axes((0, 0, 1, 1))
+        ax.set_xlim(-width / 2, width / 2)
+        ax.set_ylim(-height / 2, height / 2)
+        ax.axis('off')
+        points_per_pixel = 72 / 100
+        for item in self.to_items():
+            if item[0] == 'fill':
+                ax.add_patch(Polygon(item[1], closed=True, facecolor=item[2], edgecolor='none'))
+            elif item[0] == 'line':
+                xs, ys = zip(*item[1])
+                ax.add_line(Line2D(xs, ys, color=item[2], linewidth=item[3] * points_per_pixel,
+                                   solid_capstyle='round', solid_joinstyle='round'))
+            else:
+                _, x, y, text, color, align, family, size, style = item
+                ax.text(x, y, text, color=color, ha=align, va='baseline', family=family,
+                        fontsize=size, weight='bold' if 'bold' in style else 'normal',
+                        style='italic' if 'italic' in style else 'normal')
+        fig.savefig(path, dpi=dpi, facecolor=bgcolor)
+
+
+class _ItemBuilder:
+    """Turns turtle commands into lines, fills and text (see RecordingTurtle.to_items)."""
+
+    def __init__(self):
+        self.x = 0.0
+        self.y = 0.0
+        self.heading = 0.0
+        self.pen_down = True
+        self.pen_color = 'black'
+        self.fill_color = 'black'
+        self.width = 1
+        self.items = []
+        self._line = None
+        self._fill = None
+        self._fill_index = None
+
+    def finish_line(self):
+        if self._line is not None and len(self._line) > 1:
+            self.items.append(('line', self._line, self.pen_color, self.width))
+        self._line = None
+
+    def _move(self, x, y):
+        if self.pen_down:
+            if self._line is None:
+                self._line = [(self.x, self.y)]
+            self._line.append((x, y))
+        self.x, self.y = x, y
+        if self._fill is not None:
+            self._fill.append((x, y))
+
+    def penup(self):
+        self.finish_line()
+        self.pen_down = False
+
+    def pendown(self):
+        self.pen_down = True
+
+    def goto(self, x, y):
+        self._move(x, y)
+
+    def forward(self, distance):
+        angle = math.radians(self.heading)
+        self._move(self.x + distance * math.cos(angle), self.y + distance * math.sin(angle))
+
+    def left(self, angle):
+        self.heading = (self.heading + angle) % 360
+
+    def right(self, angle):
+        self.heading = (self.heading - angle) % 360
+
+    def setheading(self, angle):
+        self.heading = angle % 360
+
+    def pencolor(self, color):
+        self.finish_line()
+        self.pen_color = color
+
+    def fillcolor(self, color):
+        self.fill_color = color
+
+    def pensize(self, width):
+        self.finish_line()
+        self.width = width
+
+    def begin_fill(self):
+        # Like turtle, the fill is painted underneath the lines drawn after it
+        self.finish_line()
+        self._fill = [(self.x, self.y)]
+        self._fill_index = len(self.items)
+
+    def end_fill(self):
+        self.finish_line()
+        if self._fill is not None and len(self._fill) > 2:
+            self.items.insert(self._fill_index, ('fill', self._fill, self.fill_color))
+        self._fill = None
+
+    def write(self, text, align, family, size, style):
+        self.items.append(('text', self.x, self.y, text, self.pen_color, align, family, size, style))
+
+    def hideturtle(self):
+        pass
+
+    def showturtle(self):
+        pass